@@ -6,6 +6,8 @@ import numpy as np
 from numpy import sqrt
 from pandas import DataFrame
 from numpy import ndarray
+from .ProfileEncoder import ProfileEncoder, EncodedProfiles
+from .ProfileEncoder import _detect_category_index, _as_object_array
 
 
 class GeneralDistanceWrapper(object):
@@ -34,64 +36,66 @@ class GeneralDistanceWrapper(object):
 
     def __init__(self, category_index=None, null_val=0.5):
         self._cat_idx = category_index
+        self._encoder = None
+        self._projection_cache = None
+        self._encoding_cache = None
         self.load_weights()
         self._null_val = null_val
 
     def fit(self, x):
-        """ automate the detection of categoricay variables
+        """ automate the detection of categoricay variables and fit the
+            encoder of profiles, profiles encoded before must be encoded
+            again
         """
-        # cat_data_types = [bool, str, object]
-        null_val_symbols = [np.nan, None, 'nan', 'null', 'None', 'N/A', '']
-        category_dtypes = [str, bool, object, np.str_]
-
-        def return_nonull_values(x):
-            nonull_idx = [ii for ii, val in enumerate(x) \
-                          if not (val in null_val_symbols)]
-            return [x[idx] for idx in nonull_idx]
-
-        def detect_num_vs_cat(val):
-            try:
-                float(val)
-                return False
-            except:
-                return True
-
         if isinstance(x, list):
+            def detect_num_vs_cat(val):
+                try:
+                    float(val)
+                    return False
+                except:
+                    return True
             cat_idx = [ii for ii, val in enumerate(x) if detect_num_vs_cat(val)]
 
         if isinstance(x, ndarray):
-            _, n_feats = x.shape
-            cat_idx = []
-            for ii in range(n_feats):
-                col_vals = x[:, ii]
-                col_vals = return_nonull_values(col_vals)
-                if len(col_vals) > 0:
-                    val = col_vals[0]
-                    if detect_num_vs_cat(val):
-                        cat_idx.append(ii)
+            cat_idx = _detect_category_index(x)
 
         if isinstance(x, DataFrame):
-            _, n_feats = x.shape
-            cat_idx = []
-            for ii in range(n_feats):
-                col_vals = x[:, ii]
-                col_vals = return_nonull_values(col_vals)
-                if len(col_vals) > 0:
-                    val = col_vals[0]
-                    if detect_num_vs_cat(val):
-                        cat_idx.append(ii)
-
+            cat_idx = _detect_category_index(x.values)
             all_feat_names = x.columns
             cat_feat_names = [feat_name for ii, feat_name in enumerate(all_feat_names) if ii in cat_idx]
             self.set_features(all_feat_names=all_feat_names, cat_feat_names=cat_feat_names)
 
         self._cat_idx = cat_idx
+        self._reset_encoder()
+        self._encoder = ProfileEncoder(category_index=cat_idx)
+        self._encoder.fit(x.values if isinstance(x, DataFrame) else x)
 
+    def encode(self, x):
+        """ encode matrix-like profiles into EncodedProfiles with the
+            current category index, categorical codes are kept consistent
+            among all profiles encoded by the wrapper. the encoder is fitted
+            by fit(), or on x by the first encode() if the wrapper was not
+            fitted; it is never refitted here
+        """
+        if self._encoder is None:
+            self._encoder = ProfileEncoder(category_index=self._cat_idx)
+            self._encoder.fit(x)
+            self._cat_idx = self._encoder.get_category_index()
+        return self._encoder.transform(x)
+
+    def _reset_encoder(self):
+        """ drop the encoder after category index changed, profiles
+            encoded before must be encoded again
+        """
+        self._encoder = None
+        self._projection_cache = None
+        self._encoding_cache = None
 
     def set_features(self, all_feat_names, cat_feat_names):
         self._all_feat_names = all_feat_names
         self._cat_feat_names = cat_feat_names
         self._cat_idx = [ii for ii, feat in enumerate(all_feat_names) if feat in cat_feat_names]
+        self._reset_encoder()
 
     def load_weights(self, weights=None, normalize=False):
         if not weights is None:
@@ -105,7 +109,9 @@ class GeneralDistanceWrapper(object):
         self._weights = None
 
     def update_category_index(self, category_index):
+        """ set category index, profiles encoded before must be encoded again """
         self._cat_idx = category_index
+        self._reset_encoder()
 
     def get_category_index(self):
         return self._cat_idx
@@ -168,6 +174,231 @@ class GeneralDistanceWrapper(object):
             else:
                 raise ValueError("weights must be in same size with input vector (a, b)!")
 
+    def dist_euclidean_batch(self, a, b):
+        """ calculate the weighted euclidean distance between vector (a)
+        and every row of matrix (b) in a single vectorized pass. it follows
+        the semantics of dist_euclidean(): 0/1 difference for categorical
+        features and null_val for any comparison involving a null value.
+        only (a) is encoded per call: (b) may be given encoded, otherwise
+        its encoding is cached until another matrix is given, so a matrix
+        changed in place must be passed encoded or as a new object.
+
+        Parameters:
+        ----------
+        * a: <vector-like> profile of the query user
+        * b: <matrix-like or EncodedProfiles> (n, n_feats) profiles
+            compared with (a)
+
+        Returns:
+        -------
+        * dist: <numpy.ndarray> (n, ) distances between (a) and rows of (b)
+        """
+        encoded_b = self._encode_cached(b)
+        a = _as_object_array(a).ravel()
+        if len(a) != encoded_b.n_feats:
+            raise ValueError("vector (a) is in different size of vector (b)!")
+
+        encoded_a = self.encode(a)
+        return self._dist_encoded(encoded_a, [0], encoded_b, slice(None))
+
+    def _encode_cached(self, x):
+        """ return EncodedProfiles of x, the last encoded matrix is cached
+            until another one is given
+        """
+        if isinstance(x, EncodedProfiles):
+            return x
+        cache = self._encoding_cache
+        if cache is None or cache[0] is not x:
+            x_arr = _as_object_array(x)
+            if x_arr.ndim == 1:
+                x_arr = x_arr.reshape(1, -1)
+            self._encoding_cache = (x, self.encode(x_arr))
+        return self._encoding_cache[1]
+
+    def dist_euclidean_encoded(self, profiles, row, rows=None):
+        """ calculate the weighted euclidean distance between one encoded
+        profile and many others of the same EncodedProfiles
+
+        Parameters:
+        ----------
+        * profiles: <EncodedProfiles> output of .encode()
+        * row: <integer> row index of the query profile
+        * rows: <vector-like, integer> row indices to compare with,
+            all rows are compared if it is None
+
+        Returns:
+        -------
+        * dist: <numpy.ndarray> distances between (row) and (rows)
+        """
+        if rows is None:
+            rows = slice(None)
+        return self._dist_encoded(profiles, [row], profiles, rows)
+
+    def dist_euclidean_pairs(self, profiles, rows_a, rows_b):
+        """ calculate the weighted euclidean distance of every pair of
+        encoded profiles (rows_a[i], rows_b[i])
+
+        Parameters:
+        ----------
+        * profiles: <EncodedProfiles> output of .encode()
+        * rows_a: <vector-like, integer> row indices of first users
+        * rows_b: <vector-like, integer> row indices of second users
+
+        Returns:
+        -------
+        * dist: <numpy.ndarray> distances of the pairs
+        """
+        return self._dist_encoded(profiles, rows_a, profiles, rows_b)
+
+    def project(self, profiles):
+        """ return WeightedProfiles of encoded profiles under current weights,
+            the last projection is cached until weights or profiles change
+        """
+        weights_key = None if self._weights is None else tuple(self._weights)
+        cache = self._projection_cache
+        if cache is None or cache[0] is not profiles or cache[1] != weights_key:
+            num_weights, cat_weights = self._split_weights(profiles)
+            weighted = WeightedProfiles(profiles, num_weights, cat_weights, self._null_val)
+            self._projection_cache = (profiles, weights_key, weighted)
+        return self._projection_cache[2]
+
+    def dist_euclidean_block(self, profiles, rows_a=None, rows_b=None):
+        """ calculate the block of weighted euclidean distances between
+        every profile of rows_a and every profile of rows_b
+
+        Parameters:
+        ----------
+        * profiles: <EncodedProfiles> output of .encode()
+        * rows_a: <vector-like, integer> row indices, all rows if None
+        * rows_b: <vector-like, integer> row indices, all rows if None
+
+        Returns:
+        -------
+        * dist: <numpy.ndarray> (len(rows_a), len(rows_b)) distances
+        """
+        return self.project(profiles).dist_block(rows_a, rows_b)
+
+    def embed(self, profiles):
+        """ return euclidean embedding of encoded profiles under current
+        weights: numeric features are scaled by sqrt(weight), and levels of
+        categorical features are one-hot coded with sqrt(weight / 2). the
+        squared euclidean distance of two embedded profiles equals their
+        squared weighted distance if neither holds null values; null numeric
+        values are embedded at the column mean and null categorical values at
+        the origin, so distances involving nulls are approximated.
+
+        Parameters:
+        ----------
+        * profiles: <EncodedProfiles> output of .encode()
+
+        Returns:
+        -------
+        * embedded: <numpy.ndarray> (n, n_dims) float64 matrix
+        """
+        num_weights, cat_weights = self._split_weights(profiles)
+        num_values = profiles.num_values.copy()
+        if profiles.num_nulls.any():
+            n_valid = np.maximum((~profiles.num_nulls).sum(axis=0), 1)
+            col_means = num_values.sum(axis=0) / n_valid
+            num_values[profiles.num_nulls] = np.broadcast_to(col_means, num_values.shape)[profiles.num_nulls]
+        blocks = [num_values * np.sqrt(num_weights)]
+
+        for jj, weight in enumerate(cat_weights):
+            codes = profiles.cat_codes[:, jj]
+            n_levels = codes.max() + 1 if len(codes) > 0 else 0
+            one_hot = np.zeros((len(codes), max(n_levels, 0)))
+            is_valid = codes >= 0
+            one_hot[np.flatnonzero(is_valid), codes[is_valid]] = np.sqrt(weight / 2.0)
+            blocks.append(one_hot)
+        return np.hstack(blocks)
+
+    def _split_weights(self, profiles):
+        """ return weights of (numeric, categorical) features """
+        if self._weights is None:
+            weights = np.ones(profiles.n_feats)
+        else:
+            if len(self._weights) != profiles.n_feats:
+                raise ValueError("weights must be in same size with input vector (a, b)!")
+            weights = np.asarray(self._weights, dtype=np.float64)
+        return weights[profiles.num_idx], weights[profiles.cat_idx]
+
+    def _dist_encoded(self, profiles_a, rows_a, profiles_b, rows_b):
+        """ distances between rows_a of profiles_a and rows_b of profiles_b,
+            row selections are broadcast against each other
+        """
+        num_weights, cat_weights = self._split_weights(profiles_b)
+
+        num_diff = profiles_b.num_values[rows_b] - profiles_a.num_values[rows_a]
+        num_diff[profiles_b.num_nulls[rows_b] | profiles_a.num_nulls[rows_a]] = self._null_val
+        squared_dist = (num_diff * num_diff).dot(num_weights)
+
+        if len(cat_weights) > 0:
+            cat_diff = (profiles_b.cat_codes[rows_b] != profiles_a.cat_codes[rows_a]).astype(np.float64)
+            cat_diff[profiles_b.cat_nulls[rows_b] | profiles_a.cat_nulls[rows_a]] = self._null_val
+            squared_dist += (cat_diff * cat_diff).dot(cat_weights)
+
+        return sqrt(squared_dist)
+
+
+class WeightedProfiles(object):
+    """ encoded profiles projected under fixed feature weights. the numeric
+    part of a block of squared distances is factorized into one matrix
+    product of pre-computed left/right factors:
+
+        sum_f w_f * [ v_a * v_b * (a - b)^2 + (1 - v_a * v_b) * null_val^2 ]
+
+    where v is the non-null indicator and (a, b) are zero-filled at nulls.
+    categorical mismatches are compared code-wise on the block.
+    """
+
+    def __init__(self, profiles, num_weights, cat_weights, null_val=0.5):
+        null_sq = null_val * null_val
+        valid = (~profiles.num_nulls).astype(np.float64)
+        # center columns to limit cancellation of the expanded square
+        col_sums = profiles.num_values.sum(axis=0)
+        col_counts = np.maximum(valid.sum(axis=0), 1)
+        centered = (profiles.num_values - col_sums / col_counts) * valid
+        scaled = centered * np.sqrt(num_weights)
+        squared = scaled * scaled
+
+        self._left = np.ascontiguousarray(np.hstack([squared, valid, -2 * scaled,
+                                                     -null_sq * valid * num_weights]))
+        self._right = np.ascontiguousarray(np.hstack([valid, squared, scaled, valid]))
+        self._const = null_sq * num_weights.sum()
+
+        self._cat_codes = profiles.cat_codes
+        self._cat_nulls = profiles.cat_nulls
+        self._cat_weights = cat_weights
+        self._null_sq = null_sq
+
+    def __len__(self):
+        return self._left.shape[0]
+
+    def sq_dist_block(self, rows_a=None, rows_b=None):
+        """ return block of squared distances (len(rows_a), len(rows_b)) """
+        if rows_a is None:
+            rows_a = slice(None)
+        if rows_b is None:
+            rows_b = slice(None)
+
+        sq_dist = self._left[rows_a].dot(self._right[rows_b].T)
+        sq_dist += self._const
+
+        for jj, weight in enumerate(self._cat_weights):
+            if weight == 0:
+                continue
+            codes_a, codes_b = self._cat_codes[rows_a, jj], self._cat_codes[rows_b, jj]
+            nulls_a, nulls_b = self._cat_nulls[rows_a, jj], self._cat_nulls[rows_b, jj]
+            cat_diff = (codes_a[:, None] != codes_b[None, :]).astype(np.float64)
+            cat_diff[nulls_a[:, None] | nulls_b[None, :]] = self._null_sq
+            sq_dist += weight * cat_diff
+
+        return np.maximum(sq_dist, 0, out=sq_dist)
+
+    def dist_block(self, rows_a=None, rows_b=None):
+        """ return block of distances (len(rows_a), len(rows_b)) """
+        return sqrt(self.sq_dist_block(rows_a, rows_b))
+
 
 def _is_null_value(x):
     null_val_symbols = [np.nan, None, '', 'N/A']
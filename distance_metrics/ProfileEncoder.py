@@ -0,0 +1,197 @@
+""" Columnar encoding of user profiles mixing numeric and categorical features
+Author: Yi Zhang <beingzy@gmail.com>
+Date: 2016/05/20
+"""
+import numpy as np
+from numpy import ndarray
+from pandas import DataFrame, factorize
+
+
+class EncodedProfiles(object):
+    """ user profiles split into a contiguous float64 numeric block and an
+    int32-coded categorical block, each with its own null mask
+
+    Attributes:
+    ----------
+    * num_values: <numpy.ndarray, float64> (n, n_num), nulls are filled with 0
+    * num_nulls: <numpy.ndarray, bool> (n, n_num), True for null values
+    * cat_codes: <numpy.ndarray, int32> (n, n_cat), nulls are coded as -1
+    * cat_nulls: <numpy.ndarray, bool> (n, n_cat), True for null values
+    * num_idx: <numpy.ndarray, int> original positions of numeric features
+    * cat_idx: <numpy.ndarray, int> original positions of categorical features
+    """
+
+    def __init__(self, num_values, num_nulls, cat_codes, cat_nulls, num_idx, cat_idx):
+        self.num_values = np.ascontiguousarray(num_values, dtype=np.float64)
+        self.num_nulls = np.ascontiguousarray(num_nulls, dtype=bool)
+        self.cat_codes = np.ascontiguousarray(cat_codes, dtype=np.int32)
+        self.cat_nulls = np.ascontiguousarray(cat_nulls, dtype=bool)
+        self.num_idx = np.asarray(num_idx, dtype=np.intp)
+        self.cat_idx = np.asarray(cat_idx, dtype=np.intp)
+
+    def __len__(self):
+        return self.num_values.shape[0]
+
+    @property
+    def n_feats(self):
+        return len(self.num_idx) + len(self.cat_idx)
+
+    @property
+    def shape(self):
+        return (len(self), self.n_feats)
+
+    @property
+    def nbytes(self):
+        return (self.num_values.nbytes + self.num_nulls.nbytes +
+                self.cat_codes.nbytes + self.cat_nulls.nbytes)
+
+    def take(self, rows):
+        """ return EncodedProfiles of the selected rows """
+        return EncodedProfiles(self.num_values[rows], self.num_nulls[rows],
+                               self.cat_codes[rows], self.cat_nulls[rows],
+                               self.num_idx, self.cat_idx)
+
+
+class ProfileEncoder(object):
+    """ fit/transform stage converting matrix-like user profiles into
+    EncodedProfiles. categorical levels learned by the encoder are shared
+    by every transform() so the integer codes stay comparable.
+
+    Example:
+    --------
+    encoder = ProfileEncoder()
+    profiles = encoder.fit_transform(user_profiles)
+    profiles.num_values, profiles.cat_codes
+    """
+
+    def __init__(self, category_index=None):
+        self._cat_idx = category_index
+        self._n_feats = None
+        self._levels = []
+
+    def fit(self, x):
+        """ detect categorical features (if category_index is not given)
+            and learn the categorical levels
+        """
+        x = _as_object_array(x)
+        if x.ndim == 1:
+            x = x.reshape(1, -1)
+        if self._cat_idx is None:
+            self._cat_idx = _detect_category_index(x)
+        self._n_feats = x.shape[1]
+        self._levels = [{} for _ in self._cat_idx]
+        self.transform(x)
+        return self
+
+    def transform(self, x):
+        """ return EncodedProfiles of matrix-like x """
+        if self._n_feats is None:
+            raise ValueError("ProfileEncoder is not fitted yet, call .fit(x) first!")
+
+        x = _as_object_array(x)
+        if x.ndim == 1:
+            x = x.reshape(1, -1)
+        n_obs, n_feats = x.shape
+        if n_feats != self._n_feats:
+            raise ValueError("x (n_feats: {}) does not match fitted data (n_feats: {})!".format(
+                n_feats, self._n_feats))
+
+        is_cat = np.zeros(n_feats, dtype=bool)
+        is_cat[list(self._cat_idx)] = True
+        num_idx, cat_idx = np.flatnonzero(~is_cat), np.flatnonzero(is_cat)
+
+        num_block = x[:, num_idx]
+        num_nulls = _null_mask(num_block)
+        num_values = _fill_null(num_block, num_nulls)
+
+        cat_nulls = np.zeros((n_obs, len(cat_idx)), dtype=bool)
+        cat_codes = np.full((n_obs, len(cat_idx)), -1, dtype=np.int32)
+        for jj, idx in enumerate(cat_idx):
+            col_vals = x[:, idx]
+            cat_nulls[:, jj] = _null_mask(col_vals)
+            keep = ~cat_nulls[:, jj]
+            if keep.any():
+                cat_codes[keep, jj] = self._encode_levels(jj, col_vals[keep])
+
+        return EncodedProfiles(num_values, num_nulls, cat_codes, cat_nulls, num_idx, cat_idx)
+
+    def fit_transform(self, x):
+        return self.fit(x).transform(x)
+
+    def _encode_levels(self, jj, values):
+        """ map values of jj-th categorical feature to integer codes,
+            unseen levels are appended to the learned levels
+        """
+        local_codes, uniques = factorize(np.asarray(values, dtype=object))
+        levels = self._levels[jj]
+        mapping = np.empty(len(uniques), dtype=np.int32)
+        for ii, level in enumerate(uniques):
+            if not level in levels:
+                levels[level] = len(levels)
+            mapping[ii] = levels[level]
+        return mapping[local_codes]
+
+    def get_category_index(self):
+        return self._cat_idx
+
+    def get_levels(self):
+        """ return learned levels of categorical features, ordered by code """
+        return [list(levels.keys()) for levels in self._levels]
+
+
+def _detect_category_index(x):
+    """ automate the detection of categorical variables by the first
+        non-null value of every column
+    """
+    null_val_symbols = [np.nan, None, 'nan', 'null', 'None', 'N/A', '']
+
+    def detect_num_vs_cat(val):
+        try:
+            float(val)
+            return False
+        except:
+            return True
+
+    cat_idx = []
+    if x.dtype.kind in 'fiub':
+        # numeric arrays hold no categorical variables
+        return cat_idx
+
+    for ii in range(x.shape[1]):
+        # the first non-null value decides the type of the column
+        for val in x[:, ii]:
+            if not (val in null_val_symbols):
+                if detect_num_vs_cat(val):
+                    cat_idx.append(ii)
+                break
+    return cat_idx
+
+
+def _as_object_array(x):
+    """ convert vector/matrix-like input to numpy.ndarray without
+        casting mixed numeric/categorical values to strings
+    """
+    if isinstance(x, DataFrame):
+        return x.values
+    if isinstance(x, ndarray):
+        return x
+    return np.array(x, dtype=object)
+
+
+def _null_mask(x):
+    """ vectorized counterpart of _is_null_value() """
+    x = np.asarray(x)
+    if x.dtype.kind == 'f':
+        return np.isnan(x)
+    if x.dtype.kind in 'iub':
+        return np.zeros(x.shape, dtype=bool)
+    if x.dtype.kind in 'US':
+        return (x == '') | (x == 'N/A')
+    # object array, NaN is the only value unequal to itself
+    return (np.equal(x, None) | np.equal(x, '') | np.equal(x, 'N/A') |
+            np.not_equal(x, x))
+
+
+def _fill_null(x, null_mask, fill_val=0.0):
+    """ return float copy of x with null values replaced by fill_val """
+    return np.where(null_mask, fill_val, x).astype(np.float64)
@@ -1,3 +1,9 @@
 from .GeneralDistanceWrapper import GeneralDistanceWrapper
+from .GeneralDistanceWrapper import WeightedProfiles
+from .ProfileEncoder import ProfileEncoder
+from .ProfileEncoder import EncodedProfiles
 
-__all__ = ['GeneralDistanceWrapper']
\ No newline at end of file
+__all__ = ['GeneralDistanceWrapper',
+           'WeightedProfiles',
+           'ProfileEncoder',
+           'EncodedProfiles']
@@ -0,0 +1,100 @@
+""" unit-test for generalized distance wrapper
+Author: Yi Zhang <beingzy@gmail.com>
+Date: 2016/02/22
+"""
+import unittest
+import numpy as np
+from distance_metrics import GeneralDistanceWrapper
+
+
+class TestGeneralDistanceWrapper(unittest.TestCase):
+
+    def setUp(self):
+        self._profiles = np.array([[1, 2, 'a', 5.5, 'b'],
+                                   [4, 0, 'a', 2.1, 'c'],
+                                   [0, None, 'b', 1.0, 'b'],
+                                   [2, 3, '', np.nan, 'c']], dtype=object)
+        self._dist_wrapper = GeneralDistanceWrapper()
+        self._dist_wrapper.update_category_index([2, 4])
+
+    def test_batch_match_pairwise(self):
+        """ test dist_euclidean_batch agrees with dist_euclidean """
+        a = self._profiles[0, :]
+        batch_dist = self._dist_wrapper.dist_euclidean_batch(a, self._profiles)
+        pair_dist = [self._dist_wrapper.dist_euclidean(a, b) for b in self._profiles]
+        self.assertTrue(np.allclose(batch_dist, pair_dist))
+
+    def test_batch_weighted(self):
+        """ test dist_euclidean_batch with weights """
+        self._dist_wrapper.load_weights([1, 1, 1, 0, 0])
+        a = self._profiles[1, :]
+        batch_dist = self._dist_wrapper.dist_euclidean_batch(a, self._profiles)
+        pair_dist = [self._dist_wrapper.dist_euclidean(a, b) for b in self._profiles]
+        self.assertTrue(np.allclose(batch_dist, pair_dist))
+
+    def test_encoded_match_pairwise(self):
+        """ test dist_euclidean_encoded agrees with dist_euclidean """
+        self._dist_wrapper.load_weights([1, 0.5, 2, 1, 1])
+        encoded = self._dist_wrapper.encode(self._profiles)
+        encoded_dist = self._dist_wrapper.dist_euclidean_encoded(encoded, 3, [0, 1, 2])
+        pair_dist = [self._dist_wrapper.dist_euclidean(self._profiles[3, :], b) for b in self._profiles[:3]]
+        self.assertTrue(np.allclose(encoded_dist, pair_dist))
+
+    def test_block_match_pairwise(self):
+        """ test dist_euclidean_block agrees with dist_euclidean """
+        self._dist_wrapper.load_weights([1, 0.5, 2, 1, 1])
+        encoded = self._dist_wrapper.encode(self._profiles)
+        block_dist = self._dist_wrapper.dist_euclidean_block(encoded)
+        pair_dist = [[self._dist_wrapper.dist_euclidean(a, b) for b in self._profiles]
+                     for a in self._profiles]
+        self.assertTrue(np.allclose(block_dist, pair_dist))
+
+    def test_encode_never_refits(self):
+        """ test encode() keeps the fitted encoder, category index changes
+            drop it explicitly
+        """
+        dist_wrapper = GeneralDistanceWrapper()
+        dist_wrapper.fit(self._profiles)
+        encoded = dist_wrapper.encode(self._profiles)
+        encoded_tail = dist_wrapper.encode(self._profiles[2:, :])
+        self.assertTrue(np.array_equal(encoded_tail.cat_codes, encoded.cat_codes[2:]))
+        self.assertEqual(list(dist_wrapper.get_category_index()), [2, 4])
+
+        dist_wrapper.update_category_index([2, 4])
+        self.assertIsNone(dist_wrapper._encoder)
+        self.assertEqual(list(dist_wrapper.encode(self._profiles).cat_idx), [2, 4])
+
+    def test_batch_encodes_catalog_once(self):
+        """ test dist_euclidean_batch encodes only the query row once the
+            compared matrix is encoded
+        """
+        encode = self._dist_wrapper.encode
+        encoded_rows = []
+
+        def recording_encode(x):
+            encoded = encode(x)
+            encoded_rows.append(len(encoded))
+            return encoded
+        self._dist_wrapper.encode = recording_encode
+
+        pair_dist = [[self._dist_wrapper.dist_euclidean(a, b) for b in self._profiles]
+                     for a in self._profiles]
+        batch_dist = [self._dist_wrapper.dist_euclidean_batch(a, self._profiles) for a in self._profiles]
+        self.assertTrue(np.allclose(batch_dist, pair_dist))
+        self.assertEqual(encoded_rows, [4, 1, 1, 1, 1])
+
+        # encoded profiles are compared as given
+        encoded = encode(self._profiles)
+        del encoded_rows[:]
+        batch_dist = [self._dist_wrapper.dist_euclidean_batch(a, encoded) for a in self._profiles]
+        self.assertTrue(np.allclose(batch_dist, pair_dist))
+        self.assertEqual(encoded_rows, [1, 1, 1, 1])
+
+    def test_batch_bad_weights(self):
+        self._dist_wrapper.load_weights([1, 1])
+        with self.assertRaises(ValueError):
+            self._dist_wrapper.dist_euclidean_batch(self._profiles[0, :], self._profiles)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+""" unit-test for columnar profile encoder
+Author: Yi Zhang <beingzy@gmail.com>
+Date: 2016/05/20
+"""
+import unittest
+import numpy as np
+from distance_metrics import ProfileEncoder
+
+
+class TestProfileEncoder(unittest.TestCase):
+
+    def setUp(self):
+        self._profiles = np.array([[1, 2, 'a', 5.5, 'b'],
+                                   [4, 0, 'a', 2.1, 'c'],
+                                   [0, None, 'b', 1.0, 'b'],
+                                   [2, 3, '', np.nan, 'c']], dtype=object)
+        self._encoder = ProfileEncoder()
+        self._encoded = self._encoder.fit_transform(self._profiles)
+
+    def test_detect_category_index(self):
+        self.assertEqual(self._encoder.get_category_index(), [2, 4])
+
+    def test_blocks(self):
+        encoded = self._encoded
+        self.assertEqual(encoded.shape, (4, 5))
+        self.assertEqual(encoded.num_values.dtype, np.float64)
+        self.assertEqual(encoded.cat_codes.dtype, np.int32)
+        self.assertTrue(encoded.num_values.flags['C_CONTIGUOUS'])
+        self.assertEqual(encoded.num_nulls.sum(), 2)
+        self.assertEqual(encoded.cat_codes[3, 0], -1)
+        self.assertEqual(encoded.cat_codes[0, 0], encoded.cat_codes[1, 0])
+
+    def test_transform_keep_codes(self):
+        encoded = self._encoder.transform(np.array([[1, 2, 'b', 1.0, 'd']], dtype=object))
+        self.assertEqual(encoded.cat_codes[0, 0], self._encoded.cat_codes[2, 0])
+        self.assertEqual(encoded.cat_codes[0, 1], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
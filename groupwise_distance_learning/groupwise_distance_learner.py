@@ -5,17 +5,25 @@ Date: 2016/MM/DD
 import numpy as np
 from numpy.random import choice
 from pandas import DataFrame
-from networkx import Graph
 from math import floor
 from datetime import datetime
 from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
 
-from .util_functions import user_grouped_dist
-from .util_functions import user_dist_kstest
 from .util_functions import ldm_train_with_list
-from .util_functions import find_fit_group
+from .util_functions import NonFriendSampler
+from .util_functions import UserAdjacency
+from .util_functions import ShardedFitTester
 from .util_functions import zipf
 
+# group labels of users outside fit groups: users of buffer group, users
+# failing the tests with their group's distance metrics and users absent
+# from a solution
+_BUFFER = -1
+_UNFIT = -2
+_ABSENT = -3
+
 
 def _init_dict_list(k):
     """ create dictionary with k items, each
@@ -72,29 +80,51 @@ def _validate_user_information(user_ids, user_profiles, user_connections):
 
 
 def _update_groupwise_dist(dist_metrics, fit_group, user_ids, user_profiles, user_connections,
-                           min_group_size=5, random_state=None):
-    """ learning gruopwise distnace metrics """
+                           min_group_size=5, random_state=None, executor=None):
+    """ learning gruopwise distnace metrics
+
+    Parameters:
+    ----------
+    executor: concurrent.futures.Executor, optional
+        groups' ldm() trainings are submitted to executor and run
+        concurrently, one after another in this process if None.
+        weights are collected in the order of groups either way
+    """
     n_feat = user_profiles.shape[1]
     # create data container
     new_dist_metrics = dist_metrics.copy()
 
-    for gg, gg_user_ids in fit_group.items():
-        # ldm() optimized distance metrics - weights
-        # for selected users
-        if len(gg_user_ids) > min_group_size:
-            single_dist_weights = ldm_train_with_list(gg_user_ids, user_ids, user_profiles, user_connections)
-            new_dist_metrics[gg] = single_dist_weights
-        else:
-            if not gg in new_dist_metrics:
-                # intialize default distance metrics weights
-                new_dist_metrics[gg] = [1] * n_feat
+    # ldm() optimized distance metrics - weights
+    # for selected users
+    trained_groups = [gg for gg, gg_user_ids in fit_group.items() if len(gg_user_ids) > min_group_size]
+    if executor is None:
+        trained_weights = [ldm_train_with_list(fit_group[gg], user_ids, user_profiles, user_connections)
+                           for gg in trained_groups]
+    else:
+        futures = [executor.submit(ldm_train_with_list, fit_group[gg], user_ids, user_profiles, user_connections)
+                   for gg in trained_groups]
+        trained_weights = [future.result() for future in futures]
+    new_dist_metrics.update(zip(trained_groups, trained_weights))
+
+    for gg in fit_group.keys():
+        if not gg in new_dist_metrics:
+            # intialize default distance metrics weights
+            new_dist_metrics[gg] = [1] * n_feat
     return new_dist_metrics
 
 
+def _n_workers(n_jobs):
+    """ return number of worker processes of n_jobs, all cores if -1 """
+    if n_jobs is None or n_jobs < 0:
+        return cpu_count()
+    return n_jobs
+
+
 def _update_fit_group_with_groupwise_dist(dist_matrics,
                                           fit_group, fit_pvals,
                                           user_ids, user_profiles, user_connections,
-                                          ks_alpha=0.05):
+                                          ks_alpha=0.05, test_user_ids=None, sampler=None,
+                                          user_adjacency=None, fit_tester=None):
     """ return fit_group, fit_pvals, unfit_group by updating members in fit_group
     with distance metrics unfit member will be sent to unfit group.
     (fit_group, fit_pvals, unfit_group)
@@ -113,112 +143,180 @@ def _update_fit_group_with_groupwise_dist(dist_matrics,
 
     ks_alpha: float, default value = 0.05
 
+    test_user_ids: set, optional
+        only these members are tested, others keep their p-values.
+        all members are tested if None
+
+    sampler: NonFriendSampler, optional
+        draws non-friends compared with members, all non-friends if None
+
+    user_adjacency: UserAdjacency, optional
+        adjacency of user_connections, built from them if None
+
+    fit_tester: ShardedFitTester, optional
+        runs members' ks-tests in shards, in one batch if None
+
     Returns:
     -------
     fit_group, fit_pvals, unfit_group
     """
 
-    fit_group = _convert_array_to_list(fit_group)
-    fit_pvals = _convert_array_to_list(fit_pvals)
+    if user_adjacency is None:
+        user_adjacency = UserAdjacency(user_ids, user_connections)
+    groups = list(dist_matrics.keys())
+    weights = _group_weights(dist_matrics, groups)
+    labels, pvals = _group_labels(fit_group, fit_pvals, groups, user_adjacency.user_index)
 
-    user_graph = Graph()
-    user_graph.add_edges_from(user_connections)
+    tested_mask = None
+    if not test_user_ids is None:
+        tested_mask = _user_mask(user_ids, test_user_ids)
+    unfit_from = _update_fit_labels(weights, labels, pvals, user_ids, user_profiles, user_adjacency,
+                                    ks_alpha, tested_mask, sampler, fit_tester)
 
-    # create container
-    fit_group_copy = fit_group.copy()
+    _, fit_group, fit_pvals, _ = _solution_dicts(weights, labels, pvals, groups, user_ids)
     unfit_group = {}
+    for row in np.flatnonzero(labels == _UNFIT):
+        unfit_group.setdefault(groups[unfit_from[row]], []).append(user_ids[row])
+    return fit_group, fit_pvals, unfit_group
 
-    for gg, gg_user_ids in fit_group_copy.items():
-        gg_dist = dist_matrics[gg]
-
-        for ii, ii_user_id in enumerate(gg_user_ids):
-            sim_dist, diff_dist = user_grouped_dist(ii_user_id, gg_dist, user_ids, user_profiles,  user_graph)
-            ii_pval = user_dist_kstest(sim_dist, diff_dist)
-
-            if ii_pval < ks_alpha:
-                # remove the user from fit group, retreive [0] to ensure slice is integer
-                idx = [idx for idx, uid in enumerate(fit_group[gg]) if uid == ii_user_id][0]
-                # fit_group[gg].remove(idx)
-                del fit_group[gg][idx]
-                # fit_pvals[gg].remove(idx)
-                del fit_pvals[gg][idx]
-                # add the user into unfit group
-                if gg in unfit_group:
-                    unfit_group[gg].append(ii_user_id)
-                else:
-                    unfit_group[gg] = [ii_user_id]
-            else:
-                # update pvalue for user, retreive [0] to ensure slice is integer
-                idx = [idx for idx, uid in enumerate(fit_group[gg]) if uid == ii_user_id][0]
-                fit_pvals[gg][idx] = ii_pval
 
-    return fit_group, fit_pvals, unfit_group
+def _update_fit_labels(weights, labels, pvals, user_ids, user_profiles, user_adjacency,
+                       ks_alpha=0.05, tested_mask=None, sampler=None, fit_tester=None):
+    """ re-test members of groups with their group's distance metrics,
+        labels and pvals are updated in place. members failing ks-tests are
+        labeled _UNFIT. it returns int32 array of the group left by every
+        unfit member, -1 for others.
+
+    Parameters:
+    ----------
+    weights: numpy.ndarray, (n_group x n_feat) distance metrics weights
+
+    labels: numpy.ndarray, int32 group (row of weights) of every user,
+        _BUFFER for users of buffer group
+
+    pvals: numpy.ndarray, p-value of every user
+
+    tested_mask: numpy.ndarray, optional
+        boolean mask of users re-tested, others keep their p-values.
+        all members are tested if None
+    """
+    if fit_tester is None:
+        fit_tester = ShardedFitTester()
+
+    # ks-tests of all tested members of all groups are run at once,
+    # every member is tested with its group's distance metrics
+    is_tested = labels >= 0
+    if not tested_mask is None:
+        is_tested &= tested_mask
+    tested_rows = np.flatnonzero(is_tested)
+    _, tested_pvals = fit_tester.best_fits(tested_rows, weights, labels[tested_rows, np.newaxis],
+                                           user_ids, user_profiles, user_adjacency,
+                                           user_adjacency.user_index, sampler)
+    pvals[tested_rows] = tested_pvals
+
+    unfit_from = np.full(len(labels), _BUFFER, dtype=np.int32)
+    is_unfit = (labels >= 0) & (pvals < ks_alpha)
+    unfit_from[is_unfit] = labels[is_unfit]
+    labels[is_unfit] = _UNFIT
+    pvals[is_unfit] = np.nan
+    return unfit_from
 
 
 def _update_buffer_group(dist_metrics, fit_group, fit_pvals, buffer_group,
-                         user_ids, user_profiles, user_connections, ks_alpha=0.05):
+                         user_ids, user_profiles, user_connections, ks_alpha=0.05, sampler=None,
+                         user_adjacency=None, fit_tester=None):
     """ return fit_group, fit_pvals, buffer_group
         redistribute member in buffer group into fit_group if fit had been found
     """
-    # to keep API consistant
-    # restore user_profiles to DataFrame including
-    user_graph = Graph()
-    user_graph.add_edges_from(user_connections)
-
-    buffer_group_copy = buffer_group.copy()
-    if len(buffer_group_copy) > 0:
-        for ii, ii_user_id in enumerate(buffer_group_copy):
-            ii_new_group, ii_new_pval = find_fit_group(ii_user_id, dist_metrics,
-                                                       user_ids, user_profiles, user_graph, ks_alpha,
-                                                       current_group=None, fit_rayleigh=False)
-            if not ii_new_group is None:
-                # remove member with fit from buffer_group
-                buffer_group.remove(ii_user_id)
-                if ii_new_group in fit_group:
-                    fit_group[ii_new_group].append(ii_user_id)
-                    fit_pvals[ii_new_group].append(ii_new_pval)
-                else:
-                    fit_group[ii_new_group] = [ii_user_id]
-                    fit_pvals[ii_new_group] = [ii_new_pval]
-
+    if user_adjacency is None:
+        user_adjacency = UserAdjacency(user_ids, user_connections)
+    groups = list(dist_metrics.keys())
+    weights = _group_weights(dist_metrics, groups)
+    labels, pvals = _group_labels(fit_group, fit_pvals, groups, user_adjacency.user_index, buffer_group)
+
+    _update_buffer_labels(weights, labels, pvals, user_ids, user_profiles, user_adjacency,
+                          ks_alpha, None, sampler, fit_tester)
+    _, fit_group, fit_pvals, buffer_group = _solution_dicts(weights, labels, pvals, groups, user_ids)
     return fit_group, fit_pvals, buffer_group
 
 
+def _update_buffer_labels(weights, labels, pvals, user_ids, user_profiles, user_adjacency,
+                          ks_alpha=0.05, tested_mask=None, sampler=None, fit_tester=None):
+    """ move users of buffer group into the group fitting them best,
+        labels and pvals are updated in place. only users of tested_mask
+        are tested if given
+    """
+    is_tested = labels == _BUFFER
+    if not tested_mask is None:
+        is_tested &= tested_mask
+    buffer_rows = np.flatnonzero(is_tested)
+    _move_to_fit_groups(buffer_rows, None, weights, labels, pvals, user_ids, user_profiles,
+                        user_adjacency, ks_alpha, sampler, fit_tester)
+
+
 def _update_unfit_groups_with_crossgroup_dist(dist_metrics, fit_group, fit_pvals, unfit_group, buffer_group,
-                                              user_ids, user_profiles, user_connections, ks_alpha=0.05):
+                                              user_ids, user_profiles, user_connections, ks_alpha=0.05,
+                                              sampler=None, user_adjacency=None, fit_tester=None):
     """ update members in unfit_group with cross-group distance. unfit members are kept in buffer_group
     """
-    # to keep API consistant
-    # restore user_profiles to DataFrame including
-    user_graph = Graph()
-    user_graph.add_edges_from(user_connections)
-
-    unfit_group_copy = unfit_group.copy()
-    for gg, gg_user_ids in unfit_group_copy.items():
-        # extract cross-group distance metrics dictionary to avoid duplicate
-        # tests with distance metrics associated with user's group
-        other_group_keys = [group_key for group_key in dist_metrics.keys() if not group_key == gg]
-        cross_group_dist_metrics = {key: dist_metrics[key] for key in other_group_keys}
-
-        for ii, ii_user_id in enumerate(gg_user_ids):
-            ii_new_group, ii_new_pval = find_fit_group(ii_user_id, cross_group_dist_metrics,
-                                                       user_ids, user_profiles, user_graph, ks_alpha,
-                                                       current_group=None, fit_rayleigh=False)
-            # redistribute the user based on fit-tests
-            if not ii_new_group is None:
-                # remove member with fit from buffer_group
-                if ii_new_group in fit_group:
-                    fit_group[ii_new_group].append(ii_user_id)
-                    fit_pvals[ii_new_group].append(ii_new_pval)
-                else:
-                    fit_group[ii_new_group] = [ii_user_id]
-                    fit_pvals[ii_new_group] = [ii_new_pval]
-            else:
-                buffer_group.append(ii_user_id)
-
+    if user_adjacency is None:
+        user_adjacency = UserAdjacency(user_ids, user_connections)
+    user_index = user_adjacency.user_index
+    groups = list(dist_metrics.keys())
+    weights = _group_weights(dist_metrics, groups)
+    labels, pvals = _group_labels(fit_group, fit_pvals, groups, user_index, buffer_group)
+
+    unfit_from = np.full(len(labels), _BUFFER, dtype=np.int32)
+    for gg, gg_user_ids in unfit_group.items():
+        rows = [user_index[uid] for uid in gg_user_ids]
+        labels[rows] = _UNFIT
+        unfit_from[rows] = groups.index(gg) if gg in groups else _BUFFER
+
+    _update_unfit_labels(weights, labels, pvals, unfit_from, user_ids, user_profiles, user_adjacency,
+                         ks_alpha, sampler, fit_tester)
+    _, fit_group, fit_pvals, buffer_group = _solution_dicts(weights, labels, pvals, groups, user_ids)
     return fit_group, fit_pvals, buffer_group
 
 
+def _update_unfit_labels(weights, labels, pvals, unfit_from, user_ids, user_profiles, user_adjacency,
+                         ks_alpha=0.05, sampler=None, fit_tester=None):
+    """ move unfit users into the group fitting them best among groups
+        other than the one they left (unfit_from), into buffer group if
+        none fits. labels and pvals are updated in place
+    """
+    unfit_rows = np.flatnonzero(labels == _UNFIT)
+    # unfit users stay in buffer group unless a fit is found
+    labels[unfit_rows] = _BUFFER
+    other_groups = [[gg for gg in range(len(weights)) if gg != unfit_from[row]] for row in unfit_rows]
+    _move_to_fit_groups(unfit_rows, other_groups, weights, labels, pvals, user_ids, user_profiles,
+                        user_adjacency, ks_alpha, sampler, fit_tester)
+
+
+def _move_to_fit_groups(rows, user_groups, weights, labels, pvals, user_ids, user_profiles, user_adjacency,
+                        ks_alpha=0.05, sampler=None, fit_tester=None):
+    """ label users (rows) with the group of user_groups (all groups if
+        None) fitting them best if its p-value reaches ks_alpha
+    """
+    if fit_tester is None:
+        fit_tester = ShardedFitTester()
+    if not user_groups is None:
+        # users without other groups to test keep their labels
+        has_groups = np.array([len(groups) > 0 for groups in user_groups], dtype=bool)
+        rows = rows[has_groups]
+        user_groups = [groups for groups in user_groups if len(groups) > 0]
+    if len(rows) == 0 or len(weights) == 0:
+        return
+
+    best_groups, best_pvals = fit_tester.best_fits(rows, weights, user_groups, user_ids, user_profiles,
+                                                   user_adjacency, user_adjacency.user_index, sampler)
+    best_groups, best_pvals = np.array(best_groups, dtype=np.int32), np.array(best_pvals)
+    # find group whose distance metrics explained a user's existing
+    # connections at the best degree, unless null hypothesis is rejected
+    is_fit = best_pvals >= ks_alpha
+    labels[rows[is_fit]] = best_groups[is_fit]
+    pvals[rows[is_fit]] = best_pvals[is_fit]
+
+
 def _fit_score(pvals, buffer_group, C=1):
     """
     sum(pvals) / #gouped_user - C * #buffer_group/#total_user
@@ -238,6 +336,15 @@ def _fit_score(pvals, buffer_group, C=1):
     return score
 
 
+def _label_fit_score(labels, pvals, C=1):
+    """ _fit_score() of solution arrays """
+    is_grouped = labels >= 0
+    num_grouped_users = int(is_grouped.sum())
+    num_buffer_users = int((labels == _BUFFER).sum())
+    total_users = num_grouped_users + num_buffer_users
+    return float(pvals[is_grouped].sum()) / num_grouped_users - C * num_buffer_users / total_users
+
+
 def _validate_input_learned_info(dist_metrics, fit_group, fit_pvals):
     """ validate input data
     """
@@ -260,7 +367,8 @@ def _validate_input_learned_info(dist_metrics, fit_group, fit_pvals):
 def _groupwise_dist_learning_single_run(dist_metrics, fit_group, fit_pvals, buffer_group,
                                         user_ids, user_profiles, user_connections,
                                         ks_alpha=0.05, min_group_size=5, verbose=False,
-                                        random_state=None):
+                                        random_state=None, test_user_ids=None, sampler=None,
+                                        user_adjacency=None, executor=None, fit_tester=None):
     """ a single run of groupwise distance learning
 
     Parameters:
@@ -302,20 +410,62 @@ def _groupwise_dist_learning_single_run(dist_metrics, fit_group, fit_pvals, buff
        is given it fixes the seed. Defaults to the global numpy random number
        generator
 
+    test_user_ids: set, optional
+        members of fit groups and buffer group re-tested with updated
+        distance metrics, all members are re-tested if None
+
+    sampler: NonFriendSampler, optional
+        draws non-friends compared with users in ks-tests, all non-friends
+        are compared if None
+
+    user_adjacency: UserAdjacency, optional
+        adjacency of user_connections shared by all stages, built from
+        them if None
+
+    executor: concurrent.futures.Executor, optional
+        executor running groups' distance metrics learning concurrently,
+        groups are learned one after another if None
+
+    fit_tester: ShardedFitTester, optional
+        runs users' ks-tests of all stages in shards, in one batch per
+        stage if None
+
     Returns;
     -------
     """
 
+    if user_adjacency is None:
+        user_adjacency = UserAdjacency(user_ids, user_connections)
+    user_profiles = np.asarray(user_profiles)
+    groups = list(dist_metrics.keys())
+    weights = _group_weights(dist_metrics, groups, user_profiles.shape[1])
+    labels, pvals = _group_labels(fit_group, fit_pvals, groups, user_adjacency.user_index, buffer_group)
+
+    tested_mask = None
+    if not test_user_ids is None:
+        tested_mask = _user_mask(user_ids, test_user_ids)
+    weights = _single_run_labels(weights, labels, pvals, user_ids, user_profiles, user_connections,
+                                 ks_alpha, min_group_size, verbose, tested_mask, sampler,
+                                 user_adjacency, executor, fit_tester)
+    return _solution_dicts(weights, labels, pvals, groups, user_ids)
+
+
+def _single_run_labels(weights, labels, pvals, user_ids, user_profiles, user_connections,
+                       ks_alpha=0.05, min_group_size=5, verbose=False, tested_mask=None, sampler=None,
+                       user_adjacency=None, executor=None, fit_tester=None):
+    """ _groupwise_dist_learning_single_run() on solution arrays: weights
+        (n_group x n_feat), int32 group label and p-value of every user.
+        labels and pvals are updated in place, updated weights are returned
+    """
     # entire run's execution time
     total_time = 0
 
-    # validate the input data is compatible
-    # _validate_input_learned_info(dist_metrics, fit_group, fit_pvals)
-
     start_time = datetime.now()
     # step 00: learn distance metriccs
-    dist_metrics = _update_groupwise_dist(dist_metrics, fit_group, user_ids, user_profiles, user_connections,
-                                          min_group_size)
+    fit_group = {gg: [user_ids[row] for row in np.flatnonzero(labels == gg)] for gg in range(len(weights))}
+    dist_metrics = _update_groupwise_dist(dict(enumerate(weights)), fit_group, user_ids, user_profiles,
+                                          user_connections, min_group_size, executor=executor)
+    weights = _group_weights(dist_metrics, range(len(weights)))
     if verbose:
         duration = (datetime.now() - start_time).total_seconds()
         total_time += duration
@@ -324,9 +474,8 @@ def _groupwise_dist_learning_single_run(dist_metrics, fit_group, fit_pvals, buff
     # step 01: update the member composition in response to
     # newly learned distance metrics weights
     start_time = datetime.now()
-    fit_group, fit_pvals, unfit_group = _update_fit_group_with_groupwise_dist(dist_metrics, fit_group, fit_pvals,
-                                                                              user_ids, user_profiles, user_connections,
-                                                                              ks_alpha)
+    unfit_from = _update_fit_labels(weights, labels, pvals, user_ids, user_profiles, user_adjacency,
+                                    ks_alpha, tested_mask, sampler, fit_tester)
     if verbose:
         duration = (datetime.now() - start_time).total_seconds()
         total_time += duration
@@ -335,8 +484,8 @@ def _groupwise_dist_learning_single_run(dist_metrics, fit_group, fit_pvals, buff
     # step 02: tests members in buffer group with all updated distance metrics
     # fit with other distance metrics
     start_time = datetime.now()
-    fit_group, fit_pvals, buffer_group = _update_buffer_group(dist_metrics, fit_group, fit_pvals, buffer_group,
-                                                              user_ids, user_profiles, user_connections, ks_alpha)
+    _update_buffer_labels(weights, labels, pvals, user_ids, user_profiles, user_adjacency,
+                          ks_alpha, tested_mask, sampler, fit_tester)
     if verbose:
         duration = (datetime.now() - start_time).total_seconds()
         total_time += duration
@@ -344,24 +493,173 @@ def _groupwise_dist_learning_single_run(dist_metrics, fit_group, fit_pvals, buff
 
     # step 03: tests members in unfit_group with cross-group distance metrics
     start_time = datetime.now()
-    fit_group, fit_pvals, buffer_group = _update_unfit_groups_with_crossgroup_dist(dist_metrics, fit_group, fit_pvals,
-                                                                                   unfit_group, buffer_group,
-                                                                                   user_ids, user_profiles,
-                                                                                   user_connections, ks_alpha)
+    _update_unfit_labels(weights, labels, pvals, unfit_from, user_ids, user_profiles, user_adjacency,
+                         ks_alpha, sampler, fit_tester)
     if verbose:
         duration = (datetime.now() - start_time).total_seconds()
         total_time += duration
         print( "updating unfit_group with updated cross-group distance took about %.2f seconds\n" % duration )
 
+    return weights
+
+
+def _seed_of(random_state):
+    """ return integer seed of random_state, drawn from it if a RandomState """
+    if isinstance(random_state, np.random.RandomState):
+        return random_state.randint(np.iinfo(np.int32).max)
+    return random_state
+
+
+def _warm_start_groups(warm_start, user_ids):
+    """ return (dist_metrics, fit_group, fit_pvals, buffer_group) of a
+        previous solution restricted to user_ids. users unknown to the
+        solution are put into buffer_group, members without p-values get
+        the initial p-value 1.
+    """
+    user_id_set = set(user_ids)
+    dist_metrics = deepcopy(warm_start["dist_metrics"])
+    prev_fit_pvals = warm_start.get("fit_pvals", None) or {}
+
+    fit_group, fit_pvals = {}, {}
+    for gg, gg_user_ids in warm_start["fit_group"].items():
+        gg_pvals = prev_fit_pvals.get(gg, [1] * len(gg_user_ids))
+        kept = [(uid, pval) for uid, pval in zip(gg_user_ids, gg_pvals) if uid in user_id_set]
+        fit_group[gg] = [uid for uid, _ in kept]
+        fit_pvals[gg] = [pval for _, pval in kept]
+
+    buffer_group = [uid for uid in warm_start["buffer_group"] if uid in user_id_set]
+    known_user_ids = set(buffer_group)
+    for gg_user_ids in fit_group.values():
+        known_user_ids.update(gg_user_ids)
+    buffer_group.extend([uid for uid in user_ids if not uid in known_user_ids])
+    return dist_metrics, fit_group, fit_pvals, buffer_group
+
+
+def _group_labels(fit_group, fit_pvals, groups, user_index, buffer_group=None):
+    """ return (labels, pvals): int32 position in groups of the group of
+        every user, _BUFFER for users of buffer group, and p-value of every
+        user, nan for users of buffer group. users of neither fit_group nor
+        buffer_group are labeled _ABSENT if buffer_group is given, they
+        belong to buffer group otherwise
+    """
+    labels = np.full(len(user_index), _BUFFER, dtype=np.int32)
+    pvals = np.full(len(user_index), np.nan)
+    if not buffer_group is None:
+        labels[:] = _ABSENT
+        labels[[user_index[uid] for uid in buffer_group]] = _BUFFER
+    for gpos, gg in enumerate(groups):
+        rows = [user_index[uid] for uid in fit_group.get(gg, [])]
+        labels[rows] = gpos
+        pvals[rows] = fit_pvals.get(gg, [])
+    return labels, pvals
+
+
+def _user_mask(user_ids, selected_user_ids):
+    """ return boolean mask of selected_user_ids over user_ids """
+    selected_user_ids = set(selected_user_ids)
+    return np.array([uid in selected_user_ids for uid in user_ids], dtype=bool)
+
+
+def _group_weights(dist_metrics, groups, n_feat=None):
+    """ return (n_group x n_feat) array of groups' distance metrics, groups
+        without distance metrics get even weights if n_feat is given
+    """
+    weights = []
+    for gg in groups:
+        gg_weights = np.asarray(dist_metrics.get(gg, []), dtype=np.float64)
+        if len(gg_weights) == 0 and not n_feat is None:
+            gg_weights = np.ones(n_feat)
+        weights.append(gg_weights)
+    return np.array(weights)
+
+
+def _solution_dicts(weights, labels, pvals, groups, user_ids):
+    """ return (dist_metrics, fit_group, fit_pvals, buffer_group) of solution
+        arrays, members are ordered as user_ids
+    """
+    dist_metrics, fit_group, fit_pvals = {}, {}, {}
+    for gpos, gg in enumerate(groups):
+        rows = np.flatnonzero(labels == gpos)
+        dist_metrics[gg] = weights[gpos].tolist()
+        fit_group[gg] = [user_ids[row] for row in rows]
+        fit_pvals[gg] = pvals[rows].tolist()
+    buffer_group = [user_ids[row] for row in np.flatnonzero(labels == _BUFFER)]
     return dist_metrics, fit_group, fit_pvals, buffer_group
 
 
+class KnowledgeHistory(object):
+    """ knowledge packs (dist_metrics, fit_group, buffer_group) of every
+    iteration of groupwise_dist_learning(). group labels are stored as
+    the users changing group against the previous iteration, packs are
+    rebuilt on access.
+
+    Example:
+    --------
+    _, knowledge_pkgs = debug_info
+    dist_metrics, fit_group, buffer_group = knowledge_pkgs[-1]
+    for dist_metrics, fit_group, buffer_group in knowledge_pkgs[::2]:
+        ...
+    """
+
+    def __init__(self, groups, user_ids):
+        self._groups = groups
+        self._user_ids = user_ids
+        self._weights = []
+        # (rows, labels) changed against the previous iteration
+        self._diffs = []
+        self._last_labels = None
+
+    def __len__(self):
+        return len(self._diffs)
+
+    def append(self, weights, labels):
+        """ record weights (n_group x n_feat) and labels of an iteration """
+        last_labels = self._last_labels
+        if last_labels is None:
+            last_labels = np.full(len(labels), -1, dtype=np.int32)
+        changed = np.flatnonzero(labels != last_labels).astype(np.int32)
+        self._weights.append(weights)
+        self._diffs.append((changed, labels[changed]))
+        self._last_labels = labels.copy()
+
+    def __iter__(self):
+        # labels are replayed once for all packs
+        labels = np.full(len(self._user_ids), -1, dtype=np.int32)
+        for weights, (changed, changed_labels) in zip(self._weights, self._diffs):
+            labels[changed] = changed_labels
+            yield self._knowledge_pack(weights, labels)
+
+    def __getitem__(self, ii):
+        if isinstance(ii, slice):
+            iters = range(len(self))[ii]
+            if len(iters) == 0:
+                return []
+            packs = {kk: pack for kk, pack in zip(range(max(iters) + 1), self) if kk in iters}
+            return [packs[kk] for kk in iters]
+
+        ii = range(len(self))[ii]
+        labels = np.full(len(self._user_ids), -1, dtype=np.int32)
+        for changed, changed_labels in self._diffs[:ii + 1]:
+            labels[changed] = changed_labels
+        return self._knowledge_pack(self._weights[ii], labels)
+
+    def _knowledge_pack(self, weights, labels):
+        """ return (dist_metrics, fit_group, buffer_group) of an iteration """
+        pvals = np.full(len(labels), np.nan)
+        dist_metrics, fit_group, _, buffer_group = _solution_dicts(weights, labels, pvals,
+                                                                   self._groups, self._user_ids)
+        return dist_metrics, fit_group, buffer_group
+
+
 def groupwise_dist_learning(user_ids, user_profiles, user_connections,
                             n_group=2, max_iter=200, max_nogain_streak=10,
                             min_group_size=5, ks_alpha=0.95,
                             alpha_update_freq=5, learning_rate = 0.1,
                             init="zipf", C=0.1,
-                            verbose=False, is_debug=False, random_state=None):
+                            verbose=False, is_debug=False, random_state=None,
+                            warm_start=None, changed_user_ids=None,
+                            non_friend_sample_size=None, non_friend_strata=None,
+                            n_jobs=1, executor=None, n_shards=1):
     """ groupwise distance learning algorithm to classify users.
     it returns: ((dist_metrics, fit_group, buffer_group), _max_fit_score)
 
@@ -398,8 +696,72 @@ def groupwise_dist_learning(user_ids, user_profiles, user_connections,
        is given it fixes the seed. Defaults to the global numpy random number
        generator
 
+    warm_start: dictionary, optional
+        previous solution {"dist_metrics", "fit_group", "buffer_group",
+        "fit_pvals" (optional)} to start from instead of a random group
+        composition. users new to the solution start in buffer group. the
+        learning stops once an iteration leaves the group membership unchanged.
+
+    changed_user_ids: list, optional
+        with warm_start, only these users and users new to the solution are
+        re-tested, e.g. users whose neighbourhoods changed since the previous
+        solution. all users are re-tested if None
+
+    non_friend_sample_size: integer or "friends", optional
+        number of non-friends drawn per user before their distances are
+        computed for ks-tests, "friends" draws as many as the user's friends.
+        all non-friends are compared if None. draws are seeded by random_state
+
+    non_friend_strata: vector-like, optional
+        stratum label per user ordered as user_ids, non-friends are drawn
+        proportionally to strata
+
+    n_jobs: integer, optional, default value = 1
+        number of processes learning groups' distance metrics and running
+        shards of fit tests concurrently, -1 uses all cores. 1 runs them
+        one after another in this process
+
+    executor: concurrent.futures.Executor, optional
+        executor running groups' distance metrics learning and shards of
+        fit tests, e.g. a shared process pool. it overrides n_jobs and is
+        not shut down
+
+    n_shards: integer, optional, default value = 1
+        number of shards users' fit tests are partitioned into at every
+        stage. shards draw ks-tests' sub-samples with fresh seeds of a
+        generator seeded by random_state, results do not depend on n_jobs
+    """
+    res = _groupwise_dist_learning(user_ids, user_profiles, user_connections,
+                                   n_group, max_iter, max_nogain_streak, min_group_size, ks_alpha,
+                                   alpha_update_freq, learning_rate, init, C, verbose, is_debug,
+                                   random_state, warm_start, changed_user_ids,
+                                   non_friend_sample_size, non_friend_strata,
+                                   n_jobs, executor, n_shards)
+    best_knowledge_pack, _, _max_fit_score, debug_info = res
+    if is_debug:
+        return best_knowledge_pack, _max_fit_score, debug_info
+    else:
+        return best_knowledge_pack, _max_fit_score
+
 
+def _groupwise_dist_learning(user_ids, user_profiles, user_connections,
+                             n_group, max_iter, max_nogain_streak, min_group_size, ks_alpha,
+                             alpha_update_freq, learning_rate, init, C, verbose, is_debug,
+                             random_state, warm_start=None, changed_user_ids=None,
+                             non_friend_sample_size=None, non_friend_strata=None,
+                             n_jobs=1, executor=None, n_shards=1):
+    """ groupwise_dist_learning() returning also the p-values of best solution:
+        (best_knowledge_pack, best_fit_pvals, max_fit_score, debug_info)
     """
+    if executor is None and n_jobs != 1:
+        # the process pool lives as long as the fit
+        with ProcessPoolExecutor(max_workers=_n_workers(n_jobs)) as executor:
+            return _groupwise_dist_learning(user_ids, user_profiles, user_connections,
+                                            n_group, max_iter, max_nogain_streak, min_group_size, ks_alpha,
+                                            alpha_update_freq, learning_rate, init, C, verbose, is_debug,
+                                            random_state, warm_start, changed_user_ids,
+                                            non_friend_sample_size, non_friend_strata,
+                                            n_jobs, executor, n_shards)
 
     # _validate_user_information(user_ids, user_profiles, user_connections)
 
@@ -411,47 +773,75 @@ def groupwise_dist_learning(user_ids, user_profiles, user_connections,
         msg = "Invalid number of initilizations n_nogain_streak (={}) must be bigger than zero.".format(max_iter)
         raise ValueError(msg)
 
-    # initiate containers
-    dist_metrics = _init_dict_list(n_group)
-    fit_group = _init_dict_list(n_group)
-    fit_pvals = _init_dict_list(n_group)
-    buffer_group = []
-
-    # initiating the group's composition
-    total_users = len(user_ids)
-
-    if init == "zipf":
-        group_sizes = [int(prob * total_users) for prob in zipf(n_group)]
-        # margin
-        margin = total_users - sum(group_sizes)
-        if margin > 0:
-            # append extra user cap to first group
-            group_sizes[0] += margin
+    sampler = None
+    if not non_friend_sample_size is None:
+        sampler = NonFriendSampler(non_friend_sample_size, non_friend_strata, _seed_of(random_state))
+
+    fit_tester = None
+    if n_shards > 1 or not executor is None:
+        fit_tester = ShardedFitTester(n_shards, executor, _seed_of(random_state))
+
+    # connections never change during a fit
+    user_adjacency = UserAdjacency(user_ids, user_connections)
+
+    test_user_ids = None
+    if not warm_start is None:
+        # continue from the previous solution
+        dist_metrics, fit_group, fit_pvals, buffer_group = _warm_start_groups(warm_start, user_ids)
+        if not changed_user_ids is None:
+            # re-test changed users and users new to the solution only
+            new_user_ids = set(buffer_group).difference(warm_start["buffer_group"])
+            test_user_ids = set(changed_user_ids) | new_user_ids
     else:
-        # elif init == "even"
-        sample_size = floor( total_users / n_group )
-        group_sizes = [sample_size] * n_group
-        # margin
-        margin = total_users - (sample_size * n_group)
-        if margin > 0:
-            # append extra user cap to first group
-            group_sizes[0] += margin
-
-    # initiate fit_group, fit_pvals
-    # by distributing users to different groups
-    user_ids_copy = user_ids.copy()
-    group_names = list(dist_metrics.keys())
-
-    # assign users to each groups
-    for gname, gsize in zip(group_names, group_sizes):
-        # assign users to group
-        draws = choice(user_ids_copy, gsize, replace=False)
-        fit_group[gname] = draws
-        # create inititial group-associated p-values
-        fit_pvals[gname] = [1] * gsize
-
-        for drawed_user_id in draws:
-            user_ids_copy.remove(drawed_user_id)
+        # initiate containers
+        dist_metrics = _init_dict_list(n_group)
+        fit_group = _init_dict_list(n_group)
+        fit_pvals = _init_dict_list(n_group)
+        buffer_group = []
+
+        # initiating the group's composition
+        total_users = len(user_ids)
+
+        if init == "zipf":
+            group_sizes = [int(prob * total_users) for prob in zipf(n_group)]
+            # margin
+            margin = total_users - sum(group_sizes)
+            if margin > 0:
+                # append extra user cap to first group
+                group_sizes[0] += margin
+        else:
+            # elif init == "even"
+            sample_size = floor( total_users / n_group )
+            group_sizes = [sample_size] * n_group
+            # margin
+            margin = total_users - (sample_size * n_group)
+            if margin > 0:
+                # append extra user cap to first group
+                group_sizes[0] += margin
+
+        # initiate fit_group, fit_pvals
+        # by distributing users to different groups
+        group_names = list(dist_metrics.keys())
+        # users are drawn in random order, groups take consecutive draws
+        draws = choice(len(user_ids), sum(group_sizes), replace=False)
+        group_draws = np.split(draws, np.cumsum(group_sizes)[:-1])
+
+        # assign users to each groups
+        for gname, gsize, gg_rows in zip(group_names, group_sizes, group_draws):
+            # assign users to group
+            fit_group[gname] = [user_ids[row] for row in gg_rows]
+            # create inititial group-associated p-values
+            fit_pvals[gname] = [1] * gsize
+
+    # solutions are kept as arrays: weights of groups, group label and
+    # p-value per user
+    groups = list(dist_metrics.keys())
+    user_profiles = np.asarray(user_profiles)
+    weights = _group_weights(dist_metrics, groups, user_profiles.shape[1])
+    labels, pvals = _group_labels(fit_group, fit_pvals, groups, user_adjacency.user_index)
+    tested_mask = None
+    if not test_user_ids is None:
+        tested_mask = _user_mask(user_ids, test_user_ids)
 
     # create container to collect information to
     # track learning process
@@ -459,44 +849,44 @@ def groupwise_dist_learning(user_ids, user_profiles, user_connections,
         iter_hist = []
         ks_alpha_hist = []
         fs_hist = []
-        knowledge_pkgs = []
+        knowledge_pkgs = KnowledgeHistory(groups, user_ids)
         timers = []
 
     # learning process
     _nogain_streak = 0
     _iterate_counter = 0
     _max_fit_score = 0
-    # output package
-    best_knowledge_pack = None
+    # (weights, labels, pvals) of the best solution
+    best_solution = None
+    # group labels of previous iteration
+    last_labels = None
+    if not warm_start is None:
+        last_labels = labels.copy()
 
     for ii in range(max_iter):
 
         loop_start_time = datetime.now()
-        iter_res = _groupwise_dist_learning_single_run(dist_metrics, fit_group, fit_pvals, buffer_group,
-                                                       user_ids, user_profiles, user_connections,
-                                                       ks_alpha, min_group_size, verbose,
-                                                       random_state)
-
+        weights = _single_run_labels(weights, labels, pvals, user_ids, user_profiles, user_connections,
+                                     ks_alpha, min_group_size, verbose, tested_mask, sampler,
+                                     user_adjacency, executor, fit_tester)
 
         loop_duration = (datetime.now() - loop_start_time).total_seconds()
-        dist_metrics, fit_group, fit_pvals, buffer_group = iter_res
-        knowledge_pack = deepcopy(dist_metrics), deepcopy(fit_group), deepcopy(buffer_group)
 
         # evaluate current knowledge pack
-        fit_score = _fit_score(fit_pvals, buffer_group, C=C)
+        fit_score = _label_fit_score(labels, pvals, C=C)
 
         if verbose:
             msg = "-- {}th iteration's fit score: {:.4f}\n".format(_iterate_counter, fit_score)
             msg += "-- ks-alpha: {:.3f}\n".format(ks_alpha)
             msg += "-- time cost: {:.0f} seconds\n".format(loop_duration)
-            msg += "-- size of buffer group: {}\n".format(len(buffer_group))
+            msg += "-- size of buffer group: {}\n".format(int((labels == _BUFFER).sum()))
             print(msg)
 
         # capture the best learned knowledge
         if fit_score > _max_fit_score:
             # find a better solution
             _max_fit_score = fit_score
-            best_knowledge_pack = knowledge_pack
+            best_solution = weights, labels.copy(), pvals.copy()
             # reset non effective learning
             _nogain_streak = 0
         else:
@@ -508,7 +898,7 @@ def groupwise_dist_learning(user_ids, user_profiles, user_connections,
             ks_alpha_hist.append(ks_alpha)
             timers.append(loop_duration)
             fs_hist.append(fit_score)
-            knowledge_pkgs.append(knowledge_pack)
+            knowledge_pkgs.append(weights, labels)
 
         _iterate_counter += 1
 
@@ -523,6 +913,13 @@ def groupwise_dist_learning(user_ids, user_profiles, user_connections,
         if _nogain_streak >= max_nogain_streak:
             break
 
+        if not warm_start is None:
+            # warm start has converged once membership stops changing
+            if np.array_equal(labels, last_labels):
+                break
+            last_labels = labels.copy()
+
+    debug_info = None
     if is_debug:
         track_pack = DataFrame({
             "iter_hist": iter_hist,
@@ -531,9 +928,13 @@ def groupwise_dist_learning(user_ids, user_profiles, user_connections,
             "fs_hist": fs_hist,
         })
         debug_info = track_pack, knowledge_pkgs
-        return best_knowledge_pack, _max_fit_score, debug_info
-    else:
-        return best_knowledge_pack, _max_fit_score
+
+    best_knowledge_pack, best_fit_pvals = None, None
+    if not best_solution is None:
+        dist_metrics, fit_group, best_fit_pvals, buffer_group = _solution_dicts(*best_solution, groups=groups,
+                                                                                user_ids=user_ids)
+        best_knowledge_pack = dist_metrics, fit_group, buffer_group
+    return best_knowledge_pack, best_fit_pvals, _max_fit_score, debug_info
 
 
 class GroupwiseDistLearner(object):
@@ -567,6 +968,28 @@ class GroupwiseDistLearner(object):
        the generator used to initialize the group composition. If an integer
        is given it fixes the seed. Defaults to the global numpy random number
        generator
+
+    warm_start: boolean, optional, default value = False
+       True: fit() continues from the solution of the previous fit() and
+       re-tests only users whose connections changed since then
+
+    non_friend_sample_size: integer or "friends", optional
+       number of non-friends drawn per user for ks-tests, all non-friends
+       are compared if None
+
+    non_friend_strata: vector-like, optional
+       stratum label per user ordered as user_ids of fit()
+
+    n_jobs: integer, optional, default value = 1
+       number of processes learning groups' distance metrics and running
+       shards of fit tests concurrently, -1 uses all cores
+
+    executor: concurrent.futures.Executor, optional
+       executor running groups' distance metrics learning and shards of
+       fit tests, it overrides n_jobs. copies of the learner share it
+
+    n_shards: integer, optional, default value = 1
+       number of shards users' fit tests are partitioned into
     """
 
     def __init__(self, n_group=2,
@@ -574,7 +997,9 @@ class GroupwiseDistLearner(object):
                  min_group_size=5,
                  ks_alpha=0.95, alpha_update_freq = 5, learning_rate = 0.1,
                  C=0.1, init="zipf", verbose=False,
-                 is_debug=False, random_state=None):
+                 is_debug=False, random_state=None, warm_start=False,
+                 non_friend_sample_size=None, non_friend_strata=None,
+                 n_jobs=1, executor=None, n_shards=1):
         self._n_group = n_group
         self._max_iter = max_iter
         self._max_nogain_streak = max_nogain_streak
@@ -587,36 +1012,93 @@ class GroupwiseDistLearner(object):
         self._verbose = verbose
         self._is_debug = is_debug
         self._random_state = random_state
+        self._warm_start = warm_start
+        self._non_friend_sample_size = non_friend_sample_size
+        self._non_friend_strata = non_friend_strata
+        self._n_jobs = n_jobs
+        self._executor = executor
+        self._n_shards = n_shards
         # attributes for learned results
         self._dist_metrics = None
         self._fit_group = None
+        self._fit_pvals = None
         self._buffer_group = None
         self._score = None
         self._debug_info = None
-
-    def fit(self, user_ids, user_profiles, user_connections):
-
-        res = groupwise_dist_learning(user_ids, user_profiles, user_connections,
-                                      n_group=self._n_group, max_iter=self._max_iter,
-                                      max_nogain_streak=self._max_nogain_streak,
-                                      min_group_size=self._min_group_size,
-                                      ks_alpha=self._ks_alpha,
-                                      alpha_update_freq=self._alpha_update_freq, learning_rate=self._learning_rate,
-                                      init=self._init, C=self._C, verbose=self._verbose, is_debug=self._is_debug,
-                                      random_state=self._random_state)
+        # connections of the last fit, tracked for warm start
+        self._fitted_connections = None
+
+    def __deepcopy__(self, memo):
+        # executors hold locks and processes, copies share the same one
+        memo.setdefault(id(self._executor), self._executor)
+        clone = self.__class__.__new__(self.__class__)
+        memo[id(self)] = clone
+        for key, val in self.__dict__.items():
+            setattr(clone, key, deepcopy(val, memo))
+        return clone
+
+    def fit(self, user_ids, user_profiles, user_connections, changed_user_ids=None):
+        """ learn groups and groupwise distance metrics
+
+        Parameters:
+        ----------
+        user_ids: list of all user_id
+
+        user_profile: matrix-like of user profiles, records should align with user_ids
+
+        user_connections: list of user id pair representing connections
+
+        changed_user_ids: list, optional
+            with warm_start, users to re-test, e.g. users whose profiles changed.
+            users with added or removed connections are detected if None
+        """
+        warm_start = None
+        if self._warm_start and not self._dist_metrics is None:
+            warm_start = {"dist_metrics": self._dist_metrics,
+                          "fit_group": self._fit_group,
+                          "fit_pvals": self._fit_pvals,
+                          "buffer_group": self._buffer_group}
+            if changed_user_ids is None:
+                changed_user_ids = self._changed_connection_users(user_connections)
+
+        res = _groupwise_dist_learning(user_ids, user_profiles, user_connections,
+                                       n_group=self._n_group, max_iter=self._max_iter,
+                                       max_nogain_streak=self._max_nogain_streak,
+                                       min_group_size=self._min_group_size,
+                                       ks_alpha=self._ks_alpha,
+                                       alpha_update_freq=self._alpha_update_freq, learning_rate=self._learning_rate,
+                                       init=self._init, C=self._C, verbose=self._verbose, is_debug=self._is_debug,
+                                       random_state=self._random_state,
+                                       warm_start=warm_start, changed_user_ids=changed_user_ids,
+                                       non_friend_sample_size=self._non_friend_sample_size,
+                                       non_friend_strata=self._non_friend_strata,
+                                       n_jobs=self._n_jobs, executor=self._executor,
+                                       n_shards=self._n_shards)
         # unpack results
+        knowledge_pack, fit_pvals, best_score, debug_info = res
+        if best_score == 0 and not warm_start is None:
+            # no solution beat the fit score 0, keep the warm start solution
+            knowledge_pack = warm_start["dist_metrics"], warm_start["fit_group"], warm_start["buffer_group"]
+            fit_pvals, best_score = warm_start["fit_pvals"], self._score
+        dist_metrics, fit_group, buffer_group = knowledge_pack
         if self._is_debug:
-            knowledge_pack, best_score, debug_info = res
-            dist_metrics, fit_group, buffer_group = knowledge_pack
             self._debug_info = debug_info
-        else:
-            knowledge_pack, best_score = res
-            dist_metrics, fit_group, buffer_group = knowledge_pack
 
         self._score = best_score
         self._dist_metrics = dist_metrics
         self._fit_group = fit_group
+        self._fit_pvals = fit_pvals
         self._buffer_group = buffer_group
+        if self._warm_start:
+            # connections are undirected, pairs are kept regardless of order
+            self._fitted_connections = set(map(frozenset, user_connections))
+
+    def _changed_connection_users(self, user_connections):
+        """ return users with connections added or removed since last fit """
+        if self._fitted_connections is None:
+            return None
+        changed_pairs = self._fitted_connections.symmetric_difference(map(frozenset, user_connections))
+        return list(set([uid for pair in changed_pairs for uid in pair]))
 
     def get_score(self):
         return self._score
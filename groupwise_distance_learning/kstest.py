@@ -1,21 +1,9 @@
-""" KStest function depending on R-core
+""" Two-sample one-sided KS-tests in native numpy, following R's ks.test
 Author: Yi Zhang <beingzy@gmail.com>
 Date: 2016/02/29
 """
-from rpy2 import robjects
-from rpy2.robjects.packages import importr
-from rpy2.robjects.numpy2ri import numpy2ri
-
-from numpy import array, asarray, exp, min
-from numpy.random import choice
-from numpy import concatenate, cumsum, diff, unique, min
 import numpy as np
-# import numpy as np
-# import pandas as pd
 
-# set up environment
-robjects.conversion.py2ri = numpy2ri
-rstats = importr("stats")
 
 def kstest_2samp_greater(x, y):
     """ return tests staticics and p-value for KS-tests
@@ -27,6 +15,12 @@ def kstest_2samp_greater(x, y):
     H0: distribution of X >= distribution of Y
     H1: distribution of X < distribution of Y
 
+    It is ks.test(x, y, alternative="less") of R 3.x, which the rpy2
+    bridge used to run: one-sided two-sample tests always take the
+    asymptotic p-value exp(-2 * m * n / (m + n) * ts^2), with or without
+    ties and whatever the sample sizes. R >= 4.3 computes exact p-values
+    of small samples instead, these are not matched.
+
     Parameters:
     ----------
     * x: <vector-like, numeric> samples from one population
@@ -37,48 +31,96 @@ def kstest_2samp_greater(x, y):
     * ts: <numeric> tests statistics of KS-tests
     * pvalue: <numeric> p-value fo tests statistics
     """
-    # sampling y
-    # n, m = y.shape
-    # msg = "y's type; {}, nrow: {}, ncol: {}".format(type(y), n, m)
-    # print(msg)
-
-    x = x.ravel()
-    y = y.ravel()
-
-    try:
-        x_size = len(x)
-        if len(y) > x_size:
-            y = choice(y, size=x_size, replace=False)
-
-        setting = array(["less"], dtype="str")
-        test_res = rstats.ks_test(x, y, alternative=setting)
-        ts, pval = test_res[0][0], test_res[1][0]
-    except:
-        ts, pval = None, 1
-
-    return ts, pval
-
-# def kstest_2samp_greater(data1, data2):
-#     """ KS-test with two-sample, null-hypothesis: X > Y """
-#     data1 = data1.ravel()
-#     data2 = data2.ravel()
-#     if len(data2) > len(data1) * 1.2:
-#         data2 = choice(data2, size=len(data1), replace=False)
-#
-#     n1 = len(data1)
-#     n2 = len(data2)
-#     n = n1 * n2 / float(n1 + n2)
-#     data_all = concatenate([data1, data2])
-#     # return order index
-#     order_idx = data_all.argsort(axis=0)
-#     z = cumsum([1.0 / n1 if (idx <= n1) else -1.0 / n2 for idx in order_idx])
-#
-#     if len(unique(data_all)) < (n1 + n2):
-#         diffs = np.diff(z)
-#         idx = [ii for ii, diff in zip(range(len(diffs)), diffs) if diff]
-#         idx.append(n1 + n2 - 1)
-#         z = z[idx]
-#
-#     test_stat = abs(-min(z))
-#     pval = min([1, max([0, exp(-2 * n * test_stat * test_stat)])])
-#     return test_stat, pval
\ No newline at end of file
+    x = np.asarray(x, dtype=np.float64).ravel()
+    y = np.asarray(y, dtype=np.float64).ravel()
+    ts, pvals = kstest_2samp_greater_batch(x, [0, len(x)], y, [0, len(y)])
+    if np.isnan(ts[0]):
+        return None, 1
+    return float(ts[0]), float(pvals[0])
+
+
+def kstest_2samp_greater_batch(x, x_offsets, y, y_offsets, rng=None):
+    """ return tests statistics and p-values of many KS-tests of
+    kstest_2samp_greater(), given ragged samples as flat arrays plus
+    offsets: the k-th test compares x[x_offsets[k]:x_offsets[k + 1]]
+    with y[y_offsets[k]:y_offsets[k + 1]]. Tests with an empty sample
+    return nan as tests statistics, 1 as pvalue.
+
+    Parameters:
+    ----------
+    * x: <vector-like, numeric> concatenated samples
+    * x_offsets: <vector-like, integer> (n_tests + 1) offsets of x
+    * y: <vector-like, numeric> concatenated samples
+    * y_offsets: <vector-like, integer> (n_tests + 1) offsets of y
+    * rng: <numpy.random.RandomState> generator sub-sampling y down to
+        the size of x, numpy.random if None
+
+    Returns:
+    -------
+    * ts: <numpy.ndarray> tests statistics
+    * pvals: <numpy.ndarray> p-values
+    """
+    if rng is None:
+        rng = np.random
+    x, x_seg = _flatten_segments(x, x_offsets)
+    y, y_seg = _flatten_segments(y, y_offsets)
+    n_tests = len(x_offsets) - 1
+    m = np.bincount(x_seg, minlength=n_tests)
+
+    # sub-sample y down to the size of x without replacement
+    n = np.bincount(y_seg, minlength=n_tests)
+    if (n > m).any():
+        # random order within every test: segment index plus a random fraction
+        y_order = np.argsort(y_seg + rng.random_sample(len(y)))
+        y, y_seg = y[y_order], y_seg[y_order]
+        y_rank = np.arange(len(y)) - _segment_starts(y_seg, n_tests)[y_seg]
+        is_kept = y_rank < m[y_seg]
+        y, y_seg = y[is_kept], y_seg[is_kept]
+        n = np.bincount(y_seg, minlength=n_tests)
+
+    # merge samples, steps of z = (F_y - F_x) * m * n are integers
+    w = np.concatenate((x, y))
+    w_seg = np.concatenate((x_seg, y_seg))
+    step = np.concatenate((-n[x_seg], m[y_seg])).astype(np.int64)
+    order = np.lexsort((w, w_seg))
+    w, w_seg, step = w[order], w_seg[order], step[order]
+    z = np.cumsum(step)
+    # steps are counted from the start of every test
+    z -= np.concatenate(([0], z))[_segment_starts(w_seg, n_tests)[w_seg]]
+
+    # empirical CDFs are evaluated right after every distinct value
+    is_next_same = np.zeros(len(w), dtype=bool)
+    is_next_same[:-1] = (w_seg[1:] == w_seg[:-1]) & (w[1:] == w[:-1])
+    z_max = np.zeros(n_tests, dtype=np.int64)
+    np.maximum.at(z_max, w_seg[~is_next_same], z[~is_next_same])
+
+    is_valid = (m > 0) & (n > 0)
+    mn = m * n
+    ts = np.full(n_tests, np.nan)
+    ts[is_valid] = z_max[is_valid] / mn[is_valid].astype(np.float64)
+    pvals = np.ones(n_tests)
+    pvals[is_valid] = psmirnov_less_asymp(ts[is_valid], m[is_valid], n[is_valid])
+    return ts, pvals
+
+
+def _flatten_segments(values, offsets):
+    """ return finite values and their segment index """
+    values = np.asarray(values, dtype=np.float64).ravel()
+    offsets = np.asarray(offsets, dtype=np.intp)
+    seg = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    # non-finite values are dropped as R does
+    is_finite = np.isfinite(values[offsets[0]:offsets[-1]])
+    return values[offsets[0]:offsets[-1]][is_finite], seg[is_finite]
+
+
+def _segment_starts(seg, n_segments):
+    """ return start position of every segment of sorted segment index """
+    return np.concatenate(([0], np.cumsum(np.bincount(seg, minlength=n_segments))[:-1]))
+
+
+def psmirnov_less_asymp(ts, m, n):
+    """ return asymptotic P(D >= ts) of one-sided two-sample statistic,
+        arguments may be arrays
+    """
+    n_eff = np.multiply(m, n) / np.add(m, n).astype(np.float64)
+    return np.clip(np.exp(-2.0 * n_eff * np.square(ts)), 0.0, 1.0)
@@ -4,10 +4,13 @@ Author: Yi Zhang <beingzy@gmail.com>
 Date: 2016/03/13
 """
 import unittest
+import numpy as np
 from groupwise_distance_learning.tests.test_helper_func import load_sample_test_data
 from groupwise_distance_learning.groupwise_distance_learner import _groupwise_dist_learning_single_run
 from groupwise_distance_learning.groupwise_distance_learner import groupwise_dist_learning
 from groupwise_distance_learning.groupwise_distance_learner import GroupwiseDistLearner
+from groupwise_distance_learning.groupwise_distance_learner import KnowledgeHistory
+from groupwise_distance_learning.groupwise_distance_learner import _warm_start_groups
 
 class TestGroupWiseDistLearnerRun(unittest.TestCase):
 
@@ -184,6 +187,92 @@ class TestGroupWiseDistLearnerRun(unittest.TestCase):
         print("--- learner class (n_group=2) with init='zipf' ---")
         print("best score: {}".format(gwd_learner.get_score()))
 
+    def test_learner_class_warm_start(self):
+        rng = np.random.RandomState(0)
+        user_ids = ["u{}".format(ii) for ii in range(60)]
+        user_profiles = rng.rand(60, 3)
+        user_connections = np.array([[user_ids[ii], user_ids[(ii + 1) % 60]] for ii in range(0, 60, 2)] +
+                                    [[user_ids[ii], user_ids[(ii + 3) % 60]] for ii in range(0, 60, 3)])
+
+        gwd_learner = GroupwiseDistLearner(n_group=2, min_group_size=1, max_iter=10, warm_start=True,
+                                           is_debug=True, random_state=0)
+        gwd_learner.fit(user_ids, user_profiles, user_connections)
+        # refit with unchanged connections starts from the converged solution
+        gwd_learner.fit(user_ids, user_profiles, user_connections)
+        track_pack, _ = gwd_learner.get_debug_info()
+        self.assertEqual(len(track_pack), 1)
+
+        def user_pvals(learner):
+            fit_group, fit_pvals = learner.get_user_cluster()[0], learner._fit_pvals
+            return {uid: pval for gg in fit_group for uid, pval in zip(fit_group[gg], fit_pvals[gg])}
+
+        # users outside changed_user_ids are never re-tested
+        last_pvals = user_pvals(gwd_learner)
+        changed_user_ids = user_ids[:6]
+        gwd_learner.fit(user_ids, user_profiles, user_connections, changed_user_ids=changed_user_ids)
+        new_pvals = user_pvals(gwd_learner)
+        for uid, pval in last_pvals.items():
+            if not uid in changed_user_ids:
+                self.assertEqual(new_pvals[uid], pval)
+
+        # new users start in buffer group
+        new_user_ids = user_ids + ["u60", "u61"]
+        warm_start = {"dist_metrics": gwd_learner.get_groupwise_weights(), "fit_group": gwd_learner._fit_group,
+                      "fit_pvals": gwd_learner._fit_pvals, "buffer_group": gwd_learner._buffer_group}
+        _, _, _, buffer_group = _warm_start_groups(warm_start, new_user_ids)
+        self.assertEqual(buffer_group[-2:], ["u60", "u61"])
+
+        gwd_learner.fit(new_user_ids, np.vstack([user_profiles, rng.rand(2, 3)]),
+                        np.vstack([user_connections, [["u60", "u1"], ["u61", "u2"]]]))
+        fit_group, buffer_group = gwd_learner.get_user_cluster()
+        grouped_user_ids = list(buffer_group)
+        for gg_user_ids in fit_group.values():
+            grouped_user_ids.extend(gg_user_ids)
+        self.assertEqual(sorted(grouped_user_ids), sorted(new_user_ids))
+
+    def test_changed_connection_users(self):
+        rng = np.random.RandomState(0)
+        user_ids = list("abcdefgh")
+        user_profiles = rng.rand(len(user_ids), 3)
+        user_connections = np.array([["a", "b"], ["b", "c"], ["c", "d"], ["e", "f"], ["g", "h"]])
+
+        gwd_learner = GroupwiseDistLearner(n_group=2, min_group_size=1, max_iter=1, warm_start=True)
+        self.assertIsNone(gwd_learner._changed_connection_users(user_connections))
+        gwd_learner.fit(user_ids, user_profiles, user_connections)
+        self.assertEqual(gwd_learner._changed_connection_users(user_connections), [])
+        # connections are undirected, reversed pairs are unchanged
+        self.assertEqual(gwd_learner._changed_connection_users(user_connections[:, ::-1]), [])
+
+        # ["a", "h"] is added and ["e", "f"] is removed
+        new_connections = np.vstack([np.delete(user_connections, 3, axis=0), [["h", "a"]]])
+        changed_user_ids = gwd_learner._changed_connection_users(new_connections)
+        self.assertEqual(sorted(changed_user_ids), ["a", "e", "f", "h"])
+
+    def test_knowledge_history(self):
+        rng = np.random.RandomState(0)
+        user_ids = list("abcdefghij")
+        groups = [0, 1, 2]
+        knowledge_pkgs = KnowledgeHistory(groups, user_ids)
+
+        expected_pkgs = []
+        for ii in range(5):
+            weights = rng.rand(len(groups), 3)
+            # -1 labels users of buffer group
+            labels = rng.randint(-1, len(groups), len(user_ids)).astype(np.int32)
+            knowledge_pkgs.append(weights, labels)
+            dist_metrics = {gg: weights[gg].tolist() for gg in groups}
+            fit_group = {gg: [uid for uid, label in zip(user_ids, labels) if label == gg] for gg in groups}
+            buffer_group = [uid for uid, label in zip(user_ids, labels) if label == -1]
+            expected_pkgs.append((dist_metrics, fit_group, buffer_group))
+
+        self.assertEqual(len(knowledge_pkgs), 5)
+        self.assertEqual(list(knowledge_pkgs), expected_pkgs)
+        for ii in range(-5, 5):
+            self.assertEqual(knowledge_pkgs[ii], expected_pkgs[ii])
+        for ii in [slice(1, 3), slice(None, None, 2), slice(None, None, -1), slice(-2, None), slice(3, 1)]:
+            self.assertEqual(knowledge_pkgs[ii], expected_pkgs[ii])
+        self.assertRaises(IndexError, lambda: knowledge_pkgs[5])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -5,7 +5,9 @@ Date: 2016/03/12
 """
 
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 from networkx import Graph
 
 from groupwise_distance_learning.tests.test_helper_func import load_sample_test_data
@@ -14,6 +16,16 @@ from groupwise_distance_learning.groupwise_distance_learner import _update_group
 from groupwise_distance_learning.groupwise_distance_learner import _update_fit_group_with_groupwise_dist
 from groupwise_distance_learning.groupwise_distance_learner import _update_buffer_group
 from groupwise_distance_learning.groupwise_distance_learner import _update_unfit_groups_with_crossgroup_dist
+from groupwise_distance_learning.groupwise_distance_learner import _BUFFER, _UNFIT, _ABSENT
+from groupwise_distance_learning.groupwise_distance_learner import _update_fit_labels
+from groupwise_distance_learning.groupwise_distance_learner import _update_buffer_labels
+from groupwise_distance_learning.groupwise_distance_learner import _update_unfit_labels
+from groupwise_distance_learning.groupwise_distance_learner import _move_to_fit_groups
+from groupwise_distance_learning.groupwise_distance_learner import _single_run_labels
+from groupwise_distance_learning.groupwise_distance_learner import _solution_dicts
+from groupwise_distance_learning.groupwise_distance_learner import _fit_score
+from groupwise_distance_learning.groupwise_distance_learner import _label_fit_score
+from groupwise_distance_learning.util_functions import UserAdjacency
 
 
 class TestGroupWiseDistLearnerSupportFunctions(unittest.TestCase):
@@ -335,6 +347,147 @@ class TestGroupWiseDistLearnerSupportFunctions(unittest.TestCase):
         self.assertTrue(is_ok, True)
 
 
+class _TableFitTester(object):
+    """ fit tester looking p-values up in a (user x group) table, it
+        records the rows of tested users
+    """
+
+    def __init__(self, pval_table):
+        self._pval_table = np.asarray(pval_table, dtype=np.float64)
+        self.tested_rows = []
+
+    def best_fits(self, user_rows, group_weights, user_groups, *args):
+        best_groups, best_pvals = [], []
+        for kk, row in enumerate(user_rows):
+            groups = range(len(group_weights)) if user_groups is None else list(user_groups[kk])
+            row_pvals = self._pval_table[row, groups]
+            best_groups.append(groups[int(np.argmax(row_pvals))])
+            best_pvals.append(float(row_pvals.max()))
+            self.tested_rows.append(int(row))
+        return best_groups, best_pvals
+
+
+class TestGroupWiseDistLearnerLabelStages(unittest.TestCase):
+
+    def setUp(self):
+        self._user_ids = list("abcdefg")
+        self._user_profiles = np.random.RandomState(0).rand(7, 3)
+        self._user_adjacency = UserAdjacency(self._user_ids, [["a", "b"], ["c", "d"], ["e", "f"]])
+        self._weights = np.ones((2, 3))
+        # a: fits its group 0, b: fails group 0 but fits group 1,
+        # c: fails group 1 and group 0, d: buffer user fitting group 1,
+        # e: buffer user fitting nothing, f: absent, g: fits its group 1
+        self._labels = np.array([0, 0, 1, _BUFFER, _BUFFER, _ABSENT, 1], dtype=np.int32)
+        self._pvals = np.array([1, 1, 1, np.nan, np.nan, np.nan, 1])
+        self._fit_tester = _TableFitTester([[0.9, 0.1], [0.01, 0.6], [0.02, 0.01], [0.3, 0.7],
+                                            [0.01, 0.02], [0.9, 0.9], [0.99, 0.5]])
+
+    def _run_stage(self, stage, *args, **kwargs):
+        return stage(self._weights, self._labels, self._pvals, *args, user_ids=self._user_ids,
+                     user_profiles=self._user_profiles, user_adjacency=self._user_adjacency,
+                     ks_alpha=0.05, fit_tester=self._fit_tester, **kwargs)
+
+    def test_update_fit_labels(self):
+        unfit_from = self._run_stage(_update_fit_labels)
+        self.assertEqual(sorted(self._fit_tester.tested_rows), [0, 1, 2, 6])
+        self.assertEqual(self._labels.tolist(), [0, _UNFIT, _UNFIT, _BUFFER, _BUFFER, _ABSENT, 1])
+        self.assertEqual(unfit_from.tolist(), [_BUFFER, 0, 1, _BUFFER, _BUFFER, _BUFFER, _BUFFER])
+        # members are tested with their own group only
+        np.testing.assert_allclose(self._pvals[[0, 6]], [0.9, 0.5])
+        self.assertTrue(np.isnan(self._pvals[[1, 2]]).all())
+
+    def test_update_fit_labels_with_tested_mask(self):
+        tested_mask = np.array([True, True, False, True, True, True, False])
+        self._run_stage(_update_fit_labels, tested_mask=tested_mask)
+        self.assertEqual(sorted(self._fit_tester.tested_rows), [0, 1])
+        self.assertEqual(self._labels.tolist(), [0, _UNFIT, 1, _BUFFER, _BUFFER, _ABSENT, 1])
+        self.assertEqual(self._pvals[2], 1)
+
+    def test_update_unfit_labels(self):
+        unfit_from = self._run_stage(_update_fit_labels)
+        self._fit_tester.tested_rows = []
+        self._run_stage(_update_unfit_labels, unfit_from)
+        # unfit users are tested with groups other than the one they left
+        self.assertEqual(sorted(self._fit_tester.tested_rows), [1, 2])
+        self.assertEqual(self._labels.tolist(), [0, 1, _BUFFER, _BUFFER, _BUFFER, _ABSENT, 1])
+        self.assertAlmostEqual(self._pvals[1], 0.6)
+        self.assertTrue(np.isnan(self._pvals[2]))
+
+    def test_update_buffer_labels(self):
+        self._run_stage(_update_buffer_labels)
+        self.assertEqual(sorted(self._fit_tester.tested_rows), [3, 4])
+        self.assertEqual(self._labels.tolist(), [0, 0, 1, 1, _BUFFER, _ABSENT, 1])
+        self.assertAlmostEqual(self._pvals[3], 0.7)
+        self.assertTrue(np.isnan(self._pvals[4]))
+
+    def test_move_to_fit_groups(self):
+        _move_to_fit_groups(np.array([1, 3, 4]), [[0], [0, 1], []], self._weights, self._labels, self._pvals,
+                            self._user_ids, self._user_profiles, self._user_adjacency, ks_alpha=0.05,
+                            fit_tester=self._fit_tester)
+        # users without groups to test are never tested
+        self.assertEqual(self._fit_tester.tested_rows, [1, 3])
+        self.assertEqual(self._labels.tolist(), [0, 0, 1, 1, _BUFFER, _ABSENT, 1])
+        # b fails its only tested group and keeps label and p-value
+        self.assertEqual(self._pvals[1], 1)
+        self.assertAlmostEqual(self._pvals[3], 0.7)
+
+    def test_single_group_unfit_users_stay_in_buffer(self):
+        self._weights = np.ones((1, 3))
+        self._labels = np.array([0, 0, 0, _BUFFER, _BUFFER, _ABSENT, 0], dtype=np.int32)
+        self._fit_tester = _TableFitTester([[0.9], [0.01], [0.02], [0.3], [0.01], [0.9], [0.5]])
+        unfit_from = self._run_stage(_update_fit_labels)
+        self._fit_tester.tested_rows = []
+        self._run_stage(_update_unfit_labels, unfit_from)
+        # no other group to test
+        self.assertEqual(self._fit_tester.tested_rows, [])
+        self.assertEqual(self._labels.tolist(), [0, _BUFFER, _BUFFER, _BUFFER, _BUFFER, _ABSENT, 0])
+
+    def test_single_run_labels(self):
+        weights = _single_run_labels(self._weights, self._labels, self._pvals, self._user_ids,
+                                     self._user_profiles, None, ks_alpha=0.05, min_group_size=10,
+                                     user_adjacency=self._user_adjacency, fit_tester=self._fit_tester)
+        self.assertEqual(weights.shape, (2, 3))
+        self.assertNotIn(5, self._fit_tester.tested_rows)
+        self.assertEqual(self._labels.tolist(), [0, 1, _BUFFER, 1, _BUFFER, _ABSENT, 1])
+        np.testing.assert_allclose(self._pvals, [0.9, 0.6, np.nan, 0.7, np.nan, np.nan, 0.5])
+
+        # fit score of the arrays matches the one of the dictionaries
+        _, _, fit_pvals, buffer_group = _solution_dicts(weights, self._labels, self._pvals, [0, 1],
+                                                        self._user_ids)
+        self.assertEqual(buffer_group, ["c", "e"])
+        self.assertAlmostEqual(_label_fit_score(self._labels, self._pvals, C=0.1),
+                               _fit_score(fit_pvals, buffer_group, C=0.1))
+
+
+class TestGroupwiseDistWithExecutor(unittest.TestCase):
+
+    def test_update_groupwise_dist_with_executor(self):
+        rng = np.random.RandomState(0)
+        user_ids = ["u{}".format(ii) for ii in range(40)]
+        user_profiles = rng.rand(40, 3)
+        # friends of group 1 are close on the 1st feature, the ones of
+        # group 0 on the 3rd feature
+        order_1, order_0 = np.argsort(user_profiles[:20, 0]), 20 + np.argsort(user_profiles[20:, 2])
+        user_connections = np.array([[user_ids[a], user_ids[b]] for order in [order_1, order_0]
+                                     for a, b in zip(order[:-1], order[1:])])
+        # group 2 is too small to be trained and keeps its weights
+        fit_group = {1: user_ids[:20], 0: user_ids[20:38], 2: user_ids[38:]}
+        dist_metrics = {1: [1, 1, 1], 0: [1, 1, 1], 2: [0.5, 0.5, 0.5]}
+
+        new_dist_metrics = _update_groupwise_dist(dist_metrics, fit_group, user_ids, user_profiles,
+                                                  user_connections, min_group_size=5)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            par_dist_metrics = _update_groupwise_dist(dist_metrics, fit_group, user_ids, user_profiles,
+                                                      user_connections, min_group_size=5, executor=executor)
+
+        # weights are collected in the order of groups
+        self.assertEqual(list(new_dist_metrics.keys()), [1, 0, 2])
+        self.assertEqual(list(par_dist_metrics.keys()), [1, 0, 2])
+        self.assertEqual({gg: list(ww) for gg, ww in par_dist_metrics.items()},
+                         {gg: list(ww) for gg, ww in new_dist_metrics.items()})
+        self.assertEqual(list(new_dist_metrics[2]), [0.5, 0.5, 0.5])
+        self.assertNotEqual(list(new_dist_metrics[1]), list(new_dist_metrics[0]))
+
 
 if __name__ == '__main__':
     unittest.main()
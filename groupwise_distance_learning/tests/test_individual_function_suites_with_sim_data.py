@@ -5,6 +5,7 @@ Date: 2016/03/12
 """
 
 import unittest
+from concurrent.futures import ProcessPoolExecutor
 
 from networkx import Graph
 
@@ -70,6 +71,25 @@ class TestGroupWiseDistLearnerSupportFunctions(unittest.TestCase):
         is_ok = True
         self.assertTrue(is_ok, True)
 
+    def test_update_groupwise_dist_with_executor(self):
+
+        user_ids, user_profile_df, user_connection_df, true_group = load_simulated_test_data()
+
+        n_feat = user_profile_df.shape[1]
+        fit_group = {gg: [user_ids[i] for i, g in enumerate(true_group) if g == gg] for gg in [1, 0]}
+        dist_metrics = {0: [1] * n_feat, 1: [1] * n_feat}
+
+        new_dist_metrics = _update_groupwise_dist(dist_metrics, fit_group,
+                                                  user_ids, user_profile_df, user_connection_df,
+                                                  min_group_size=1)
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            par_dist_metrics = _update_groupwise_dist(dist_metrics, fit_group,
+                                                      user_ids, user_profile_df, user_connection_df,
+                                                      min_group_size=1, executor=executor)
+
+        for gg in fit_group.keys():
+            self.assertEqual(list(par_dist_metrics[gg]), list(new_dist_metrics[gg]))
+
     def test_update_fit_group_with_groupwise_dist_01(self):
         """ test with generic distance metrics """
 
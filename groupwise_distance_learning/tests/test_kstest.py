@@ -6,6 +6,7 @@ import unittest
 import numpy as np
 from numpy.random import normal
 from groupwise_distance_learning.kstest import kstest_2samp_greater
+from groupwise_distance_learning.kstest import kstest_2samp_greater_batch
 
 
 class TestKSTest2SampGreater(unittest.TestCase):
@@ -63,6 +64,57 @@ class TestKSTest2SampGreater(unittest.TestCase):
 
         self.assertTrue(is_match)
 
+    def test_r3_reference_pvalue(self):
+        # reference values of R 3.x ks.test(x, y, alternative="less"),
+        # asymptotic p-values for small samples and ties alike
+        res_ts, res_pval = kstest_2samp_greater(np.array([4., 5., 6.]), np.array([1., 2., 3.]))
+        self.assertEqual(res_ts, 1.0)
+        self.assertAlmostEqual(res_pval, 0.04978707, places=7)
+
+        res_ts, res_pval = kstest_2samp_greater(np.array([1., 2., 3.]), np.array([4., 5., 6.]))
+        self.assertEqual(res_ts, 0.0)
+        self.assertEqual(res_pval, 1.0)
+
+        res_ts, res_pval = kstest_2samp_greater(np.array([3., 4., 5., 6.]), np.array([1., 2., 7.]))
+        self.assertAlmostEqual(res_ts, 2. / 3)
+        self.assertAlmostEqual(res_pval, 0.21788028, places=7)
+
+        # ties: the statistic is evaluated after every distinct value
+        res_ts, res_pval = kstest_2samp_greater(np.array([1., 2., 2., 3., 5.]), np.array([0., 2., 2., 4.]))
+        self.assertAlmostEqual(res_ts, 0.25)
+        self.assertAlmostEqual(res_pval, 0.75746513, places=7)
+
+    def test_batch_match_single(self):
+        # ragged samples, y never longer than x to avoid sub-sampling
+        xs = [self._x, self._y[:10], self._z[:3], np.array([])]
+        ys = [self._y, self._x[:7], self._x[:3], self._z[:5]]
+        x_offsets = np.cumsum([0] + [len(x) for x in xs])
+        y_offsets = np.cumsum([0] + [len(y) for y in ys])
+        res_ts, res_pvals = kstest_2samp_greater_batch(np.concatenate(xs), x_offsets,
+                                                       np.concatenate(ys), y_offsets)
+        for ii, (x, y) in enumerate(zip(xs[:3], ys[:3])):
+            ts, pval = kstest_2samp_greater(x, y)
+            self.assertAlmostEqual(res_ts[ii], ts)
+            self.assertAlmostEqual(res_pvals[ii], pval)
+        self.assertTrue(np.isnan(res_ts[3]))
+        self.assertEqual(res_pvals[3], 1)
+
+    def test_batch_subsampling_draws(self):
+        xs = [self._x[:10], self._y[:7]]
+        x_offsets = np.cumsum([0] + [len(x) for x in xs])
+        # no y longer than x, no random draws are taken
+        rng = np.random.RandomState(0)
+        kstest_2samp_greater_batch(np.concatenate(xs), x_offsets, self._z[:15], [0, 10, 15], rng=rng)
+        self.assertEqual(rng.random_sample(), np.random.RandomState(0).random_sample())
+        # y longer than x is sub-sampled down to the size of x
+        rng = np.random.RandomState(0)
+        res_ts, _ = kstest_2samp_greater_batch(np.concatenate(xs), x_offsets, self._z[:20], [0, 10, 20],
+                                               rng=rng)
+        self.assertNotEqual(rng.random_sample(), np.random.RandomState(0).random_sample())
+        # statistics are multiples of 1 / (m * n) with n == m
+        z_max = res_ts * [100, 49]
+        self.assertTrue(np.allclose(z_max, np.round(z_max)))
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,138 @@
+""" test utility functions of groupwise distance learner
+
+Author: Yi Zhang <beingzy@gmail.com>
+Date: 2016/06/02
+"""
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from networkx import Graph
+from groupwise_distance_learning.util_functions import NonFriendSampler
+from groupwise_distance_learning.util_functions import UserAdjacency
+from groupwise_distance_learning.util_functions import ShardedFitTester
+from groupwise_distance_learning.util_functions import find_fit_groups
+from groupwise_distance_learning.util_functions import user_grouped_dist
+from groupwise_distance_learning.util_functions import user_grouped_dist_rows
+
+
+class TestNonFriendSampler(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        n_users = 100
+        self._user_ids = ["u{}".format(ii) for ii in range(n_users)]
+        self._user_profiles = rng.rand(n_users, 3)
+        self._user_graph = Graph()
+        self._user_graph.add_edges_from([("u0", "u{}".format(ii)) for ii in range(1, 6)])
+        self._strata = np.repeat([0, 1, 2], [50, 30, 20])
+
+    def test_sample_size_friends(self):
+        sampler = NonFriendSampler(random_state=0)
+        sim_dist, diff_dist = user_grouped_dist("u0", [1, 1, 1], self._user_ids, self._user_profiles,
+                                                self._user_graph, sampler=sampler)
+        self.assertEqual(len(sim_dist), 5)
+        self.assertEqual(len(diff_dist), 5)
+        # seeded per user, the same non-friends are drawn again
+        _, diff_dist_again = user_grouped_dist("u0", [1, 1, 1], self._user_ids, self._user_profiles,
+                                               self._user_graph, sampler=sampler)
+        self.assertTrue(np.array_equal(diff_dist, diff_dist_again))
+
+    def test_stratified_sample(self):
+        sampler = NonFriendSampler(sample_size=10, strata=self._strata, random_state=0)
+        sampled_rows = sampler.sample(0, np.arange(1, 100), 5)
+        self.assertEqual(len(np.unique(sampled_rows)), 10)
+        self.assertEqual(np.bincount(self._strata[sampled_rows]).tolist(), [5, 3, 2])
+        # users of every stratum draw 5/3/2 non-friends, never themselves
+        for user_row in [0, 50, 80]:
+            non_friend_rows = np.delete(np.arange(100), user_row)
+            sampled_rows = sampler.sample(user_row, non_friend_rows, 5)
+            self.assertEqual(len(np.unique(sampled_rows)), 10)
+            self.assertNotIn(user_row, sampled_rows)
+            self.assertTrue(np.isin(sampled_rows, non_friend_rows).all())
+            self.assertEqual(np.bincount(self._strata[sampled_rows], minlength=3).tolist(), [5, 3, 2])
+            # seeded per user, the same non-friends are drawn again
+            self.assertTrue(np.array_equal(sampler.sample(user_row, non_friend_rows, 5), sampled_rows))
+
+    def test_no_sampler(self):
+        sim_dist, diff_dist = user_grouped_dist("u0", [1, 1, 1], self._user_ids, self._user_profiles,
+                                                self._user_graph)
+        self.assertEqual(len(sim_dist), 5)
+        self.assertEqual(len(diff_dist), 94)
+
+    def test_grouped_dist_rows(self):
+        weights = np.array([0.5, 1.0, 2.0])
+        friend_mask = np.zeros(100, dtype=bool)
+        friend_mask[1:6] = True
+        sim_dist, diff_dist = user_grouped_dist_rows(0, weights, self._user_profiles, friend_mask)
+
+        profile_diff = self._user_profiles - self._user_profiles[0]
+        expected = np.sqrt((profile_diff ** 2 * weights).sum(axis=1))
+        np.testing.assert_allclose(sim_dist, expected[1:6])
+        np.testing.assert_allclose(diff_dist, expected[6:])
+
+
+class TestUserAdjacency(unittest.TestCase):
+
+    def test_match_graph(self):
+        user_ids = ["a", "b", "c", "d"]
+        user_connections = [["a", "b"], ["c", "a"], ["b", "a"], ["d", "d"]]
+        user_graph = Graph()
+        user_graph.add_edges_from(user_connections)
+        user_adjacency = UserAdjacency(user_ids, user_connections)
+
+        for uid in user_ids:
+            self.assertEqual(sorted(user_adjacency.neighbors(uid)), sorted(user_graph.neighbors(uid)))
+        self.assertEqual(user_adjacency.friend_mask(0).tolist(), [False, True, True, False])
+
+        profiles = np.arange(12.0).reshape(4, 3)
+        for user_graph_like in [user_graph, user_adjacency]:
+            sim_dist, diff_dist = user_grouped_dist("a", [1, 1, 1], user_ids, profiles, user_graph_like)
+            self.assertEqual(len(sim_dist), 2)
+            self.assertEqual(len(diff_dist), 1)
+
+
+class TestShardedFitTester(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self._user_ids = list(range(60))
+        self._user_profiles = rng.rand(60, 3)
+        user_connections = [(int(a), int(b)) for a, b in rng.randint(0, 60, (150, 2)) if a != b]
+        self._user_adjacency = UserAdjacency(self._user_ids, user_connections)
+
+    def test_shards_match_executor(self):
+        dist_metrics = {"a": [1, 1, 1], "b": [1, 0, 0], "c": [0, 0, 1]}
+
+        fits = []
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for shard_executor in [None, executor]:
+                fit_tester = ShardedFitTester(n_shards=4, executor=shard_executor, random_state=0)
+                fits.append(find_fit_groups(self._user_ids, dist_metrics, self._user_ids, self._user_profiles,
+                                            self._user_adjacency, threshold=0,
+                                            user_index=self._user_adjacency.user_index,
+                                            fit_tester=fit_tester))
+        self.assertEqual(fits[0], fits[1])
+        self.assertTrue(all(group in dist_metrics for group, _ in fits[0]))
+
+    def test_calls_draw_fresh_streams(self):
+        user_rows = np.arange(60)
+        group_weights = [[1, 1, 1], [1, 0, 0]]
+
+        def run_calls(fit_tester, n_calls=2):
+            return [fit_tester.best_fits(user_rows, group_weights, None, self._user_ids, self._user_profiles,
+                                         self._user_adjacency, self._user_adjacency.user_index)[1]
+                    for _ in range(n_calls)]
+
+        first_pvals, second_pvals = run_calls(ShardedFitTester(n_shards=4, random_state=0))
+        # non-friends are sub-sampled with a fresh stream on every call
+        self.assertNotEqual(first_pvals, second_pvals)
+        # the sequence of calls is reproduced by the seed
+        self.assertEqual(run_calls(ShardedFitTester(n_shards=4, random_state=0)), [first_pvals, second_pvals])
+        # without seed, shards' seeds are drawn from numpy.random
+        np.random.seed(0)
+        unseeded_pvals = run_calls(ShardedFitTester(n_shards=4))
+        np.random.seed(0)
+        self.assertEqual(run_calls(ShardedFitTester(n_shards=4)), unseeded_pvals)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,8 +6,8 @@ import numpy as np
 from scipy.stats import rayleigh
 
 from ..learning_dist_metrics.ldm import LDM
-from ..learning_dist_metrics.dist_metrics import weighted_euclidean
 from .kstest import kstest_2samp_greater
+from .kstest import kstest_2samp_greater_batch
 
 
 def zipf_pdf(k, n, s=1):
@@ -28,7 +28,8 @@ def zipf(n, s=1):
     return [zipf_pdf(k, n, s) for k in range(1, n+1)]
 
 
-def user_grouped_dist(user_id, weights, user_ids, user_profiles, user_graph):
+def user_grouped_dist(user_id, weights, user_ids, user_profiles, user_graph, user_index=None,
+                      sampler=None):
     """ return vector of weighted distance of a user vs. user's conencted users,
     and a vector of weighted distnces of a user vs. user's non-connected users.
 
@@ -46,7 +47,11 @@ def user_grouped_dist(user_id, weights, user_ids, user_profiles, user_graph):
     # * user_ids: <list> a list of user_ids
     # * user_profile: <matrix-like, array>, a matrix of user profile, sorted by user_ids
     # * friend_ls: <list>, a list of user ids
-    # * user_graph: <networkx.Graph>
+    # * user_graph: <UserAdjacency or networkx.Graph>
+    # * user_index: <dict> {user_id: row of user_profiles}, it is built
+    #   from user_ids if not provided
+    # * sampler: <NonFriendSampler> draws the non-friends whose distances
+    #   are computed, all non-friends are compared if None
 
     Returns:
     -------
@@ -60,33 +65,264 @@ def user_grouped_dist(user_id, weights, user_ids, user_profiles, user_graph):
         user_profiles, user_graph)
     """
 
+    if user_index is None:
+        user_index = build_user_index(user_ids)
+
+    friend_mask = _friend_mask(user_id, user_graph, user_index, len(user_ids))
+    sim_dist_vec, diff_dist_vec = user_grouped_dist_rows(user_index[user_id], weights, user_profiles,
+                                                         friend_mask, sampler)
+    return sim_dist_vec.tolist(), diff_dist_vec.tolist()
+
+
+def _friend_mask(user_id, user_graph, user_index, n_users):
+    """ return boolean mask of rows of user's friends in user_graph
+        (UserAdjacency or networkx.Graph)
+    """
+    if isinstance(user_graph, UserAdjacency):
+        return user_graph.friend_mask(user_index[user_id])
+
     # get the user_id of friends of the target user
     try:
-        friend_ls = user_graph.neighbors(user_id)
+        friend_ls = list(user_graph.neighbors(user_id))
     except:
         friend_ls = []
+    friend_mask = np.zeros(n_users, dtype=bool)
+    friend_mask[[user_index[f_id] for f_id in friend_ls]] = True
+    return friend_mask
 
-    non_friends_ls = [u for u in user_ids if u not in friend_ls + [user_id]]
 
-    # retrive target user's profile
-    idx = [i for i, uid in enumerate(user_ids) if uid == user_id]
-    user_profile = user_profiles[idx, :]
+def user_grouped_dist_rows(user_row, weights, user_profiles, friend_mask, sampler=None):
+    """ return weighted distances of a user (row) vs. user's friends and vs.
+    user's non-friends, computed in one pass over profile matrix.
 
-    sim_dist_vec = []
-    for f_id in friend_ls:
-        idx = [i for i, uid in enumerate(user_ids) if uid == f_id]
-        friend_profile = user_profiles[idx, :]
-        the_dist = weighted_euclidean(user_profile, friend_profile, weights)
-        sim_dist_vec.append(the_dist)
+    Parameters:
+    ----------
+    * user_row: <integer> row of the target user in user_profiles
+    * weights: <vector-like> a vector of weights per user profile feature
+    * user_profiles: <matrix-like, array> a matrix of user profile
+    * friend_mask: <vector-like, boolean> True at rows of user's friends
+    * sampler: <NonFriendSampler> draws the non-friends whose distances
+        are computed, all non-friends are compared if None
+
+    Returns:
+    -------
+    * (sim_dist, dissim_dist): <numpy.ndarray> distances of user-vs-friends,
+    distances of user-vs-non-friends, ordered by rows
+    """
+    user_profiles = np.asarray(user_profiles, dtype=np.float64)
+    friend_mask = np.asarray(friend_mask, dtype=bool)
+    weights = np.asarray(weights, dtype=np.float64).ravel()
+
+    non_friend_mask = ~friend_mask
+    non_friend_mask[user_row] = False
+    if sampler is None:
+        # distances to all users, split by the masks
+        dist = _weighted_dist_to_rows(user_profiles, user_row, slice(None), weights)
+        return dist[friend_mask], dist[non_friend_mask]
+
+    # distances are computed for friends and sampled non-friends only
+    friend_rows = np.flatnonzero(friend_mask)
+    non_friend_rows = sampler.sample(user_row, np.flatnonzero(non_friend_mask), len(friend_rows))
+    dist = _weighted_dist_to_rows(user_profiles, user_row,
+                                  np.concatenate((friend_rows, non_friend_rows)), weights)
+    return dist[:len(friend_rows)], dist[len(friend_rows):]
 
-    diff_dist_vec = []
-    for nf_id in non_friends_ls:
-        idx = [i for i, uid in enumerate(user_ids) if uid == nf_id]
-        non_friend_profile = user_profiles[idx, :]
-        the_dist = weighted_euclidean(user_profile, non_friend_profile, weights)
-        diff_dist_vec.append(the_dist)
 
-    return sim_dist_vec, diff_dist_vec
+def _weighted_dist_to_rows(user_profiles, user_row, rows, weights):
+    """ return weighted euclidean distances of user (row) to rows """
+    diff = user_profiles[rows] - user_profiles[user_row]
+    return np.sqrt(np.dot(diff * diff, weights))
+
+
+class UserAdjacency(object):
+    """ immutable undirected adjacency of users in CSR layout: neighbours
+    of user row i are indices[indptr[i]:indptr[i + 1]]. it is built once
+    per fit in place of networkx.Graph, user_connections never change
+    during a fit.
+
+    Parameters:
+    ----------
+    user_ids: {list} all user ids following same order of user_profiles
+    user_connections: {list} pairs of connected user ids
+    user_index: {dictionary} {user_id: row}, built from user_ids if None
+    """
+
+    def __init__(self, user_ids, user_connections, user_index=None):
+        if user_index is None:
+            user_index = build_user_index(user_ids)
+        self.user_ids = user_ids
+        self.user_index = user_index
+
+        n_users = len(user_ids)
+        pairs = np.array([[user_index[a], user_index[b]] for a, b in user_connections],
+                         dtype=np.int64).reshape(-1, 2)
+        # both directions, duplicated edges are stored once
+        keys = np.unique(np.concatenate((pairs[:, 0] * n_users + pairs[:, 1],
+                                         pairs[:, 1] * n_users + pairs[:, 0])))
+        src = keys // n_users
+        self.indices = (keys % n_users).astype(np.int32)
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n_users))))
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def neighbor_rows(self, row):
+        """ return rows of neighbours of user (row) """
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def neighbors(self, user_id):
+        """ return ids of neighbours of user_id, as networkx.Graph does """
+        return [self.user_ids[ii] for ii in self.neighbor_rows(self.user_index[user_id])]
+
+    def friend_mask(self, row):
+        """ return boolean mask of rows of neighbours of user (row) """
+        friend_mask = np.zeros(len(self), dtype=bool)
+        friend_mask[self.neighbor_rows(row)] = True
+        return friend_mask
+
+
+class NonFriendSampler(object):
+    """ draw the non-friends compared with a user before their distances
+    are computed, instead of sub-sampling them in ks-tests. the draw is
+    seeded per user, so a user is compared with the same non-friends
+    under every group's distance metrics.
+
+    Parameters:
+    ----------
+    sample_size: {integer or "friends"}, number of sampled non-friends,
+        "friends" samples as many non-friends as the user has friends, the
+        size ks-tests sub-sample non-friends to
+    strata: {vector-like}, stratum label per user ordered as user_ids,
+        non-friends are sampled proportionally to strata if provided
+    random_state: {integer}, seed of draws, numpy.random is used if None
+    """
+
+    def __init__(self, sample_size="friends", strata=None, random_state=None):
+        self._sample_size = sample_size
+        self._strata = None if strata is None else np.asarray(strata)
+        self._random_state = random_state
+
+    def sample(self, user_row, non_friend_rows, n_friends):
+        """ return sampled rows of non_friend_rows for user (user_row) """
+        size = n_friends if self._sample_size == "friends" else self._sample_size
+        if size >= len(non_friend_rows):
+            return non_friend_rows
+
+        if self._random_state is None:
+            rng = np.random
+        else:
+            rng = np.random.RandomState([self._random_state, user_row])
+
+        if self._strata is None:
+            return np.sort(rng.choice(non_friend_rows, size, replace=False))
+
+        # proportional allocation, remainders go to largest fractions
+        _, stratum, counts = np.unique(self._strata[non_friend_rows], return_inverse=True,
+                                       return_counts=True)
+        quota = size * counts / float(len(non_friend_rows))
+        alloc = np.floor(quota).astype(np.intp)
+        n_extra = size - alloc.sum()
+        alloc[np.argsort(alloc - quota, kind="mergesort")[:n_extra]] += 1
+        # random order within every stratum
+        order = np.lexsort((rng.random_sample(len(non_friend_rows)), stratum))
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        rank = np.arange(len(order)) - starts[stratum[order]]
+        return np.sort(non_friend_rows[order[rank < alloc[stratum[order]]]])
+
+
+class ShardedFitTester(object):
+    """ run users' fit tests, distances to friends and non-friends and
+    their ks-tests, in shards of users. shards are submitted to executor
+    and return (user row, group, pvalue) per user, collected in the
+    order of users. every call draws one seed per shard from the tester's
+    generator, shards sub-sample non-friends in ks-tests with their own
+    RandomState, so results depend on neither the executor nor the
+    scheduling of shards, and successive calls draw fresh streams.
+
+    Parameters:
+    ----------
+    n_shards: {integer}, number of shards users are partitioned into
+    executor: {concurrent.futures.Executor}, runs shards concurrently,
+        shards run one after another in this process if None
+    random_state: {integer}, seed of the generator of shards' seeds,
+        numpy.random is used if None
+    """
+
+    def __init__(self, n_shards=1, executor=None, random_state=None):
+        self._n_shards = max(1, n_shards)
+        self._executor = executor
+        if random_state is None:
+            self._rng = np.random
+        else:
+            self._rng = np.random.RandomState(random_state)
+
+    def best_fits(self, user_rows, group_weights, user_groups, user_ids, user_profiles, user_graph,
+                  user_index, sampler=None, fit_rayleigh=False, _n=1000):
+        """ return (groups, pvals): per user of user_rows, the group of
+            user_groups with the highest p-value (first among ties) and the
+            p-value
+
+        Parameters:
+        ----------
+        user_rows: {vector-like, integer}, rows of tested users
+        group_weights: {list}, distance metrics weights per group
+        user_groups: {list}, groups (positions in group_weights) tested per
+            user, all groups are tested for every user if None
+        """
+        user_profiles = np.asarray(user_profiles, dtype=np.float64)
+        n_shards = min(self._n_shards, max(1, len(user_rows)))
+        bounds = np.linspace(0, len(user_rows), n_shards + 1).astype(np.intp)
+
+        # seeds are drawn here, never in (possibly forked) workers
+        shard_seeds = self._rng.randint(np.iinfo(np.int32).max, size=n_shards)
+        shard_args = []
+        for kk in range(n_shards):
+            rng = np.random.RandomState(shard_seeds[kk])
+            shard_user_groups = None if user_groups is None else user_groups[bounds[kk]:bounds[kk + 1]]
+            shard_args.append((user_rows[bounds[kk]:bounds[kk + 1]], group_weights, shard_user_groups,
+                               user_ids, user_profiles, user_graph, user_index, sampler,
+                               fit_rayleigh, _n, rng))
+
+        if self._executor is None:
+            shard_fits = [_best_fits_shard(*args) for args in shard_args]
+        else:
+            futures = [self._executor.submit(_best_fits_shard, *args) for args in shard_args]
+            shard_fits = [future.result() for future in futures]
+
+        fits = [fit for fits in shard_fits for fit in fits]
+        return [group for _, group, _ in fits], [pval for _, _, pval in fits]
+
+
+def _best_fits_shard(user_rows, group_weights, user_groups, user_ids, user_profiles, user_graph,
+                     user_index, sampler, fit_rayleigh, _n, rng):
+    """ return (user row, group, pvalue) of best fit group per user """
+    if user_groups is None:
+        user_groups = [range(len(group_weights))] * len(user_rows)
+
+    # ks-tests of all users and groups are run in one batch
+    sim_dists, diff_dists = [], []
+    for row, groups in zip(user_rows, user_groups):
+        friend_mask = _friend_mask(user_ids[row], user_graph, user_index, len(user_ids))
+        for gg in groups:
+            sim_dist, diff_dist = user_grouped_dist_rows(row, group_weights[gg], user_profiles,
+                                                         friend_mask, sampler)
+            sim_dists.append(sim_dist)
+            diff_dists.append(diff_dist)
+    pvals = users_dist_kstest(sim_dists, diff_dists, fit_rayleigh, _n, rng)
+
+    fits, start = [], 0
+    for row, groups in zip(user_rows, user_groups):
+        groups = list(groups)
+        user_pvals = pvals[start:start + len(groups)]
+        start += len(groups)
+        max_idx = int(np.argmax(user_pvals))
+        fits.append((row, groups[max_idx], float(user_pvals[max_idx])))
+    return fits
+
+
+def build_user_index(user_ids):
+    """ return {user_id: row} of user ids ordered as user_profiles """
+    return {uid: ii for ii, uid in enumerate(user_ids)}
 
 
 def user_dist_kstest(sim_dist_vec, diff_dist_vec,
@@ -139,6 +375,43 @@ def user_dist_kstest(sim_dist_vec, diff_dist_vec,
     return pval
 
 
+def users_dist_kstest(sim_dist_vecs, diff_dist_vecs, fit_rayleigh=False, _n=100, rng=None):
+    """ user_dist_kstest() of many users in one vectorized call
+
+    Parameters:
+    ----------
+    sim_dist_vecs: {list}, distances between friends and the user per user
+    diff_dist_vecs: {list}, distances between non-friends and the user per user
+    fit_rayleigh: {boolean}, determine if fit data into Rayleigth distri
+                  -bution
+    _n: {integer}, number of random samples generated from estimated
+        distribution
+    rng: {numpy.random.RandomState}, generator sub-sampling non-friends'
+        distances in ks-tests, numpy.random if None
+
+    Returns:
+    -------
+    * res: {list}: p-value of ks-tests per user
+    """
+    if fit_rayleigh:
+        return [user_dist_kstest(sim_dist_vec, diff_dist_vec, fit_rayleigh, _n)
+                for sim_dist_vec, diff_dist_vec in zip(sim_dist_vecs, diff_dist_vecs)]
+
+    sim_dist, sim_offsets = _concatenate_ragged(sim_dist_vecs)
+    diff_dist, diff_offsets = _concatenate_ragged(diff_dist_vecs)
+    _, pvals = kstest_2samp_greater_batch(sim_dist, sim_offsets, diff_dist, diff_offsets, rng)
+    return pvals.tolist()
+
+
+def _concatenate_ragged(vecs):
+    """ return (flat array, offsets) of a list of vectors """
+    sizes = [len(vec) for vec in vecs]
+    offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.intp)
+    if offsets[-1] == 0:
+        return np.empty(0), offsets
+    return np.concatenate([np.asarray(vec, dtype=np.float64).ravel() for vec in vecs]), offsets
+
+
 def users_filter_by_weights(weights, user_ids, user_profiles, user_graph,
                             pval_threshold=0.5,
                             mutate_rate=0.4,
@@ -193,9 +466,11 @@ def users_filter_by_weights(weights, user_ids, user_profiles, user_graph,
     # user_ids
     # container for users meeting different critiria
     pvals = []
+    user_index = build_user_index(user_ids)
 
     for uid in user_ids:
-        sim_dist, diff_dist = user_grouped_dist(uid, weights, user_ids, user_profiles, user_graph)
+        sim_dist, diff_dist = user_grouped_dist(uid, weights, user_ids, user_profiles, user_graph,
+                                                user_index)
         pval = user_dist_kstest(sim_dist, diff_dist, fit_rayleigh, _n)
         pvals.append(pval)
 
@@ -238,10 +513,11 @@ def ldm_train_with_list(users_list, user_ids, user_profiles, user_connections, r
     ---------
     new_dist_metrics = ldm_train_with_list(user_list, profile_df, friends_df)
     """
+    users_set = set(users_list)
     if retain_type == 0:
-        friends = [(a, b) for a, b in user_connections if a in users_list or b in users_list]
+        friends = [(a, b) for a, b in user_connections if a in users_set or b in users_set]
     else:
-        friends = [(a, b) for a, b in user_connections if a in users_list and b in users_list]
+        friends = [(a, b) for a, b in user_connections if a in users_set and b in users_set]
 
     ldm = LDM()
     ldm.fit(user_ids=user_ids, X=user_profiles, S=friends)
@@ -251,7 +527,8 @@ def ldm_train_with_list(users_list, user_ids, user_profiles, user_connections, r
 
 def find_fit_group(uid, dist_metrics,
                    user_ids, user_profiles, user_graph,
-                   threshold=0.5, current_group=None, fit_rayleigh=False, _n=1000):
+                   threshold=0.5, current_group=None, fit_rayleigh=False, _n=1000,
+                   user_index=None):
     """ calculate user p-value for the distance metrics of
         each group
 
@@ -264,11 +541,31 @@ def find_fit_group(uid, dist_metrics,
     threshold: {float}, threshold for qualifying pvalue of ks-tests
     current_group: {integer}, group index
     fit_rayleigh: {boolean}
+    user_index: {dictionary}, {user_id: row of user_profiles}
 
     Resutls:
     --------
     res: {list}, [group_idx, pvalue]
     """
+    return find_fit_groups([uid], dist_metrics, user_ids, user_profiles, user_graph,
+                           threshold, current_group, fit_rayleigh, _n, user_index)[0]
+
+
+def find_fit_groups(uids, dist_metrics,
+                    user_ids, user_profiles, user_graph,
+                    threshold=0.5, current_group=None, fit_rayleigh=False, _n=1000,
+                    user_index=None, sampler=None, fit_tester=None):
+    """ find_fit_group() of many users, ks-tests of all users and groups
+        are run in one batch, or in shards by fit_tester (ShardedFitTester)
+        if provided. non-friends are drawn by sampler if provided
+
+    Resutls:
+    --------
+    res: {list}, (group_idx, pvalue) per user of uids
+    """
+    if user_index is None:
+        user_index = build_user_index(user_ids)
+
     if current_group is None:
         other_group = list(dist_metrics.keys())
         other_dist_metrics = list(dist_metrics.values())
@@ -276,36 +573,23 @@ def find_fit_group(uid, dist_metrics,
         other_group = [group for group in dist_metrics.keys() if group != current_group]
         other_dist_metrics = [dist for group, dist in dist_metrics.items() if group != current_group]
 
-    if len(other_dist_metrics) > 0:
-        # only excute this is at least one alternative group
-        pvals = []
-
-        for dist in other_dist_metrics:
-            # loop through all distance metrics and calculate
-            # p-value of ks-tests by applying it to the user
-            # relationships
-            sim_dist, diff_dist = user_grouped_dist(user_id=uid, weights=dist,
-                                             user_ids=user_ids, user_profiles=user_profiles,
-                                             user_graph=user_graph)
-
-            pval = user_dist_kstest(sim_dist_vec=sim_dist, diff_dist_vec=diff_dist,
-                                    fit_rayleigh=fit_rayleigh, _n=_n)
+    if len(other_dist_metrics) == 0 or len(uids) == 0:
+        return [(None, None)] * len(uids)
 
-            pvals.append(pval)
-
-        # find group whose distance metrics explained a user's existing
-        # connections at the best degree.
-        max_pval = max(pvals)
-        max_idx = [ii for ii, pval in enumerate(pvals) if pval == max_pval][0]
-        best_group = other_group[max_idx]
+    if fit_tester is None:
+        fit_tester = ShardedFitTester()
 
+    # find group whose distance metrics explained a user's existing
+    # connections at the best degree, first one among ties.
+    user_rows = [user_index[uid] for uid in uids]
+    best_idx, best_pvals = fit_tester.best_fits(user_rows, other_dist_metrics, None,
+                                                user_ids, user_profiles, user_graph, user_index,
+                                                sampler, fit_rayleigh, _n)
+    res = []
+    for max_idx, max_pval in zip(best_idx, best_pvals):
         if max_pval < threshold:
             # reject null hypothesis
-            best_group = None
-            max_pval = None
-
-    else:
-        best_group = None
-        max_pval = None
-
-    return best_group, max_pval
\ No newline at end of file
+            res.append((None, None))
+        else:
+            res.append((other_group[max_idx], max_pval))
+    return res
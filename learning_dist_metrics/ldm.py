@@ -162,8 +162,9 @@ class LDM(object):
         # Convert ids in D and S into row index, in order to provide them to
         # a set of two distance functions, squared_sum_grouped_dist() and
         # sum_grouped_dist()
-        S_idx = [(find_index(a, ids), find_index(b, ids)) for (a, b) in S]
-        D_idx = [(find_index(a, ids), find_index(b, ids)) for (a, b) in D]
+        id_index = {uid: ii for ii, uid in enumerate(ids)}
+        S_idx = [(id_index[a], id_index[b]) for (a, b) in S]
+        D_idx = [(id_index[a], id_index[b]) for (a, b) in D]
         # [ [a, b] for a, b in g.edges() if a in sample_user_ids or b in sample_user_ids ]
 
         grouped_distance_container = WeightedDistanceTester(X, S_idx, D_idx)
@@ -15,7 +15,6 @@ from networkx import DiGraph, Graph
 from .SocialNetworkEvaluator import EvaluatorMixin
 from .UserClickSimulator import UserClickSimulatorMixin
 from ..user_recommender.UserRecommenderMixin import UserRecommenderMixin
-import copy
 
 
 class UserRecSysExpSimulator(object):
@@ -176,15 +175,16 @@ class UserRecSysExpSimulator(object):
             start_time = datetime.now()
 
             uniq_user_ids = self._recommender._user_ids
+            # generate suggestions of all users in one batch
+            all_suggestions = self._recommender.gen_suggestions_batch(uniq_user_ids)
 
-            for ii, user_id in enumerate(uniq_user_ids):
+            for ii, (user_id, suggestions) in enumerate(zip(uniq_user_ids, all_suggestions)):
                 # retrieve recommended users
                 # if user_id in self._rejected_user_dict:
                 #    block_list = self._rejected_user_dict[user_id]
                 # else:
                 #    block_list = []
 
-                suggestions = self._recommender.gen_suggestion(user_id)
                 accepted, rejected = self._clicker.click(user_id, suggestions)
 
                 tot_suggestions += len(suggestions)
@@ -231,10 +231,8 @@ class UserRecSysExpSimulator(object):
             self._evaluator.load_eval_user_connections(self._recommender._user_connections)
             eval_score = self._evaluator.get_score()
 
-            cand_size = 0
-            recommender_memory = copy.deepcopy(self._recommender._ordered_cand_dict)
-            for k in recommender_memory.keys():
-                cand_size += len(recommender_memory[k])
+            # cursors report their remaining candidates without copying them
+            cand_size = sum(len(cands) for cands in self._recommender._ordered_cand_dict.values())
 
             # measure the network
             if self._is_directed:
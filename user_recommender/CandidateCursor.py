@@ -0,0 +1,172 @@
+""" Cursor over recommendation candidates ordered by distance
+Author: Yi Zhang <beingzy@gmail.com>
+Date: 2016/05/24
+"""
+import numpy as np
+
+
+class CandidateCursor(object):
+    """ page through candidates from the nearest to the farthest. only a
+    window of the nearest candidates is ordered and kept, as int32 rows;
+    the window grows geometrically by ranking the remaining candidates
+    again when the pages run beyond it. ties are broken by the order of
+    candidates, as a stable sort does.
+
+    Example:
+    --------
+    # candidates given by their distances
+    cursor = CandidateCursor(cand_user_ids, cand_user_dist)
+    # candidates ranked on demand from weighted profiles
+    cursor = CandidateCursor.from_profiles(user_index, weighted_profiles, row, blocked_rows)
+    suggestion = cursor.next(5)
+    len(cursor) # number of candidates not yet returned
+    """
+
+    def __init__(self, cand_user_ids, cand_user_dist):
+        """ instance initilization function
+
+        Parameters:
+        ----------
+        * cand_user_ids: <list> candidate user ids
+        * cand_user_dist: <array-like> distances aligned with cand_user_ids
+        """
+        if len(cand_user_ids) != len(cand_user_dist):
+            raise ValueError("cand_user_ids (nobs: {}) does not match cand_user_dist (nobs: {})".format(
+                len(cand_user_ids), len(cand_user_dist)))
+        self._cand_user_ids = cand_user_ids
+        self._user_index = None
+        self._ranker = _DistanceRanker(cand_user_dist)
+        self._window = np.empty(0, dtype=np.int32)
+        # number of candidates have been returned
+        self._pos = 0
+
+    @classmethod
+    def from_profiles(cls, user_index, weighted_profiles, row, blocked_rows, dist_row=None):
+        """ return cursor ranking all users but blocked_rows by their
+            distances to user (row), distances are computed on demand
+
+        Parameters:
+        ----------
+        * user_index: <UserIdIndex> translation of rows to user ids
+        * weighted_profiles: <WeightedProfiles> projection of profiles
+            under the weights of the query user
+        * row: <integer> row of query user
+        * blocked_rows: <vector-like, integer> rows never returned
+        * dist_row: <numpy.ndarray> pre-computed distances of user (row) to
+            all users, used by the first ranking only
+        """
+        cursor = cls.__new__(cls)
+        cursor._cand_user_ids = None
+        cursor._user_index = user_index
+        cursor._ranker = _ProfileRanker(weighted_profiles, row, blocked_rows, dist_row)
+        cursor._window = np.empty(0, dtype=np.int32)
+        cursor._pos = 0
+        return cursor
+
+    def __len__(self):
+        return len(self._ranker) - self._pos
+
+    @property
+    def nbytes(self):
+        """ memory held by the cursor (the shared profiles are excluded) """
+        return self._window.nbytes + self._ranker.nbytes
+
+    def next(self, size):
+        """ return the next (at most) size nearest candidates """
+        positions = self._get_window(size)
+        self._pos += len(positions)
+        return self._to_user_ids(positions)
+
+    def peek(self, size=None):
+        """ return the next (at most) size nearest candidates without
+            advancing the cursor, all remaining candidates if size is None
+        """
+        if size is None:
+            size = len(self)
+        return self._to_user_ids(self._get_window(size))
+
+    def prefetch(self, size):
+        """ rank the next size candidates ahead of the paging """
+        self._get_window(size)
+
+    def _get_window(self, size):
+        n_ordered = min(self._pos + size, len(self._ranker))
+        if n_ordered > len(self._window):
+            # grow the window geometrically to amortize repeated ranking
+            n_select = max(n_ordered - len(self._window), len(self._window))
+            selected = self._ranker.select(n_select, self._window)
+            self._window = np.concatenate((self._window, selected.astype(np.int32)))
+        return self._window[self._pos:self._pos + size]
+
+    def _to_user_ids(self, positions):
+        if self._user_index is None:
+            return [self._cand_user_ids[ii] for ii in positions]
+        return self._user_index.ids(positions).tolist()
+
+
+class _DistanceRanker(object):
+    """ rank candidates by given distances """
+
+    def __init__(self, cand_user_dist):
+        self._cand_user_dist = np.asarray(cand_user_dist, dtype=np.float64)
+
+    def __len__(self):
+        return len(self._cand_user_dist)
+
+    @property
+    def nbytes(self):
+        return self._cand_user_dist.nbytes
+
+    def select(self, size, exclude):
+        """ return positions of the size nearest candidates not in exclude """
+        is_kept = np.ones(len(self._cand_user_dist), dtype=bool)
+        is_kept[exclude] = False
+        positions = np.flatnonzero(is_kept)
+        return positions[_argsmallest(self._cand_user_dist[positions], size)]
+
+
+class _ProfileRanker(object):
+    """ rank all users but the blocked ones by distances to user (row),
+        computed from WeightedProfiles every time a ranking is requested
+    """
+
+    def __init__(self, weighted_profiles, row, blocked_rows, dist_row=None):
+        self._weighted_profiles = weighted_profiles
+        self._row = int(row)
+        self._blocked_rows = np.unique(np.asarray(blocked_rows, dtype=np.int32))
+        self._dist_row = dist_row
+
+    def __len__(self):
+        return len(self._weighted_profiles) - len(self._blocked_rows)
+
+    @property
+    def nbytes(self):
+        dist_nbytes = 0 if self._dist_row is None else self._dist_row.nbytes
+        return self._blocked_rows.nbytes + dist_nbytes
+
+    def select(self, size, exclude):
+        """ return rows of the size nearest users not in exclude """
+        is_kept = np.ones(len(self._weighted_profiles), dtype=bool)
+        is_kept[self._blocked_rows] = False
+        is_kept[exclude] = False
+        cand_rows = np.flatnonzero(is_kept)
+        if self._dist_row is None:
+            cand_dist = self._weighted_profiles.dist_block([self._row], cand_rows)[0]
+        else:
+            cand_dist = self._dist_row[cand_rows]
+            # pre-computed distances are released after the first ranking
+            self._dist_row = None
+        return cand_rows[_argsmallest(cand_dist, size)]
+
+
+def _argsmallest(x, k):
+    """ return positions of k smallest values of x in ascending order,
+        ties are ordered by position
+    """
+    if k >= len(x):
+        return np.argsort(x, kind='mergesort')
+    kth_val = np.partition(x, k - 1)[k - 1]
+    below = np.flatnonzero(x < kth_val)
+    ties = np.flatnonzero(x == kth_val)[:k - len(below)]
+    selected = np.concatenate((below, ties))
+    return selected[np.argsort(x[selected], kind='mergesort')]
@@ -0,0 +1,175 @@
+""" Approximate nearest-neighbour candidate retrieval for user recommenders
+Author: Yi Zhang <beingzy@gmail.com>
+Date: 2016/05/28
+"""
+import numpy as np
+
+
+class IVFCandidateIndex(object):
+    """ inverted-file (IVF) index over the euclidean embedding of encoded
+    user profiles. users are clustered by k-means into n_lists inverted
+    lists; a query probes the n_probe lists with the nearest centroids,
+    re-ranks their members with the exact weighted distance and returns
+    the nearest n_candidates of them. n_probe is the recall/latency knob:
+    n_probe = n_lists is an exact (brute-force) search.
+
+    Example:
+    --------
+    cand_index = IVFCandidateIndex(n_probe=4, random_state=0)
+    cand_index.fit(dist_wrapper, encoded_profiles)
+    rows, dists = cand_index.search(row, exclude_rows=blocked_rows)
+    cand_index.recall_report(size=5)
+    """
+
+    def __init__(self, n_lists=None, n_probe=1, n_candidates=None, n_iter=10, random_state=None):
+        """ instance initilization function
+
+        Parameters:
+        ----------
+        * n_lists: <integer> number of inverted lists, sqrt(n_users) if None
+        * n_probe: <integer> number of lists probed per query
+        * n_candidates: <integer> maximum number of re-ranked candidates
+            returned per query, all members of probed lists if None
+        * n_iter: <integer> number of k-means iterations
+        * random_state: <integer> seed of k-means initialization
+        """
+        self._n_lists = n_lists
+        self._n_probe = n_probe
+        self._n_candidates = n_candidates
+        self._n_iter = n_iter
+        self._random_state = random_state
+        self._dist_wrapper = None
+        self._encoded_profiles = None
+
+    def set_n_probe(self, n_probe):
+        self._n_probe = n_probe
+
+    def fit(self, dist_wrapper, encoded_profiles):
+        """ build the index with the current weights of dist_wrapper
+
+        Parameters:
+        ----------
+        * dist_wrapper: <GeneralDistanceWrapper> metric of exact re-ranking
+        * encoded_profiles: <EncodedProfiles> output of dist_wrapper.encode()
+        """
+        self._dist_wrapper = dist_wrapper
+        self._encoded_profiles = encoded_profiles
+        embedded = dist_wrapper.embed(encoded_profiles)
+        n_users = embedded.shape[0]
+
+        n_lists = self._n_lists
+        if n_lists is None:
+            n_lists = int(np.ceil(np.sqrt(n_users)))
+        n_lists = max(1, min(n_lists, n_users))
+
+        centroids, labels = _kmeans(embedded, n_lists, self._n_iter, np.random.RandomState(self._random_state))
+        # inverted lists in CSR layout: members of list k are
+        # self._list_rows[self._list_offsets[k]:self._list_offsets[k + 1]]
+        self._list_rows = np.argsort(labels, kind='mergesort')
+        self._list_offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=n_lists))))
+        self._centroids = centroids
+        self._embedded = embedded
+        return self
+
+    def search(self, row, exclude_rows=None, n_probe=None):
+        """ return nearest candidates of user (row) ordered by exact distance
+
+        Parameters:
+        ----------
+        * row: <integer> row of the query user
+        * exclude_rows: <vector-like, integer> rows never returned, e.g.
+            the query user and connected users
+        * n_probe: <integer> overwrite n_probe of the index
+
+        Returns:
+        -------
+        * (rows <numpy.ndarray>, dists <numpy.ndarray>)
+        """
+        if self._encoded_profiles is None:
+            raise ValueError("IVFCandidateIndex is not fitted yet, call .fit() first!")
+        if n_probe is None:
+            n_probe = self._n_probe
+        n_probe = max(1, min(n_probe, len(self._centroids)))
+
+        query = self._embedded[row]
+        centroid_dist = np.square(self._centroids - query).sum(axis=1)
+        probed = np.argsort(centroid_dist, kind='mergesort')[:n_probe]
+        cand_rows = np.concatenate([self._list_rows[self._list_offsets[kk]:self._list_offsets[kk + 1]]
+                                    for kk in probed])
+
+        if not exclude_rows is None and len(exclude_rows) > 0:
+            is_kept = np.ones(len(self._embedded), dtype=bool)
+            is_kept[np.asarray(exclude_rows, dtype=np.intp)] = False
+            cand_rows = cand_rows[is_kept[cand_rows]]
+        if len(cand_rows) == 0:
+            return cand_rows, np.empty(0, dtype=np.float64)
+
+        # exact re-ranking of probed candidates
+        cand_rows = np.sort(cand_rows)
+        dists = self._dist_wrapper.dist_euclidean_encoded(self._encoded_profiles, row, cand_rows)
+        order = np.argsort(dists, kind='mergesort')
+        if not self._n_candidates is None:
+            order = order[:self._n_candidates]
+        return cand_rows[order], dists[order]
+
+    def recall_report(self, size=5, rows=None, n_probe=None, sample_size=100):
+        """ compare top-size candidates of search() with exact search
+
+        Parameters:
+        ----------
+        * size: <integer> number of nearest users compared per query
+        * rows: <vector-like, integer> rows of query users, a sample of
+            sample_size users is drawn if None
+        * n_probe: <integer> overwrite n_probe of the index
+
+        Returns:
+        -------
+        * report: <dictionary> {"recall": mean recall@size,
+            "n_queries": number of queries,
+            "mean_candidates": mean number of re-ranked candidates}
+        """
+        n_users = len(self._embedded)
+        if rows is None:
+            rng = np.random.RandomState(self._random_state)
+            rows = rng.choice(n_users, min(sample_size, n_users), replace=False)
+
+        recalls, n_cands = [], []
+        for row in rows:
+            approx_rows, _ = self.search(row, exclude_rows=[row], n_probe=n_probe)
+            n_cands.append(len(approx_rows))
+            exact_dists = self._dist_wrapper.dist_euclidean_encoded(self._encoded_profiles, row)
+            exact_dists[row] = np.inf
+            exact_rows = np.argsort(exact_dists, kind='mergesort')[:min(size, n_users - 1)]
+            if len(exact_rows) > 0:
+                recalls.append(len(np.intersect1d(approx_rows[:size], exact_rows)) / float(len(exact_rows)))
+
+        return {"recall": float(np.mean(recalls)) if len(recalls) > 0 else 1.0,
+                "n_queries": len(rows),
+                "mean_candidates": float(np.mean(n_cands)) if len(n_cands) > 0 else 0.0}
+
+
+def _kmeans(x, n_clusters, n_iter, rng):
+    """ Lloyd's k-means, return (centroids, labels) """
+    centroids = x[rng.choice(len(x), n_clusters, replace=False)].copy()
+    labels = _assign(x, centroids)
+    for _ in range(n_iter):
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.column_stack([np.bincount(labels, weights=x[:, jj], minlength=n_clusters)
+                                for jj in range(x.shape[1])])
+        is_empty = counts == 0
+        centroids[~is_empty] = sums[~is_empty] / counts[~is_empty, None]
+        # reseed empty clusters with random users
+        if is_empty.any():
+            centroids[is_empty] = x[rng.choice(len(x), is_empty.sum(), replace=False)]
+        labels = _assign(x, centroids)
+    return centroids, labels
+
+
+def _assign(x, centroids, chunk_size=1 << 14):
+    """ return index of the nearest centroid of every row of x """
+    sq_norms = np.square(centroids).sum(axis=1)[None, :]
+    labels = np.empty(len(x), dtype=np.intp)
+    for start in range(0, len(x), chunk_size):
+        sq_dist = sq_norms - 2 * x[start:start + chunk_size].dot(centroids.T)
+        labels[start:start + chunk_size] = np.argmin(sq_dist, axis=1)
+    return labels
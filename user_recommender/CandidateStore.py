@@ -0,0 +1,78 @@
+""" Store of candidate cursors per user
+Author: Yi Zhang <beingzy@gmail.com>
+Date: 2016/05/30
+"""
+
+
+class CandidateStore(object):
+    """ dictionary-like container of CandidateCursor per user, which
+    reports the number of remaining candidates and the memory held by the
+    cursors without materializing any candidate list.
+
+    Example:
+    --------
+    store = CandidateStore()
+    store[user_id] = cursor
+    store.total_size() # number of remaining candidates of all users
+    store.memory_report()
+    """
+
+    def __init__(self):
+        self._cursors = {}
+
+    def __len__(self):
+        return len(self._cursors)
+
+    def __contains__(self, user_id):
+        return user_id in self._cursors
+
+    def __iter__(self):
+        return iter(self._cursors)
+
+    def __getitem__(self, user_id):
+        return self._cursors[user_id]
+
+    def __setitem__(self, user_id, cursor):
+        self._cursors[user_id] = cursor
+
+    def __delitem__(self, user_id):
+        del self._cursors[user_id]
+
+    def get(self, user_id, default=None):
+        return self._cursors.get(user_id, default)
+
+    def keys(self):
+        return self._cursors.keys()
+
+    def values(self):
+        return self._cursors.values()
+
+    def items(self):
+        return self._cursors.items()
+
+    def update(self, cursors):
+        self._cursors.update(cursors)
+
+    def clear(self):
+        self._cursors.clear()
+
+    def size(self, user_id):
+        """ return number of remaining candidates of user_id """
+        return len(self._cursors[user_id])
+
+    def total_size(self):
+        """ return number of remaining candidates of all users """
+        return sum(len(cursor) for cursor in self._cursors.values())
+
+    def nbytes(self):
+        """ return bytes held by the cursors """
+        return sum(cursor.nbytes for cursor in self._cursors.values())
+
+    def memory_report(self):
+        """ return {"n_users": number of users with cursors,
+                    "n_candidates": number of remaining candidates,
+                    "nbytes": bytes held by the cursors}
+        """
+        return {"n_users": len(self._cursors),
+                "n_candidates": self.total_size(),
+                "nbytes": self.nbytes()}
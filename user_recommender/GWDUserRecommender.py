@@ -2,11 +2,17 @@
 Author: Yi Zhang <beingzy@gmail.com>
 Date: 2016/04/05
 """
+import copy
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from numpy import array, vstack
 from pandas import DataFrame
 from . import UserRecommenderMixin
 from ..groupwise_distance_learning.groupwise_distance_learner import GroupwiseDistLearner
 from ..distance_metrics import GeneralDistanceWrapper
+from .CandidateCursor import CandidateCursor
+from .CandidateStore import CandidateStore
 
 
 def _consolidate_learned_info(gwd_learner, buffer_min_size=1):
@@ -26,9 +32,11 @@ def _consolidate_learned_info(gwd_learner, buffer_min_size=1):
     if buffer_min_size is None:
         buffer_min_size = 20
 
-    # extract learned information
-    fit_weights = gwd_learner.get_groupwise_weights()
+    # extract learned information, copied to keep the learner's
+    # solution intact for warm start
+    fit_weights = dict(gwd_learner.get_groupwise_weights())
     fit_groups, buffer_group = gwd_learner.get_user_cluster()
+    fit_groups = {gid: list(gg_user_ids) for gid, gg_user_ids in fit_groups.items()}
 
     # process buffer group
     group_ids = list(fit_groups.keys())
@@ -52,10 +60,22 @@ def _consolidate_learned_info(gwd_learner, buffer_min_size=1):
     return fit_weights, fit_groups
 
 
+def _learn_groupwise(gwd_learner, user_ids, user_profiles, user_connections, buffer_min_size):
+    """ fit gwd_learner on a snapshot of the network, run by the executor
+        of background relearning. It returns (gwd_learner, fit_weights,
+        fit_groups, seconds of learning)
+    """
+    start_time = time()
+    gwd_learner.fit(user_ids, user_profiles, user_connections)
+    fit_weights, fit_groups = _consolidate_learned_info(gwd_learner, buffer_min_size)
+    return gwd_learner, fit_weights, fit_groups, time() - start_time
+
+
 class GWDUserRecommender(UserRecommenderMixin):
 
     def __init__(self, user_ids, user_profiles, user_connections, only_init_learn=False,
-                 update_iter_period=None, **kwargs):
+                 update_iter_period=None, async_learning=False, learning_executor=None,
+                 on_model_swap=None, **kwargs):
         """ instance initilization function
         Parameters:
         ===========
@@ -66,6 +86,14 @@ class GWDUserRecommender(UserRecommenderMixin):
         * only_init_learn: boolean
             True: GroupwiseDistLearner only learn user_group and groupwise distance at one time
             False: GroupwiseDistLearner will learn every time
+        * async_learning: boolean
+            True: relearning after the initial learning runs in background on a
+            snapshot of the network, suggestions are served by the last learned
+            model until the new one is swapped in
+        * learning_executor: <concurrent.futures.Executor> executor of background
+            relearning, a single-thread executor is used if None
+        * on_model_swap: <function> called with the stats of every finished
+            relearning, failed ones included, see get_learning_status()
         """
 
         super().__init__()
@@ -99,7 +127,7 @@ class GWDUserRecommender(UserRecommenderMixin):
         self._pdm_container = {}
         # store orderred unconnected users
         # and the container will be reset per distance metrics update
-        self._ordered_cand_dict = {}
+        self._ordered_cand_dict = CandidateStore()
         # store users had been ever recommended
         self._recommended_user_dict = {}
 
@@ -114,6 +142,26 @@ class GWDUserRecommender(UserRecommenderMixin):
             # overwrite init_ if update_iter_period had been set
             self._only_init_learn = False
 
+        # load distance wrapper
+        self._gd_wrapper = GeneralDistanceWrapper()
+        self._gd_wrapper.fit(user_profiles)
+        # encode user profiles into numeric/categorical blocks
+        self._encoded_profiles = self._gd_wrapper.encode(user_profiles)
+        # profiles projected under every group's weights
+        self._group_profiles = {}
+        # position of user's group in self._all_group_ids per row, -1 if none
+        self._user_group_pos = np.empty(0, dtype=np.int32)
+
+        # background relearning
+        self._async_learning = async_learning
+        self._learning_executor = learning_executor
+        # executor created by the recommender is shut down by close()
+        self._owns_executor = False
+        self._on_model_swap = on_model_swap
+        self._learning_future = None
+        self._learning_submitted = None
+        self._learning_stats = None
+
         # equip with GWD leanner
         self.gwd_learner = GroupwiseDistLearner(**kwargs)
         # initiate learning
@@ -121,29 +169,42 @@ class GWDUserRecommender(UserRecommenderMixin):
         # marker for information updated
         self._is_updated = False
 
-        # load distance wrapper
-        self._gd_wrapper = GeneralDistanceWrapper()
-        self._gd_wrapper.fit(user_profiles)
-
     def _get_distance(self, a_user_id, b_user_id):
         """ calcualte two users's distance from user a's group weights
         """
-        a_user_idx = [i for i, uid in enumerate(self._user_ids) if uid == a_user_id][0]
-        b_user_idx = [i for i, uid in enumerate(self._user_ids) if uid == b_user_id][0]
-        a_user_profile = self._user_profiles[a_user_idx, :]
-        b_user_profile = self._user_profiles[b_user_idx, :]
-
+        a_user_idx = self._user_index[a_user_id]
+        b_user_idx = self._user_index[b_user_id]
         gid = self._return_user_group(a_user_id)
-        weights = self._fit_weights[gid]
-        self._gd_wrapper.load_weights(weights)
-        return self._gd_wrapper.dist_euclidean(a_user_profile, b_user_profile)
+        weighted_profiles = self._group_profiles[gid]
+        return weighted_profiles.dist_block([a_user_idx], [b_user_idx])[0, 0]
 
     def _return_user_group(self, user_id):
         """ return group key of a given user
         """
+        group_pos = self._user_group_pos[self._user_index[user_id]]
+        if group_pos >= 0:
+            return self._all_group_ids[group_pos]
+
+    def _update_group_profiles(self):
+        """ project profiles under every group's weights and locate the
+            group of every user, once per learning
+        """
+        self._group_profiles = {}
         for gid in self._all_group_ids:
-            if user_id in self._fit_groups[gid]:
-                return gid
+            self._gd_wrapper.load_weights(self._fit_weights[gid])
+            self._group_profiles[gid] = self._gd_wrapper.project(self._encoded_profiles)
+
+        self._user_group_pos = np.full(len(self._user_index), -1, dtype=np.int32)
+        # assign in reverse order, the first group wins for users in many groups
+        for group_pos in range(len(self._all_group_ids) - 1, -1, -1):
+            group_user_ids = self._fit_groups[self._all_group_ids[group_pos]]
+            rows = self._user_index.rows([uid for uid in group_user_ids if uid in self._user_index])
+            self._user_group_pos[rows] = group_pos
+        if (self._user_group_pos < 0).any():
+            # users unknown to the learned model, e.g. joined while a
+            # background relearning is in flight, are served by even weights
+            self._gd_wrapper.load_weights(None)
+            self._group_profiles[None] = self._gd_wrapper.project(self._encoded_profiles)
 
     def _triger_groupwise_learning(self):
         # initial the learning of embedded GDL algorithm
@@ -157,7 +218,7 @@ class GWDUserRecommender(UserRecommenderMixin):
                                      self._user_profiles,
                                      self._user_connections)
                 # reset candidate
-                self._ordered_cand_dict = {}
+                self._ordered_cand_dict = CandidateStore()
 
         # check if updating the GDL model is needed
         if self._only_init_learn:
@@ -170,6 +231,11 @@ class GWDUserRecommender(UserRecommenderMixin):
                 update_period = 1
 
             if current_iter % update_period == 0:
+                if self._async_learning and len(self._fit_weights) > 0:
+                    # keep serving the current model while relearning
+                    self._submit_learning()
+                    self._update_group_profiles()
+                    return
                 # update distance metrics
                 self.gwd_learner.fit(self._user_ids,
                                      self._user_profiles,
@@ -180,10 +246,108 @@ class GWDUserRecommender(UserRecommenderMixin):
             else:
                 fit_weights, fit_groups = _consolidate_learned_info(self.gwd_learner,
                                                                     self._buffer_min_size)
+        self._load_learned_model(fit_weights, fit_groups)
+
+    def _load_learned_model(self, fit_weights, fit_groups):
+        served_weights = {uid: self._user_weights(uid) for uid in self._ordered_cand_dict}
         # update attribute
         self._fit_weights = fit_weights
         self._fit_groups = fit_groups
         self._all_group_ids = list(fit_groups.keys())
+        self._update_group_profiles()
+        # candidates ordered under outdated weights are ranked again on demand
+        for uid, weights in served_weights.items():
+            if self._user_weights(uid) != weights:
+                del self._ordered_cand_dict[uid]
+
+    def _user_weights(self, user_id):
+        """ return weights of user's group as list, None for even weights """
+        gid = self._return_user_group(user_id)
+        if not gid is None:
+            return np.asarray(self._fit_weights[gid], dtype=np.float64).tolist()
+
+    def _submit_learning(self):
+        """ relearn groups in background on a snapshot of the network,
+            no-op while a relearning is in flight
+        """
+        if not self._learning_future is None:
+            return
+        if self._learning_executor is None:
+            self._learning_executor = ThreadPoolExecutor(max_workers=1)
+            self._owns_executor = True
+        # the serving learner is never fitted concurrently
+        gwd_learner = copy.deepcopy(self.gwd_learner)
+        self._learning_submitted = (self._iter_counter, time())
+        self._learning_future = self._learning_executor.submit(_learn_groupwise, gwd_learner,
+                                                               list(self._user_ids),
+                                                               self._user_profiles,
+                                                               self._user_connections,
+                                                               self._buffer_min_size)
+
+    def _swap_learned_model(self, wait=False):
+        """ swap in the model of a finished background relearning, all
+            learned attributes are replaced together before serving resumes,
+            and ordered candidates of users whose group weights changed are
+            dropped. It returns True if a model is swapped in.
+        """
+        future = self._learning_future
+        if future is None or not (wait or future.done()):
+            return False
+        self._learning_future = None
+        try:
+            gwd_learner, fit_weights, fit_groups, learn_seconds = future.result()
+            error = None
+        except Exception as err:
+            # a failed relearning keeps the current model serving
+            learn_seconds, error = None, err
+        else:
+            self.gwd_learner = gwd_learner
+            self._load_learned_model(fit_weights, fit_groups)
+
+        submit_iter, submit_time = self._learning_submitted
+        self._learning_stats = {"submit_iter": submit_iter,
+                                "swap_iter": self._iter_counter,
+                                "staleness": self._iter_counter - submit_iter,
+                                "learn_seconds": learn_seconds,
+                                "latency_seconds": time() - submit_time,
+                                "error": error}
+        if not self._on_model_swap is None:
+            self._on_model_swap(dict(self._learning_stats))
+        return error is None
+
+    def wait_learning(self):
+        """ block until the background relearning in flight (if any) is
+            swapped in, it returns True if a model is swapped in
+        """
+        return self._swap_learned_model(wait=True)
+
+    def close(self):
+        """ swap in the background relearning in flight (if any) and shut
+            down the executor created by the recommender, an executor given
+            as learning_executor is left running
+        """
+        self.wait_learning()
+        if self._owns_executor:
+            self._learning_executor.shutdown()
+            self._learning_executor = None
+            self._owns_executor = False
+
+    def get_learning_status(self):
+        """ return {"is_learning": a relearning is in flight,
+                    "pending_iters": iterations since the relearning in flight
+                        was submitted,
+                    "last_swap": stats of the last finished relearning:
+                        {"submit_iter", "swap_iter", "staleness" (iterations
+                        served by the outdated model), "learn_seconds",
+                        "latency_seconds" (submission to swap), "error" (the
+                        exception of a failed relearning whose model is not
+                        swapped in, None otherwise)}}
+        """
+        is_learning = not self._learning_future is None
+        pending_iters = self._iter_counter - self._learning_submitted[0] if is_learning else 0
+        return {"is_learning": is_learning,
+                "pending_iters": pending_iters,
+                "last_swap": None if self._learning_stats is None else dict(self._learning_stats)}
 
     def set_recommendation_size(self, size=5):
         self._size = size
@@ -191,12 +355,14 @@ class GWDUserRecommender(UserRecommenderMixin):
     def update(self, **kwargs):
         """ update social network
         """
+        self._swap_learned_model()
         if "user_ids" in kwargs.keys():
             self.load_user_ids(kwargs["user_ids"])
             self._is_updated = True
 
         if "user_profiles" in kwargs.keys():
             self.load_user_profiles(kwargs["user_profiles"])
+            self._encoded_profiles = self._gd_wrapper.encode(self._user_profiles)
             self._is_updated = True
 
         if "user_connections" in kwargs.keys():
@@ -218,45 +384,26 @@ class GWDUserRecommender(UserRecommenderMixin):
             else:
                 raise ValueError("illegal new_user_connections data is provided !")
         self._user_connections = vstack((self._user_connections, new_user_connections))
+        self._index_connections(new_user_connections)
         self._is_updated = True
 
-    def get_connected_users(self, user_id):
-        """ return a list of user who are connceted with the target user"""
-        b_user_ids = [pp[1] for pp in self._user_connections if pp[0] == user_id]
-        a_user_ids = [pp[0] for pp in self._user_connections if pp[1] == user_id]
-        return list(set(b_user_ids + a_user_ids))
-
     def gen_suggestion(self, user_id, block_list=[]):
         """ generate recommendation list for target user: user_id
         """
         size = self._size
+        self._swap_learned_model()
 
         # get a complete list of recommended user ordered
         # by distance
         if user_id in self._ordered_cand_dict:
-            # retrieve the order commendation list
-            sorted_cand_uids = self._ordered_cand_dict[user_id]
-            # remove candidates in block_list
-            if len(sorted_cand_uids) > size:
-                suggestion = sorted_cand_uids[:size]
-                del self._ordered_cand_dict[user_id][:size]
-            else:
-                suggestion = sorted_cand_uids
-                self._ordered_cand_dict[user_id] = []
-
-            # store recommended users
-            if user_id in self._recommended_user_dict:
-                self._recommended_user_dict[user_id].append(suggestion)
-            else:
-                self._recommended_user_dict[user_id] = suggestion
-
+            # retrieve the next candidates of the ordered list
+            suggestion = self._ordered_cand_dict[user_id].next(size)
+            self._store_recommended(user_id, suggestion)
             return suggestion
 
         else:
             # first time to rank candidates since late update of GDL algorithm
             user_gid = self._return_user_group(user_id)
-            # list all possible condidates
-            cand_user_ids = self._user_ids
             # remove connected users
             block_list = self.get_connected_users(user_id)
             block_list.append(user_id)
@@ -265,29 +412,44 @@ class GWDUserRecommender(UserRecommenderMixin):
                 recommended = self._recommended_user_dict[user_id]
                 block_list.extend(recommended)
 
-            cand_user_ids = [uid for uid in cand_user_ids if not uid in block_list]
-            cand_user_dist = [None] * len(cand_user_ids)
-            if len(cand_user_ids) > 0:
-                for ii, cand_user_id in enumerate(cand_user_ids):
-                    cand_user_dist[ii] = self._get_distance(user_id, cand_user_id)
-
-            # sort candidates by distance
-            sorted_list = sorted(zip(cand_user_ids, cand_user_dist), key=lambda pp: pp[1])
-            sorted_cand_uids = [uid for uid, _ in sorted_list]
-
-            # list in dicitonary is immutable
-            # sorted_cand_uids is a pointer to
-            # the element of a dicitonary
-            suggestion = sorted_cand_uids[:size]
-            del sorted_cand_uids[:size]
-
-            # append the ordered list
-            self._ordered_cand_dict[user_id] = sorted_cand_uids.copy()
-
-            # append to ever recommended list
-            if user_id in self._recommended_user_dict:
-                self._recommended_user_dict[user_id].append(suggestion)
-            else:
-                self._recommended_user_dict[user_id] = suggestion
+            # candidates are ranked on demand from profiles projected
+            # under the group weights
+            cand_cursor = CandidateCursor.from_profiles(self._user_index, self._group_profiles[user_gid],
+                                                        self._user_index[user_id],
+                                                        self._get_blocked_rows(block_list))
+            self._ordered_cand_dict[user_id] = cand_cursor
+            suggestion = cand_cursor.next(size)
+            self._store_recommended(user_id, suggestion)
+            return suggestion
 
-            return suggestion
\ No newline at end of file
+    def gen_suggestions_batch(self, user_ids):
+        """ generate recommendations for many users at once, users without
+            ordered candidates are ranked group by group, each group as one
+            matrix block under the group's weights
+        """
+        self._swap_learned_model()
+        new_user_ids = [uid for uid in dict.fromkeys(user_ids) if not uid in self._ordered_cand_dict]
+        group_user_ids = {}
+        for uid in new_user_ids:
+            group_user_ids.setdefault(self._return_user_group(uid), []).append(uid)
+
+        for gid, gg_user_ids in group_user_ids.items():
+            block_lists = [self.get_connected_users(uid) + [uid] + self._recommended_user_dict.get(uid, [])
+                           for uid in gg_user_ids]
+            cursors = self._rank_candidates(self._user_index.rows(gg_user_ids), block_lists,
+                                            self._group_profiles[gid], self._size)
+            self._ordered_cand_dict.update(zip(gg_user_ids, cursors))
+
+        suggestions = []
+        for uid in user_ids:
+            suggestion = self._ordered_cand_dict[uid].next(self._size)
+            self._store_recommended(uid, suggestion)
+            suggestions.append(suggestion)
+        return suggestions
+
+    def _store_recommended(self, user_id, suggestion):
+        """ append suggestion to the users ever recommended to user_id """
+        if user_id in self._recommended_user_dict:
+            self._recommended_user_dict[user_id].extend(suggestion)
+        else:
+            self._recommended_user_dict[user_id] = list(suggestion)
\ No newline at end of file
@@ -2,15 +2,29 @@
 Author: Yi Zhang <beingzy@gmail.com>
 Date: 2016/02/20
 """
+import numpy as np
 from numpy import array, vstack
 from . import UserRecommenderMixin
 from ..distance_metrics import GeneralDistanceWrapper
 from .PairwiseDistMatrix import PairwiseDistMatrix
+from .CandidateCursor import CandidateCursor
+from .CandidateStore import CandidateStore
 
 
 class NNUserRecommender(UserRecommenderMixin):
 
-    def __init__(self, user_ids, user_profiles, user_connections, weights=None):
+    def __init__(self, user_ids, user_profiles, user_connections, weights=None, cand_index=None):
+        """ instance initilization function
+
+        Parameters:
+        ===========
+        * user_ids: <list> a list of unique user ids
+        * user_profiles: <matrix-like> a numpy.array of user profile
+        * user_connections: <matrix-like> pair-wise connections
+        * weights: <vector-like> weights of distance metrics
+        * cand_index: <IVFCandidateIndex> approximate index retrieving
+            candidates, candidates are searched exhaustively if None
+        """
         super().__init__()
         # load user-related information
         self.load_user_ids(user_ids)
@@ -20,7 +34,7 @@ class NNUserRecommender(UserRecommenderMixin):
         # store ordered un-connected users
         # which would be reset per every
         # distance metrics update
-        self._ordered_cand_dict = {}
+        self._ordered_cand_dict = CandidateStore()
 
         # load generalized distance wrapper to deal with cateogrical features
         self._gd_wrapper = GeneralDistanceWrapper()
@@ -28,6 +42,12 @@ class NNUserRecommender(UserRecommenderMixin):
         self._gd_wrapper.fit(self._user_profiles)
         # initiate default weights for distance caluclation
         self._gd_wrapper.load_weights(weights)
+        # encode user profiles into numeric/categorical blocks
+        self._encoded_profiles = self._gd_wrapper.encode(self._user_profiles)
+        # pair-wise distance matrix, built by the first update()
+        self._dist_matrix = None
+        # approximate candidate retrieval
+        self.set_candidate_index(cand_index)
 
         # defulat maximum number of suggsetion per recommendation query
         self._size = 5
@@ -35,13 +55,24 @@ class NNUserRecommender(UserRecommenderMixin):
         # store ordered un-connected users
         # which would be reset per every
         # distance metrics update
-        self._ordered_cand_dict = {}
+        self._ordered_cand_dict = CandidateStore()
         self._rejected_user_dict = {}
 
     def _update_dist_func(self):
         self._gd_wrapper.fit(self._user_profiles)
-        fit_dist_func = self._gd_wrapper.dist_euclidean
-        self._dist_matrix.set_dist_func(fit_dist_func)
+        self._encoded_profiles = self._gd_wrapper.encode(self._user_profiles)
+        if not self._cand_index is None:
+            self._cand_index.fit(self._gd_wrapper, self._encoded_profiles)
+
+    def set_candidate_index(self, cand_index=None):
+        """ plug in index retrieving candidates approximately, it is fitted
+            to the current profiles and weights. None restores the exact
+            exhaustive search.
+        """
+        self._cand_index = cand_index
+        if not cand_index is None:
+            cand_index.fit(self._gd_wrapper, self._encoded_profiles)
+        self._ordered_cand_dict = CandidateStore()
 
     def set_recommendation_size(self, size=5):
         self._size = size
@@ -49,14 +80,27 @@ class NNUserRecommender(UserRecommenderMixin):
     def _get_distance(self, a_user_id, b_user_id):
         """ return distance between two user
         """
-        a_user_idx = [i for i, uid in enumerate(self._user_ids) if uid == a_user_id][0]
-        b_user_idx = [i for i, uid in enumerate(self._user_ids) if uid == b_user_id][0]
+        a_user_idx = self._user_index[a_user_id]
+        b_user_idx = self._user_index[b_user_id]
         a_user_profile = self._user_profiles[a_user_idx, :]
         b_user_profile = self._user_profiles[b_user_idx, :]
         return self._gd_wrapper.dist_euclidean(a_user_profile, b_user_profile)
 
     def update(self, **kwargs):
-        """ update social network """
+        """ update social network
+
+        Parameters:
+        ----------
+        * user_ids: <list> user ids, users appended to the current user ids
+            are added to the distance matrix without rebuilding it
+        * user_profiles: <matrix-like> user profiles ordered by user_ids
+        * user_connections: <matrix-like> pair-wise connections
+        * changed_user_ids: <list> users whose profiles changed, they are
+            detected from user_profiles if not provided
+        """
+        old_user_ids = self._user_ids
+        old_encoded_profiles = self._encoded_profiles
+
         if "user_ids" in kwargs.keys():
             self.load_user_ids(kwargs["user_ids"])
 
@@ -69,10 +113,31 @@ class NNUserRecommender(UserRecommenderMixin):
 
         # update distance matrix
         if "user_ids" in kwargs.keys() or "user_profiles" in kwargs.keys():
-            # !!!! --- SHOULD REMOVE THIS LINE DUE TO UN_MATCHED DISTANCE WEIGHTS
+            self._update_dist_matrix(old_user_ids, old_encoded_profiles,
+                                     kwargs.get("changed_user_ids", None))
+            # ordered candidates are outdated by the new distances
+            self._ordered_cand_dict = CandidateStore()
+
+    def _update_dist_matrix(self, old_user_ids, old_encoded_profiles, changed_user_ids=None):
+        """ recalculate distances involving new or changed users, distance
+            matrix is rebuilt if existing users are removed or reordered
+        """
+        n_old = len(old_user_ids)
+        new_user_ids = list(self._user_ids)
+        is_appended = new_user_ids[:n_old] == list(old_user_ids)
+
+        if changed_user_ids is None and is_appended:
+            changed_rows = _changed_rows(old_encoded_profiles, self._encoded_profiles)
+            if not changed_rows is None:
+                changed_user_ids = [new_user_ids[ii] for ii in changed_rows]
+
+        if self._dist_matrix is None or not is_appended or changed_user_ids is None:
             self._dist_matrix = PairwiseDistMatrix(self._user_ids, self._user_profiles)
-            # self._dist_matrix.set_dist_func()
+            self._dist_matrix.set_dist_func(dist_wrapper=self._gd_wrapper)
             self._dist_matrix.update_distance_matrix()
+        else:
+            self._dist_matrix.update_users(self._user_profiles, changed_user_ids,
+                                           new_user_ids[n_old:])
 
     def add_new_connections(self, new_user_connections):
         """ add new user connections """
@@ -83,29 +148,16 @@ class NNUserRecommender(UserRecommenderMixin):
             else:
                 raise ValueError("illegal new_user_connections data is provided !")
         self._user_connections = vstack((self._user_connections, new_user_connections))
-
-    def get_connected_users(self, user_id):
-        """ return a list of user who are connceted with the target user"""
-        b_user_ids = [pp[1] for pp in self._user_connections if pp[0] == user_id]
-        a_user_ids = [pp[0] for pp in self._user_connections if pp[1] == user_id]
-        return list(set(b_user_ids + a_user_ids))
+        self._index_connections(new_user_connections)
 
     def gen_suggestion(self, user_id, block_list=[]):
         """ generate recommendation for a specified user """
         size = self._size
 
         if user_id in self._ordered_cand_dict:
-            sorted_cand_uids = self._ordered_cand_dict[user_id]
-            if len(sorted_cand_uids) > size:
-                suggestion = sorted_cand_uids[:size]
-                del self._ordered_cand_dict[user_id][:size]
-            else:
-                suggestion = sorted_cand_uids
-                self._ordered_cand_dict[user_id] = []
-            return suggestion
+            return self._ordered_cand_dict[user_id].next(size)
 
         else:
-            cand_user_ids = self._user_ids
             con_user_ids = self.get_connected_users(user_id)
             if len(block_list) == 0:
                 block_list = con_user_ids + [user_id]
@@ -113,22 +165,37 @@ class NNUserRecommender(UserRecommenderMixin):
                 block_list.extend(con_user_ids + [user_id])
 
             # remove connected users from condidate list
-            keep_idx = [ii for ii, uid in enumerate(cand_user_ids) if not uid in block_list]
-            cand_user_ids = [cand_user_ids[ii] for ii in keep_idx]
-            cand_user_dist = []
-            for ii, cand_user_id in enumerate(cand_user_ids):
-                dist = self._get_distance(user_id, cand_user_id)
-                cand_user_dist.append(dist)
-
-            # sort candidates by distance
-            sorted_list = sorted(zip(cand_user_ids, cand_user_dist), key=lambda pp: pp[1])
-            sorted_cand_uids = [uid for uid, _ in sorted_list]
+            block_rows = self._get_blocked_rows(block_list)
+            user_idx = self._user_index[user_id]
+            if not self._cand_index is None:
+                # approximate retrieval with exact re-ranking
+                cand_rows, cand_user_dist = self._cand_index.search(user_idx, block_rows)
+                cand_cursor = CandidateCursor(self._user_index.ids(cand_rows), cand_user_dist)
+            else:
+                # candidates are ranked on demand from the projected profiles
+                weighted_profiles = self._gd_wrapper.project(self._encoded_profiles)
+                cand_cursor = CandidateCursor.from_profiles(self._user_index, weighted_profiles,
+                                                            user_idx, block_rows)
+            self._ordered_cand_dict[user_id] = cand_cursor
+            return cand_cursor.next(size)
+
+    def gen_suggestions_batch(self, user_ids):
+        """ generate recommendations for many users at once, distances of
+            users without ordered candidates are computed as one matrix
+            block
+        """
+        if not self._cand_index is None:
+            return super().gen_suggestions_batch(user_ids)
 
-            suggestion = sorted_cand_uids[:size]
-            del sorted_cand_uids[:size]
-            self._ordered_cand_dict[user_id] = sorted_cand_uids.copy()
+        new_user_ids = [uid for uid in dict.fromkeys(user_ids) if not uid in self._ordered_cand_dict]
+        if len(new_user_ids) > 0:
+            block_lists = [self.get_connected_users(uid) + [uid] for uid in new_user_ids]
+            weighted_profiles = self._gd_wrapper.project(self._encoded_profiles)
+            cursors = self._rank_candidates(self._user_index.rows(new_user_ids), block_lists,
+                                            weighted_profiles, self._size)
+            self._ordered_cand_dict.update(zip(new_user_ids, cursors))
 
-            return suggestion
+        return [self._ordered_cand_dict[uid].next(self._size) for uid in user_ids]
 
     def update_reject_dict(self, user_id, rejected_list):
         if user_id in self._rejected_user_dict:
@@ -137,6 +204,21 @@ class NNUserRecommender(UserRecommenderMixin):
             self._rejected_user_dict[user_id] = rejected_list
 
 
+def _changed_rows(old_profiles, new_profiles):
+    """ return rows of old_profiles (EncodedProfiles) differing from the
+        leading rows of new_profiles, None if they are not comparable
+    """
+    n_old = len(old_profiles)
+    if len(new_profiles) < n_old or \
+        not np.array_equal(old_profiles.num_idx, new_profiles.num_idx) or \
+        not np.array_equal(old_profiles.cat_idx, new_profiles.cat_idx):
+        return None
+    is_changed = (old_profiles.num_values != new_profiles.num_values[:n_old]).any(axis=1)
+    is_changed |= (old_profiles.num_nulls != new_profiles.num_nulls[:n_old]).any(axis=1)
+    is_changed |= (old_profiles.cat_codes != new_profiles.cat_codes[:n_old]).any(axis=1)
+    return np.flatnonzero(is_changed)
+
+
 class DNNUserRecommender(NNUserRecommender):
     """ Directed Network verion of NNUserRecommender
     """
@@ -145,5 +227,4 @@ class DNNUserRecommender(NNUserRecommender):
         super().__init__()
 
     def get_connected_users(self, user_id):
-        user_ids = [pp[1] for pp in self._user_connections if pp[0] == user_id]
-        return user_ids
+        return list(self._user_successors.get(user_id, set()))
@@ -2,76 +2,441 @@
 Author: Yi Zhang <beingzy@gmail.com>
 Date: 2016/02/20
 """
+import os
+import json
+import warnings
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
 from pandas import DataFrame
-from itertools import combinations
 # from scipy.spatial.distance import euclidean
 from ..distance_metrics import GeneralDistanceWrapper
+from .UserIdIndex import UserIdIndex
+
+# number of distances computed per block, sized to keep a block
+# and its input factors within the CPU cache
+_BLOCK_ELEMENTS = 1 << 18
+
 
 class PairwiseDistMatrix(object):
+    """ condensed pair-wise distance matrix
+
+    Without target_user_ids, the distances of all N * (N - 1) / 2 user pairs
+    are kept in lower-triangular row-major order: the distance of rows
+    (i, j), j < i, is stored at i * (i - 1) / 2 + j. With target_user_ids,
+    each target user keeps a row of N - 1 distances to all other users.
+
+    With mmap_path, the condensed matrix is written to a .npy file and
+    accessed through numpy.memmap, so it may exceed the memory and can be
+    shared by several processes via PairwiseDistMatrix.load(mmap_path).
+    """
 
-    def __init__(self, user_ids, user_profiles, target_user_ids=None):
+    def __init__(self, user_ids, user_profiles, target_user_ids=None,
+                 dtype=np.float64, block_size=None, mmap_path=None):
         """ instance initilization function
 
         Parameters:
         ===========
         user_ids: <list> a list of unique user ids
-        user_profiles: <matrix-like> a numpy.array of user profile
+        user_profiles: <matrix-like> a numpy.array of user profile, it can be
+            None for a matrix which is loaded from disk only
         target_uer_ids: <list> a list of user whose distance in relation to other users
             will be  calculated only.
+        dtype: <numpy.dtype> float32 or float64 storage of distances
+        block_size: <integer> number of rows computed per block, it is
+            sized automatically if None
+        mmap_path: <string> path of .npy file backing the distance matrix,
+            distances are kept in memory if None
         """
         if isinstance(user_profiles, DataFrame):
             user_profiles = user_profiles.as_matrix()
 
-        if len(user_ids) != user_profiles.shape[0]:
+        if not user_profiles is None and len(user_ids) != user_profiles.shape[0]:
             nobs = len(user_ids)
             nrow = user_profiles.shape[0]
             raise ValueError("user_ids (nobs: %d) does not match user_profiles (nrow: %d)".format(nobs, nrow))
 
         # distance wrapper
-        dist_wrapper = GeneralDistanceWrapper()
-        dist_wrapper.fit(user_profiles)
-        self.set_dist_func(dist_wrapper.dist_euclidean)
+        if user_profiles is None:
+            self.set_dist_func(None)
+        else:
+            dist_wrapper = GeneralDistanceWrapper()
+            dist_wrapper.fit(user_profiles)
+            self.set_dist_func(dist_wrapper=dist_wrapper)
+        self._encoded_profiles = None
         # state informaiton to track update
         self._update_status = True
         # user-related information
         self._user_ids = user_ids
+        self._user_index = UserIdIndex(user_ids)
         self._user_profiles = user_profiles
         self._target_user_ids = target_user_ids
-        # user-pair-wise distance related info.
-        self._dist_user_pairs = []
-        self._dist_matrix = []
-
-        self._all_pairs = []
+        self._user_ids_array = None
         if target_user_ids is None:
-            self._all_pairs = combinations(user_ids, 2)
+            self._target_rows = None
+            self._target_index = None
         else:
-            for a_uid in target_user_ids:
-                for b_uid in user_ids:
-                    if a_uid != b_uid:
-                        self._all_pairs.append((a_uid, b_uid))
+            self._target_rows = self._user_index.rows(target_user_ids)
+            self._target_index = {uid: ii for ii, uid in enumerate(target_user_ids)}
+        # user-pair-wise distance related info.
+        self._dtype = np.dtype(dtype)
+        self._block_size = block_size
+        self._mmap_path = mmap_path
+        self._dist_user_pairs = _CondensedPairs(self)
+        self._dist_matrix = np.empty(0, dtype=self._dtype)
+
+    def set_dist_func(self, dist_func=None, dist_wrapper=None):
+        """ redefine the distance metric function
 
-    def set_dist_func(self, dist_func):
-        """ redefine the distance metric function """
+        Parameters:
+        ===========
+        dist_func: <function> distance of two profiles, computed pair by pair
+        dist_wrapper: <GeneralDistanceWrapper> wrapper whose weighted
+            euclidean distance is used instead of dist_func, distances are
+            computed in blocks over encoded profiles
+        """
+        if not dist_wrapper is None:
+            dist_func = dist_wrapper.dist_euclidean
         self._dist_func = dist_func
+        self._dist_wrapper = dist_wrapper
+        self._update_status = True
+
+    def _get_block_func(self):
+        """ return (function(rows_a, rows_b) computing a block of distances,
+            boolean whether the block holds squared distances)
+        """
+        if not self._dist_wrapper is None:
+            self._encoded_profiles = self._dist_wrapper.encode(self._user_profiles)
+            return self._dist_wrapper.project(self._encoded_profiles).sq_dist_block, True
+
+        user_profiles = self._user_profiles
+        dist_func = self._dist_func
+
+        def block_func(rows_a, rows_b):
+            n_users = len(user_profiles)
+            rows_a, rows_b = _as_rows(rows_a, n_users), _as_rows(rows_b, n_users)
+            return np.array([[dist_func(user_profiles[a, :], user_profiles[b, :]) for b in rows_b]
+                             for a in rows_a], dtype=np.float64).reshape(len(rows_a), len(rows_b))
+        return block_func, False
+
+    def _get_block_rows(self, n_cols):
+        if self._block_size is None:
+            return max(1, _BLOCK_ELEMENTS // max(n_cols, 1))
+        return self._block_size
+
+    def _alloc_dist_matrix(self, size):
+        """ allocate storage of distance matrix, memory-mapped .npy file
+            is created next to mmap_path and moved in place once it is filled
+        """
+        if self._mmap_path is None:
+            return np.empty(size, dtype=self._dtype)
+        return np.lib.format.open_memmap(_tmp_path(self._mmap_path), mode='w+',
+                                         dtype=self._dtype, shape=(size,))
+
+    def update_distance_matrix(self, n_jobs=1):
+        """ update the distance matrix
+
+        Parameters:
+        ----------
+        * n_jobs: <integer> number of worker processes filling row blocks of
+            the matrix, -1 to use all CPUs. workers write into a shared
+            memory (or the memory-mapped file) directly.
+        """
+        if self._user_profiles is None:
+            raise ValueError("user_profiles are not loaded, distance matrix can not be calculated!")
+
+        block_func, is_squared = self._get_block_func()
+        n_users = len(self._user_ids)
+        block_rows = self._get_block_rows(n_users)
+        if self._target_rows is None:
+            size = n_users * (n_users - 1) // 2
+            blocks = [(start, min(start + block_rows, n_users)) for start in range(1, n_users, block_rows)]
+        else:
+            size = len(self._target_rows) * (n_users - 1)
+            blocks = [(start, min(start + block_rows, len(self._target_rows)))
+                      for start in range(0, len(self._target_rows), block_rows)]
+
+        n_jobs = _get_n_jobs(n_jobs, len(blocks))
+        if n_jobs > 1 and self._dist_wrapper is None:
+            warnings.warn("customized distance function is computed in a single process!")
+            n_jobs = 1
 
-    def update_distance_matrix(self):
-        """ update the distance matrix """
-        # is_update = function() change
-        all_pairs = self._all_pairs
-        dist_user_pairs = []
-        dist_containers = []
-        for user_a, user_b in all_pairs:
-            idx_a, idx_b = self._user_ids.index(user_a), self._user_ids.index(user_b)
-            profile_a, profile_b = self._user_profiles[idx_a, :], self._user_profiles[idx_b, :]
-            pair_dist = self._dist_func( profile_a, profile_b )
-            dist_user_pairs.append( [user_a, user_b] )
-            dist_containers.append( pair_dist )
-
-        self._dist_user_pairs = dist_user_pairs
-        self._dist_matrix = dist_containers
+        if n_jobs == 1:
+            dist_matrix = self._alloc_dist_matrix(size)
+            for start, stop in blocks:
+                _fill_block(dist_matrix, block_func, is_squared, self._target_rows, start, stop)
+        else:
+            dist_matrix = self._fill_parallel(size, blocks, block_func, is_squared, n_jobs)
+
+        if not self._mmap_path is None:
+            dist_matrix.flush()
+            # readers of the previous file keep their mapping of it
+            os.replace(_tmp_path(self._mmap_path), self._mmap_path)
+            self._write_meta(self._mmap_path)
+        self._dist_matrix = dist_matrix
         # swith update status after refreshing distance matrix
         self._update_status = False
 
+    def update_users(self, user_profiles, changed_user_ids=None, new_user_ids=None,
+                     copy_on_write=False):
+        """ update the distance matrix with the changed profiles of existing
+            users and/or new users appended to user_ids. only the distances
+            involving changed or new users are recalculated.
+
+            Cost: recalculation is O(N * (n_changed + n_new)). Without new
+            users, the changed distances are written in place, in memory or
+            in the memory-mapped file. New users grow the matrix, which is
+            copied to new storage: O(N^2) memory or file I/O. With mmap_path
+            and copy_on_write, the file is always copied and moved in place
+            once the update is done, so readers of the file never see a
+            partial update, at the O(N^2) I/O cost; otherwise readers mapping
+            the file see the distances change while they are written.
+
+        Parameters:
+        ----------
+        * user_profiles: <matrix-like> profiles of all users, ordered as
+            user_ids followed by new_user_ids
+        * changed_user_ids: <list> existing users whose profiles changed
+        * new_user_ids: <list> users to append
+        * copy_on_write: <boolean> with mmap_path, write the update to a copy
+            of the file even if no user is added
+
+        Returns:
+        -------
+        * self
+        """
+        if self._update_status:
+            raise ValueError("distance matrix is outdated, call .update_distance_matrix() first!")
+
+        if isinstance(user_profiles, DataFrame):
+            user_profiles = user_profiles.as_matrix()
+        changed_user_ids = [] if changed_user_ids is None else changed_user_ids
+        new_user_ids = [] if new_user_ids is None else new_user_ids
+
+        n_old = len(self._user_ids)
+        n_users = n_old + len(new_user_ids)
+        if user_profiles.shape[0] != n_users:
+            raise ValueError("user_profiles (nrow: {}) does not match user_ids with new_user_ids (nobs: {})".format(
+                user_profiles.shape[0], n_users))
+        for uid in new_user_ids:
+            if uid in self._user_index:
+                raise ValueError("new user_id (:{}) is already included in data!".format(uid))
+        for uid in changed_user_ids:
+            if not uid in self._user_index:
+                raise ValueError("user_id (:{}) is not included in data!".format(uid))
+
+        # register new users
+        if len(new_user_ids) > 0:
+            self._user_ids = list(self._user_ids) + list(new_user_ids)
+            self._user_index.append(new_user_ids)
+            self._user_ids_array = None
+        self._user_profiles = user_profiles
+
+        block_func, is_squared = self._get_block_func()
+        changed_rows = np.unique(self._user_index.rows(changed_user_ids))
+        block_rows = self._get_block_rows(n_users)
+
+        if self._target_rows is None:
+            dist_matrix = self._resize_dist_matrix(n_users * (n_users - 1) // 2, n_old, copy_on_write)
+            for start in range(0, len(changed_rows), block_rows):
+                rows = changed_rows[start:start + block_rows]
+                # new users are covered by their own rows below
+                block = block_func(rows, slice(0, n_old))
+                if is_squared:
+                    np.sqrt(block, out=block)
+                for ii, row in enumerate(rows):
+                    offset = _tri_offset(row)
+                    dist_matrix[offset:offset + row] = block[ii, :row]
+                    rows_after = np.arange(row + 1, n_old, dtype=np.intp)
+                    dist_matrix[_tri_offset(rows_after) + row] = block[ii, row + 1:]
+            for start in range(max(n_old, 1), n_users, block_rows):
+                _fill_block(dist_matrix, block_func, is_squared, None, start, min(start + block_rows, n_users))
+        else:
+            n_targets = len(self._target_rows)
+            dist_matrix = self._resize_dist_matrix(n_targets * (n_users - 1), n_old, copy_on_write)
+            # columns of changed users and new users in every target row
+            cols = np.concatenate((changed_rows, np.arange(n_old, n_users, dtype=np.intp)))
+            if len(cols) > 0:
+                for start in range(0, n_targets, block_rows):
+                    rows = self._target_rows[start:start + block_rows]
+                    block = block_func(rows, cols)
+                    if is_squared:
+                        np.sqrt(block, out=block)
+                    for ii, row in enumerate(rows):
+                        keep = cols != row
+                        offset = (start + ii) * (n_users - 1)
+                        dist_matrix[offset + cols[keep] - (cols[keep] > row)] = block[ii, keep]
+            # rows of changed target users
+            changed_targets = np.flatnonzero(np.isin(self._target_rows, changed_rows))
+            for ii in changed_targets:
+                _fill_block(dist_matrix, block_func, is_squared, self._target_rows, ii, ii + 1)
+
+        if not self._mmap_path is None:
+            dist_matrix.flush()
+            if not dist_matrix is self._dist_matrix:
+                os.replace(_tmp_path(self._mmap_path), self._mmap_path)
+            self._write_meta(self._mmap_path)
+        self._dist_matrix = dist_matrix
+        return self
+
+    def _resize_dist_matrix(self, size, n_old, copy_on_write=False):
+        """ return distance matrix of size, carrying over distances among
+            the first n_old users. matrix of unchanged size is updated in
+            place, unless a memory-mapped matrix is copied on write: it is
+            copied to a new file to keep it consistent for readers until
+            the update is done.
+        """
+        old_matrix = self._dist_matrix
+        if len(old_matrix) == size and (self._mmap_path is None or not copy_on_write):
+            if not old_matrix.flags.writeable:
+                # matrix loaded read-only, mapped again for writing
+                self._dist_matrix = old_matrix = np.load(self._mmap_path, mmap_mode='r+')
+            return old_matrix
+
+        dist_matrix = self._alloc_dist_matrix(size)
+        if self._target_rows is None:
+            # rows of new users are appended to lower-triangular order
+            dist_matrix[:len(old_matrix)] = old_matrix
+        else:
+            n_targets, n_cols = len(self._target_rows), size // max(len(self._target_rows), 1)
+            # columns of new users are appended to every target row
+            dist_matrix.reshape(n_targets, n_cols)[:, :n_old - 1] = old_matrix.reshape(n_targets, n_old - 1)
+        return dist_matrix
+
+    def _fill_parallel(self, size, blocks, block_func, is_squared, n_jobs):
+        """ fill distance matrix by a pool of worker processes, the blocks of
+            distances are written to the output buffer in place
+        """
+        if self._mmap_path is None:
+            shm = shared_memory.SharedMemory(create=True, size=max(size * self._dtype.itemsize, 1))
+            buffer_spec = ("shm", shm.name, size, self._dtype.str)
+        else:
+            # allocate the .npy file for workers to map it with mode 'r+'
+            self._alloc_dist_matrix(size).flush()
+            buffer_spec = ("mmap", _tmp_path(self._mmap_path))
+
+        try:
+            initargs = (buffer_spec, block_func, is_squared, self._target_rows)
+            with multiprocessing.Pool(n_jobs, initializer=_init_worker, initargs=initargs) as pool:
+                for _ in pool.imap_unordered(_fill_worker_block, blocks):
+                    pass
+
+            if self._mmap_path is None:
+                return np.ndarray(size, dtype=self._dtype, buffer=shm.buf).copy()
+            return np.load(_tmp_path(self._mmap_path), mmap_mode='r+')
+        finally:
+            if self._mmap_path is None:
+                shm.close()
+                shm.unlink()
+
+    def save(self, path):
+        """ save the distance matrix to .npy file (path), user ids are saved
+            into a sidecar .json file. the saved matrix is loaded with
+            PairwiseDistMatrix.load(path)
+        """
+        if self._update_status:
+            raise ValueError("distance matrix is outdated, call .update_distance_matrix() first!")
+        if not self._mmap_path is None and os.path.abspath(path) == os.path.abspath(self._mmap_path):
+            self._dist_matrix.flush()
+        else:
+            np.save(path, self._dist_matrix)
+        self._write_meta(path)
+
+    @classmethod
+    def load(cls, path, user_profiles=None, mmap_mode='r'):
+        """ load distance matrix saved by .save(path) or built with mmap_path
+
+        Parameters:
+        ----------
+        * path: <string> path of .npy file
+        * user_profiles: <matrix-like> user profiles, required by
+            .update_distance_matrix() only
+        * mmap_mode: <string> mode of numpy.memmap, None to read the matrix
+            into memory
+
+        Returns:
+        -------
+        * PairwiseDistMatrix
+        """
+        with open(_meta_path(path), 'r') as f:
+            meta = json.load(f)
+        dist_matrix = np.load(path, mmap_mode=mmap_mode)
+        pdm = cls(meta["user_ids"], user_profiles, meta["target_user_ids"],
+                  dtype=dist_matrix.dtype, mmap_path=path if mmap_mode else None)
+        pdm._dist_matrix = dist_matrix
+        pdm._update_status = False
+        return pdm
+
+    def _write_meta(self, path):
+        meta = {"user_ids": _to_json_ids(self._user_ids),
+                "target_user_ids": None if self._target_user_ids is None else \
+                    _to_json_ids(self._target_user_ids),
+                "dtype": self._dtype.name}
+        with open(_meta_path(path), 'w') as f:
+            json.dump(meta, f)
+
+    def _pair_rows(self, k):
+        """ return row indices (row_a, row_b) of k-th stored distance """
+        n_users = len(self._user_ids)
+        if self._target_rows is None:
+            row_b = int((1 + np.sqrt(1 + 8 * k)) // 2)
+            # guard floating point rounding of the triangular root
+            while _tri_offset(row_b) > k:
+                row_b -= 1
+            while _tri_offset(row_b + 1) <= k:
+                row_b += 1
+            return k - _tri_offset(row_b), row_b
+        else:
+            row_a = int(self._target_rows[k // (n_users - 1)])
+            row_b = k % (n_users - 1)
+            if row_b >= row_a:
+                row_b += 1
+            return row_a, row_b
+
+    def get_user_dist(self, user_id):
+        """ return distances between user (user_id) and all the other users,
+            the counterpart users are ordered as in user_ids. the row is
+            located by index arithmetic on the condensed matrix, no scan
+            over user pairs is involved.
+
+        Parameters:
+        ----------
+        * user_id: <string or integer>
+
+        Returns:
+        -------
+        * (user_ids <numpy.ndarray>, distance <numpy.ndarray>)
+        """
+        row = self._get_user_row(user_id)
+        n_users = len(self._user_ids)
+        if self._target_rows is None:
+            offset = _tri_offset(row)
+            dists = np.empty(n_users - 1, dtype=self._dtype)
+            # (row, j), j < row, are stored contiguously
+            dists[:row] = self._dist_matrix[offset:offset + row]
+            # (j, row), j > row, are stored one per lower-triangular row
+            rows_after = np.arange(row + 1, n_users, dtype=np.intp)
+            dists[row:] = self._dist_matrix[_tri_offset(rows_after) + row]
+        else:
+            offset = self._target_index[user_id] * (n_users - 1)
+            dists = self._dist_matrix[offset:offset + n_users - 1]
+        user_ids = self._get_user_ids_array()
+        return np.concatenate((user_ids[:row], user_ids[row + 1:])), dists
+
+    def get_distance(self, user_a, user_b):
+        """ return distance between user_a and user_b """
+        row_a, row_b = self._get_user_row(user_a), self._user_index.get(user_b)
+        if row_b is None:
+            raise ValueError("user_id (:{}) is not included in data!".format(user_b))
+        if row_a == row_b:
+            return 0.0
+        if self._target_rows is None:
+            row_a, row_b = max(row_a, row_b), min(row_a, row_b)
+            return float(self._dist_matrix[_tri_offset(row_a) + row_b])
+        n_users = len(self._user_ids)
+        offset = self._target_index[user_a] * (n_users - 1)
+        return float(self._dist_matrix[offset + row_b - (row_b > row_a)])
+
     def list_all_dist(self, user_id):
         """list distance involving user (user_id)
 
@@ -83,28 +448,125 @@ class PairwiseDistMatrix(object):
         -------
         * (user_ids <list>, distance <list>)
         """
-        if not user_id in self._user_ids:
+        cnu_ids, pair_dist = self.get_user_dist(user_id)
+        return cnu_ids.tolist(), pair_dist.tolist()
+
+    def _get_user_row(self, user_id):
+        """ return row index of user_id, validated for access to distances """
+        if not user_id in self._user_index:
             raise ValueError("user_id (:{}) is not included in data!".format(user_id))
 
         if not self._target_user_ids is None:
-            if not user_id in self._target_user_ids:
+            if not user_id in self._target_index:
                 raise ValueError("user_id (:{})is not in target_user_ids!".format(user_id))
 
-        # collect index of user-pair whose first user is target user
-        idx_b = [ ii for ii, pp in enumerate(self._dist_user_pairs) if pp[0]==user_id ]
-        user_id_b = [ pp[1] for pp in self._dist_user_pairs if pp[0]==user_id ]
+        if self._update_status:
+            raise ValueError("distance matrix is outdated, call .update_distance_matrix() first!")
+        return self._user_index[user_id]
 
-        if not self._target_user_ids is None:
-            # collect index of user-pair whose second user is target user
-            idx_a = [ ii for ii, pp in enumerate(self._dist_user_pairs) if pp[1]==user_id ]
-            user_id_a = [ pp[0] for pp in self._dist_user_pairs if pp[1]==user_id ]
-        else:
-            idx_a = []
-            user_id_a = []
+    def _get_user_ids_array(self):
+        if self._user_ids_array is None:
+            self._user_ids_array = np.asarray(self._user_ids)
+        return self._user_ids_array
+
+
+class _CondensedPairs(object):
+    """ read-only sequence of [user_a, user_b] aligned with the condensed
+        distance matrix, pairs are derived from positions on access
+    """
+
+    def __init__(self, dist_matrix):
+        self._pdm = dist_matrix
+
+    def __len__(self):
+        return len(self._pdm._dist_matrix)
+
+    def __getitem__(self, k):
+        if k < 0:
+            k += len(self)
+        if k < 0 or k >= len(self):
+            raise IndexError("pair index out of range")
+        row_a, row_b = self._pdm._pair_rows(k)
+        user_ids = self._pdm._user_ids
+        return [user_ids[row_a], user_ids[row_b]]
+
+
+def _as_rows(rows, n_rows):
+    """ expand slice of rows into row indices of n_rows rows """
+    if isinstance(rows, slice):
+        return range(*rows.indices(n_rows))
+    return rows
+
+
+def _tri_offset(row):
+    """ position of the first distance of row in lower-triangular order """
+    return row * (row - 1) // 2
+
+
+def _fill_block(dist_matrix, block_func, is_squared, target_rows, start, stop):
+    """ compute and store the distances of rows [start, stop) of the
+        condensed matrix, the rows are indices into target_rows if given
+    """
+    if target_rows is None:
+        block = block_func(slice(start, stop), slice(0, stop))
+        # rows [start, stop) occupy one contiguous lower-triangular segment
+        for row in range(start, stop):
+            offset = _tri_offset(row)
+            dist_matrix[offset:offset + row] = block[row - start, :row]
+        segment = dist_matrix[_tri_offset(start):_tri_offset(stop)]
+    else:
+        rows = target_rows[start:stop]
+        block = block_func(rows, slice(None))
+        n_users = block.shape[1]
+        # drop the distance of target user to itself
+        for ii, row in enumerate(rows):
+            offset = (start + ii) * (n_users - 1)
+            dist_matrix[offset:offset + row] = block[ii, :row]
+            dist_matrix[offset + row:offset + n_users - 1] = block[ii, row + 1:]
+        segment = dist_matrix[start * (n_users - 1):stop * (n_users - 1)]
+    if is_squared:
+        np.sqrt(segment, out=segment)
+
+
+# state of worker processes filling distance matrix in parallel
+_worker_state = {}
+
+
+def _init_worker(buffer_spec, block_func, is_squared, target_rows):
+    if buffer_spec[0] == "shm":
+        _, name, size, dtype = buffer_spec
+        shm = shared_memory.SharedMemory(name=name)
+        dist_matrix = np.ndarray(size, dtype=np.dtype(dtype), buffer=shm.buf)
+        # keep the shared memory referenced by the worker
+        _worker_state["shm"] = shm
+    else:
+        dist_matrix = np.load(buffer_spec[1], mmap_mode='r+')
+    _worker_state["args"] = (dist_matrix, block_func, is_squared, target_rows)
+
+
+def _fill_worker_block(block):
+    dist_matrix, block_func, is_squared, target_rows = _worker_state["args"]
+    _fill_block(dist_matrix, block_func, is_squared, target_rows, block[0], block[1])
+
+
+def _get_n_jobs(n_jobs, n_blocks):
+    if n_jobs is None or n_jobs == 0:
+        n_jobs = 1
+    if n_jobs < 0:
+        n_jobs = max(1, (multiprocessing.cpu_count() or 1) + 1 + n_jobs)
+    return max(1, min(n_jobs, n_blocks))
+
+
+def _meta_path(path):
+    """ path of the sidecar .json file of a saved distance matrix """
+    return os.path.splitext(path)[0] + ".meta.json"
+
+
+def _tmp_path(path):
+    root, ext = os.path.splitext(path)
+    return root + ".tmp" + ext
 
-        # counter part user_ids
-        cnu_ids = user_id_a + user_id_b
-        idx = idx_a + idx_b
-        pair_dist = [ self._dist_matrix[ii] for ii in idx ]
-        return cnu_ids, pair_dist
 
+def _to_json_ids(user_ids):
+    """ convert user ids (including numpy scalars) to json-serializable list """
+    return [uid.item() if isinstance(uid, np.generic) else uid for uid in user_ids]
@@ -0,0 +1,100 @@
+""" Hashed index mapping user ids to rows of user profiles
+Author: Yi Zhang <beingzy@gmail.com>
+Date: 2016/05/26
+"""
+import numpy as np
+
+
+class UserIdIndex(object):
+    """ map unique user ids to their row positions in user_ids
+
+    Example:
+    --------
+    user_index = UserIdIndex(user_ids)
+    row = user_index[user_id]
+    rows = user_index.rows(["a", "c", "d"])
+    """
+
+    def __init__(self, user_ids):
+        self._user_ids = list(user_ids)
+        self._index = {uid: ii for ii, uid in enumerate(self._user_ids)}
+        if len(self._index) != len(self._user_ids):
+            raise ValueError("user_ids are not unique!")
+        self._ids_array = None
+        # sorted ids for vectorized look-up, built on demand
+        self._is_sorted = False
+        self._sorted_ids = None
+        self._sorted_rows = None
+
+    def __len__(self):
+        return len(self._user_ids)
+
+    def __contains__(self, user_id):
+        return user_id in self._index
+
+    def __getitem__(self, user_id):
+        try:
+            return self._index[user_id]
+        except KeyError:
+            raise ValueError("user_id (:{}) is not included in data!".format(user_id))
+
+    def get(self, user_id, default=None):
+        return self._index.get(user_id, default)
+
+    def get_user_ids(self):
+        return self._user_ids
+
+    def ids(self, rows):
+        """ translate rows into a numpy.ndarray (dtype: object) of user ids """
+        if self._ids_array is None or len(self._ids_array) != len(self._user_ids):
+            self._ids_array = np.empty(len(self._user_ids), dtype=object)
+            self._ids_array[:] = self._user_ids
+        return self._ids_array[rows]
+
+    def append(self, user_ids):
+        """ add new user ids after the existing ones """
+        for uid in user_ids:
+            if uid in self._index:
+                raise ValueError("user_id (:{}) is already included in data!".format(uid))
+            self._index[uid] = len(self._user_ids)
+            self._user_ids.append(uid)
+        self._is_sorted = False
+        self._sorted_ids = None
+        self._sorted_rows = None
+
+    def rows(self, user_ids):
+        """ translate user ids into a numpy.ndarray of rows
+
+        Parameters:
+        ----------
+        * user_ids: <vector-like> user ids, all must be included in the index
+
+        Returns:
+        -------
+        * rows: <numpy.ndarray, int>
+        """
+        user_ids = np.asarray(user_ids)
+        if len(user_ids) == 0:
+            return np.empty(0, dtype=np.intp)
+
+        self._build_sorted()
+        if not self._sorted_ids is None and user_ids.dtype.kind == self._sorted_ids.dtype.kind:
+            # binary search on sorted ids
+            pos = np.searchsorted(self._sorted_ids, user_ids)
+            pos[pos == len(self._sorted_ids)] = 0
+            is_found = self._sorted_ids[pos] == user_ids
+            if not is_found.all():
+                missing = user_ids[~is_found][0]
+                raise ValueError("user_id (:{}) is not included in data!".format(missing))
+            return self._sorted_rows[pos]
+        return np.fromiter((self[uid] for uid in user_ids), dtype=np.intp, count=len(user_ids))
+
+    def _build_sorted(self):
+        """ sort user ids of homogeneous integer or string type """
+        if self._is_sorted:
+            return
+        self._is_sorted = True
+        user_ids = np.asarray(self._user_ids)
+        if user_ids.dtype.kind in 'iuU':
+            self._sorted_rows = np.argsort(user_ids, kind='mergesort')
+            self._sorted_ids = user_ids[self._sorted_rows]
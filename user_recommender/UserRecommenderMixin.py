@@ -2,6 +2,12 @@
 Author: Yi Zhang <beingzy@gmail.com>
 Date: 2016/02/20
 """
+from .UserIdIndex import UserIdIndex
+from .CandidateCursor import CandidateCursor
+
+# number of distances computed per block of batched queries
+_BATCH_BLOCK_ELEMENTS = 1 << 20
+
 
 class UserRecommenderMixin(object):
 
@@ -10,6 +16,7 @@ class UserRecommenderMixin(object):
             self.load_user_ids(kwargs["user_ids"])
         else:
             self._user_ids = None
+            self._user_index = None
 
         if "user_profiles" in kwargs.keys():
             self.load_user_profiles(kwargs["user_profiles"])
@@ -20,6 +27,8 @@ class UserRecommenderMixin(object):
             self.load_user_connections(kwargs["user_connections"])
         else:
             self._user_connections = None
+            self._user_successors = {}
+            self._user_predecessors = {}
         # the recomemndation size (the number of suggestions per query)
         self._size = 5
 
@@ -34,6 +43,8 @@ class UserRecommenderMixin(object):
     def load_user_ids(self, value):
         """load a list of unque user ids"""
         self._user_ids = value
+        # hashed index of user id to row of user_profiles
+        self._user_index = UserIdIndex(value)
 
     def load_user_profiles(self, value):
         """load matrix-like user-profile (ordered by user id)"""
@@ -42,6 +53,23 @@ class UserRecommenderMixin(object):
     def load_user_connections(self, value):
         """load pair-wise connection"""
         self._user_connections = value
+        # adjacency of users: {user_id: set of connected user ids}
+        self._user_successors = {}
+        self._user_predecessors = {}
+        if not value is None:
+            self._index_connections(value)
+
+    def _index_connections(self, user_connections):
+        """ add pair-wise connections [[uid_a, uid_b], ...] to adjacency """
+        for uid_a, uid_b in user_connections:
+            self._user_successors.setdefault(uid_a, set()).add(uid_b)
+            self._user_predecessors.setdefault(uid_b, set()).add(uid_a)
+
+    def get_connected_users(self, user_id):
+        """ return a list of user who are connceted with the target user"""
+        b_user_ids = self._user_successors.get(user_id, set())
+        a_user_ids = self._user_predecessors.get(user_id, set())
+        return list(b_user_ids | a_user_ids)
 
     def update_iteration(self):
         self._iter_counter += 1
@@ -51,3 +79,49 @@ class UserRecommenderMixin(object):
 
     def gen_suggestion(self, user_id):
         pass
+
+    def gen_suggestions_batch(self, user_ids):
+        """ generate recommendations for many users at once, it is
+            equivalent to calling gen_suggestion() per user in order.
+
+        Parameters:
+        ----------
+        * user_ids: <list> target users
+
+        Returns:
+        -------
+        * suggestions: <list> suggestion list per user of user_ids
+        """
+        return [self.gen_suggestion(uid) for uid in user_ids]
+
+    def _get_blocked_rows(self, block_list):
+        """ return rows of known users of block_list """
+        return self._user_index.rows([uid for uid in set(block_list) if uid in self._user_index])
+
+    def _rank_candidates(self, query_rows, block_lists, weighted_profiles, size):
+        """ return CandidateCursor per query user, ranking all users but the
+            blocked ones. distances are computed as blocks of query users and
+            the first size candidates of every cursor are ranked from them.
+
+        Parameters:
+        ----------
+        * query_rows: <numpy.ndarray> rows of query users
+        * block_lists: <list> list of blocked user ids per query user
+        * weighted_profiles: <WeightedProfiles> profiles projected under
+            the weights shared by query users
+        * size: <integer> number of candidates ranked ahead
+        """
+        n_users = len(self._user_index)
+        chunk_size = max(1, _BATCH_BLOCK_ELEMENTS // max(n_users, 1))
+
+        cursors = []
+        for start in range(0, len(query_rows), chunk_size):
+            rows = query_rows[start:start + chunk_size]
+            dist_block = weighted_profiles.dist_block(rows)
+            for ii, block_list in enumerate(block_lists[start:start + chunk_size]):
+                cursor = CandidateCursor.from_profiles(self._user_index, weighted_profiles, rows[ii],
+                                                       self._get_blocked_rows(block_list), dist_block[ii])
+                # rank ahead so the block row is released
+                cursor.prefetch(size)
+                cursors.append(cursor)
+        return cursors
@@ -1,9 +1,17 @@
+from .UserIdIndex import UserIdIndex
 from .UserRecommenderMixin import UserRecommenderMixin
 from .PairwiseDistMatrix import PairwiseDistMatrix
+from .CandidateCursor import CandidateCursor
+from .CandidateStore import CandidateStore
+from .CandidateIndex import IVFCandidateIndex
 from .NNUserRecommender import NNUserRecommender
 from .GWDUserRecommender import GWDUserRecommender
 
-__all__ = ["UserRecommenderMixin",
+__all__ = ["UserIdIndex",
+           "UserRecommenderMixin",
            "PairwiseDistMatrix",
+           "CandidateCursor",
+           "CandidateStore",
+           "IVFCandidateIndex",
            "NNUserRecommender",
            "GWDUserRecommender"]
@@ -0,0 +1,76 @@
+""" unit-test for candidate cursor
+Author: Yi Zhang <beingzy@gmail.com>
+Date: 2016/05/24
+"""
+import unittest
+import numpy as np
+from user_recommender import CandidateCursor, CandidateStore, UserIdIndex
+from distance_metrics import GeneralDistanceWrapper
+
+
+class TestCandidateCursor(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self._cand_user_ids = ["u{}".format(ii) for ii in range(100)]
+        # rounded distances to include ties
+        self._cand_user_dist = np.round(rng.rand(100), 1)
+
+    def test_match_stable_sort(self):
+        """ test paging agrees with stable sort of candidates """
+        sorted_list = sorted(zip(self._cand_user_ids, self._cand_user_dist), key=lambda pp: pp[1])
+        sorted_cand_uids = [uid for uid, _ in sorted_list]
+
+        cursor = CandidateCursor(self._cand_user_ids, self._cand_user_dist)
+        paged_uids = []
+        for size in [1, 5, 3, 20, 7, 100]:
+            paged_uids.extend(cursor.next(size))
+        self.assertEqual(paged_uids, sorted_cand_uids)
+        self.assertEqual(len(cursor), 0)
+        self.assertEqual(cursor.next(5), [])
+
+    def test_len_and_peek(self):
+        cursor = CandidateCursor(self._cand_user_ids, self._cand_user_dist)
+        peeked = cursor.peek(5)
+        self.assertEqual(cursor.next(5), peeked)
+        self.assertEqual(len(cursor), 95)
+        self.assertEqual(len(cursor.peek()), 95)
+
+    def test_from_profiles(self):
+        """ test cursor ranking projected profiles agrees with given distances """
+        rng = np.random.RandomState(1)
+        profiles = np.round(rng.rand(100, 3), 1)
+        gd_wrapper = GeneralDistanceWrapper()
+        gd_wrapper.fit(profiles)
+        gd_wrapper.load_weights([1.0, 0.5, 2.0])
+        encoded = gd_wrapper.encode(profiles)
+        weighted = gd_wrapper.project(encoded)
+        user_index = UserIdIndex(self._cand_user_ids)
+
+        blocked_rows = [0, 7, 42]
+        keep_idx = np.setdiff1d(np.arange(100), blocked_rows)
+        dists = weighted.dist_block([0], keep_idx)[0]
+        expected = CandidateCursor([self._cand_user_ids[ii] for ii in keep_idx], dists).peek()
+
+        cursor = CandidateCursor.from_profiles(user_index, weighted, 0, blocked_rows)
+        self.assertEqual(len(cursor), 97)
+        paged_uids = []
+        for size in [5, 5, 10, 30, 100]:
+            paged_uids.extend(cursor.next(size))
+        self.assertEqual(paged_uids, expected)
+        self.assertEqual(len(set(paged_uids) & set(["u0", "u7", "u42"])), 0)
+
+    def test_store_report(self):
+        store = CandidateStore()
+        store["a"] = CandidateCursor(self._cand_user_ids, self._cand_user_dist)
+        store["b"] = CandidateCursor(self._cand_user_ids[:10], self._cand_user_dist[:10])
+        store["a"].next(5)
+        report = store.memory_report()
+        self.assertEqual(report["n_users"], 2)
+        self.assertEqual(report["n_candidates"], 105)
+        self.assertEqual(store.size("b"), 10)
+        self.assertTrue(report["nbytes"] > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
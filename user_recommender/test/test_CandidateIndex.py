@@ -0,0 +1,42 @@
+""" unit-test for approximate candidate index
+Author: Yi Zhang <beingzy@gmail.com>
+Date: 2016/05/28
+"""
+import unittest
+import numpy as np
+from distance_metrics import GeneralDistanceWrapper
+from user_recommender import IVFCandidateIndex
+
+
+class TestIVFCandidateIndex(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        user_profiles = np.empty((300, 3), dtype=object)
+        user_profiles[:, :2] = rng.rand(300, 2)
+        user_profiles[:, 2] = rng.choice(['a', 'b', 'c'], 300)
+        self._dist_wrapper = GeneralDistanceWrapper()
+        self._dist_wrapper.fit(user_profiles)
+        self._encoded_profiles = self._dist_wrapper.encode(user_profiles)
+
+    def test_full_probe_is_exact(self):
+        """ test search over all lists agrees with exhaustive search """
+        cand_index = IVFCandidateIndex(n_lists=10, n_probe=10, random_state=0)
+        cand_index.fit(self._dist_wrapper, self._encoded_profiles)
+        rows, dists = cand_index.search(5, exclude_rows=[5, 7])
+        exact_dists = self._dist_wrapper.dist_euclidean_encoded(self._encoded_profiles, 5)
+        self.assertEqual(len(rows), 298)
+        self.assertTrue(np.allclose(dists, exact_dists[rows]))
+        self.assertTrue(np.all(np.diff(dists) >= 0))
+        self.assertEqual(cand_index.recall_report(size=5)["recall"], 1.0)
+
+    def test_probe_limits_candidates(self):
+        cand_index = IVFCandidateIndex(n_lists=10, n_probe=1, n_candidates=20, random_state=0)
+        cand_index.fit(self._dist_wrapper, self._encoded_profiles)
+        rows, _ = cand_index.search(5, exclude_rows=[5])
+        self.assertTrue(len(rows) <= 20)
+        self.assertFalse(5 in rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+""" unit-test for User Recommendation System with Groupwise Distance Learning
+Author: Yi Zhang <beingzy@gmail.com>
+Date: 2016/04/05
+"""
+import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from numpy.testing import assert_allclose
+from user_recommender import GWDUserRecommender
+from distance_metrics import GeneralDistanceWrapper
+
+
+def _make_network(n_users=30, n_feats=3, seed=0):
+    """ random user profiles with a ring of friends """
+    rng = np.random.RandomState(seed)
+    user_ids = ["u%02d" % ii for ii in range(n_users)]
+    user_profiles = rng.rand(n_users, n_feats)
+    user_connections = np.array([[user_ids[ii], user_ids[(ii + 1) % n_users]]
+                                 for ii in range(n_users)])
+    return user_ids, user_profiles, user_connections
+
+
+class _ManualExecutor(object):
+    """ executor holding submitted jobs until run_all() is called """
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.jobs.append((future, fn, args))
+        return future
+
+    def run_all(self, error=None, result=None):
+        for future, fn, args in self.jobs:
+            if not error is None:
+                future.set_exception(error)
+            elif not result is None:
+                future.set_result(result)
+            else:
+                future.set_result(fn(*args))
+        self.jobs = []
+
+
+class TestGWDUserRecommender(unittest.TestCase):
+
+    def setUp(self):
+        self.user_ids, self.user_profiles, self.user_connections = _make_network()
+        self.gwd_rec = GWDUserRecommender(self.user_ids, self.user_profiles, self.user_connections,
+                                          only_init_learn=True, n_group=2, max_iter=2,
+                                          min_group_size=1, random_state=0)
+        self.gwd_rec.set_recommendation_size(3)
+        # hand-made model: u00 is in both groups, u29 is in none
+        self.fit_weights = {0: [1.0, 0.0, 0.0], 1: [0.2, 0.3, 0.5]}
+        self.fit_groups = {0: self.user_ids[:10], 1: self.user_ids[:29]}
+        self.gwd_rec._load_learned_model(self.fit_weights, self.fit_groups)
+
+    def test_user_group_position(self):
+        group_pos = self.gwd_rec._user_group_pos.tolist()
+        self.assertEqual(group_pos, [0] * 10 + [1] * 19 + [-1])
+        # first group wins for users in many groups
+        self.assertEqual(self.gwd_rec._return_user_group("u00"), 0)
+        self.assertEqual(self.gwd_rec._return_user_group("u15"), 1)
+        self.assertIsNone(self.gwd_rec._return_user_group("u29"))
+
+    def test_even_weights_for_unknown_users(self):
+        self.assertIn(None, self.gwd_rec._group_profiles)
+        gd_wrapper = GeneralDistanceWrapper()
+        gd_wrapper.fit(self.user_profiles)
+        expected = gd_wrapper.dist_euclidean(self.user_profiles[29], self.user_profiles[3])
+        assert_allclose(self.gwd_rec._get_distance("u29", "u03"), expected)
+        # no fallback is projected when every user has a group
+        self.gwd_rec._load_learned_model(self.fit_weights, {0: self.user_ids[:10],
+                                                            1: self.user_ids[10:]})
+        self.assertNotIn(None, self.gwd_rec._group_profiles)
+
+    def test_get_distance_under_group_weights(self):
+        gd_wrapper = GeneralDistanceWrapper()
+        gd_wrapper.fit(self.user_profiles)
+        for a_uid, b_uid in [("u00", "u12"), ("u05", "u20"), ("u15", "u01"), ("u28", "u03")]:
+            gid = self.gwd_rec._return_user_group(a_uid)
+            gd_wrapper.load_weights(self.fit_weights[gid])
+            a_profile = self.user_profiles[self.user_ids.index(a_uid)]
+            b_profile = self.user_profiles[self.user_ids.index(b_uid)]
+            expected = gd_wrapper.dist_euclidean(a_profile, b_profile)
+            assert_allclose(self.gwd_rec._get_distance(a_uid, b_uid), expected)
+
+
+class TestGWDUserRecommenderAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.user_ids, self.user_profiles, self.user_connections = _make_network()
+        self.executor = _ManualExecutor()
+        self.swaps = []
+        self.gwd_rec = GWDUserRecommender(self.user_ids, self.user_profiles, self.user_connections,
+                                          async_learning=True, learning_executor=self.executor,
+                                          on_model_swap=self.swaps.append, n_group=2, max_iter=2,
+                                          min_group_size=1, random_state=0)
+        self.gwd_rec.set_recommendation_size(3)
+
+    def _relearn(self, new_connections):
+        self.gwd_rec.update_iteration()
+        self.gwd_rec.add_new_connections(new_connections)
+        self.gwd_rec.update()
+
+    def test_submit_is_noop_while_learning(self):
+        self._relearn([["u00", "u15"]])
+        self._relearn([["u01", "u16"]])
+        self.assertEqual(len(self.executor.jobs), 1)
+        status = self.gwd_rec.get_learning_status()
+        self.assertTrue(status["is_learning"])
+        self.assertEqual(status["pending_iters"], 1)
+        self.assertIsNone(status["last_swap"])
+
+    def test_atomic_swap(self):
+        fit_weights = self.gwd_rec._fit_weights
+        gwd_learner = self.gwd_rec.gwd_learner
+        self._relearn([["u00", "u15"]])
+        future = self.executor.jobs[0][0]
+        # the current model keeps serving while the relearning is in flight
+        self.gwd_rec.gen_suggestion("u03")
+        self.assertIs(self.gwd_rec._fit_weights, fit_weights)
+        self.assertIs(self.gwd_rec.gwd_learner, gwd_learner)
+
+        self.executor.run_all()
+        new_learner, new_weights, new_groups, _ = future.result()
+        self.assertIsNot(new_learner, gwd_learner)
+        self.gwd_rec.gen_suggestion("u04")
+        self.assertIs(self.gwd_rec.gwd_learner, new_learner)
+        self.assertIs(self.gwd_rec._fit_weights, new_weights)
+        self.assertIs(self.gwd_rec._fit_groups, new_groups)
+        self.assertEqual(set(self.gwd_rec._group_profiles) - {None}, set(new_groups))
+
+    def test_swap_hook_payload(self):
+        self._relearn([["u00", "u15"]])
+        self.gwd_rec.update_iteration()
+        self.gwd_rec.update_iteration()
+        self.executor.run_all()
+        self.gwd_rec.gen_suggestions_batch(["u03", "u04"])
+        self.assertEqual(len(self.swaps), 1)
+        stats = self.swaps[0]
+        self.assertEqual((stats["submit_iter"], stats["swap_iter"], stats["staleness"]), (1, 3, 2))
+        self.assertGreaterEqual(stats["learn_seconds"], 0)
+        self.assertGreaterEqual(stats["latency_seconds"], stats["learn_seconds"])
+        self.assertIsNone(stats["error"])
+        status = self.gwd_rec.get_learning_status()
+        self.assertEqual(status, {"is_learning": False, "pending_iters": 0, "last_swap": stats})
+
+    def test_failing_fit_keeps_model(self):
+        fit_weights = self.gwd_rec._fit_weights
+        gwd_learner = self.gwd_rec.gwd_learner
+        self._relearn([["u00", "u15"]])
+        error = RuntimeError("fit failed")
+        self.executor.run_all(error=error)
+        # neither serving nor updating re-raises the failure
+        self.gwd_rec.gen_suggestion("u03")
+        self.assertIs(self.gwd_rec._fit_weights, fit_weights)
+        self.assertIs(self.gwd_rec.gwd_learner, gwd_learner)
+        self.assertEqual(len(self.swaps), 1)
+        self.assertIs(self.swaps[0]["error"], error)
+        self.assertIsNone(self.swaps[0]["learn_seconds"])
+        status = self.gwd_rec.get_learning_status()
+        self.assertFalse(status["is_learning"])
+        self.assertIs(status["last_swap"]["error"], error)
+        # the next update submits a new relearning
+        self._relearn([["u01", "u16"]])
+        self.assertEqual(len(self.executor.jobs), 1)
+
+    def test_swap_drops_outdated_candidates(self):
+        group_ids = list(self.gwd_rec._fit_groups.keys())
+        a_uid, b_uid = [self.gwd_rec._fit_groups[gid][0] for gid in group_ids[:2]]
+        self.gwd_rec.gen_suggestions_batch([a_uid, b_uid])
+        b_cursor = self.gwd_rec._ordered_cand_dict[b_uid]
+
+        self._relearn([["u00", "u15"]])
+        # only the weights of a_uid's group are changed by the relearning
+        new_weights = dict(self.gwd_rec._fit_weights)
+        new_weights[group_ids[0]] = [1.0, 0.0, 0.0]
+        new_groups = {gid: list(gg_user_ids) for gid, gg_user_ids in self.gwd_rec._fit_groups.items()}
+        self.executor.run_all(result=(self.gwd_rec.gwd_learner, new_weights, new_groups, 0.0))
+        self.assertTrue(self.gwd_rec.wait_learning())
+
+        self.assertNotIn(a_uid, self.gwd_rec._ordered_cand_dict)
+        self.assertIs(self.gwd_rec._ordered_cand_dict[b_uid], b_cursor)
+        # candidates are ranked again under the new weights
+        gd_wrapper = GeneralDistanceWrapper()
+        gd_wrapper.fit(self.user_profiles)
+        gd_wrapper.load_weights(new_weights[group_ids[0]])
+        a_row = self.user_ids.index(a_uid)
+        dists = gd_wrapper.dist_euclidean_batch(self.user_profiles[a_row], self.user_profiles)
+        blocked = set(self.gwd_rec.get_connected_users(a_uid)) | set(self.gwd_rec._recommended_user_dict[a_uid])
+        candidates = [self.user_ids[row] for row in np.argsort(dists, kind="mergesort")
+                      if not self.user_ids[row] in blocked and row != a_row]
+        self.assertEqual(self.gwd_rec.gen_suggestion(a_uid), candidates[:3])
+
+    def test_close_shuts_down_own_executor(self):
+        self.gwd_rec.close()
+        # executor given by the caller is left to the caller
+        self.assertIs(self.gwd_rec._learning_executor, self.executor)
+
+        self.gwd_rec._learning_executor = None
+        self._relearn([["u00", "u15"]])
+        executor = self.gwd_rec._learning_executor
+        self.assertIsInstance(executor, ThreadPoolExecutor)
+        self.gwd_rec.close()
+        self.assertIsNone(self.gwd_rec._learning_executor)
+        self.assertFalse(self.gwd_rec.get_learning_status()["is_learning"])
+        self.assertRaises(RuntimeError, executor.submit, len, [])
+
+    def test_wait_learning(self):
+        self.assertFalse(self.gwd_rec.wait_learning())
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.gwd_rec._learning_executor = executor
+            self._relearn([["u00", "u15"]])
+            self.assertTrue(self.gwd_rec.wait_learning())
+        self.assertFalse(self.gwd_rec.get_learning_status()["is_learning"])
+        self.assertEqual(len(self.swaps), 1)
+        self.assertFalse(self.gwd_rec.wait_learning())
+
+
+if __name__ == '__main__':
+    unittest.main()
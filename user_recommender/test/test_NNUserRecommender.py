@@ -47,6 +47,28 @@ class TestNNUserRecommender(unittest.TestCase):
         is_match = returned_rec == possible_rec
         self.assertTrue(is_match)
 
+    def test_gen_suggestions_batch(self):
+        """ test batched suggestions agree with per-user suggestions """
+        user_ids = self.nnrec_sys._user_ids
+        _, user_profiles, user_connections = load_test_data(getcwd())
+        seq_rec_sys = NNUserRecommender(user_ids, user_profiles, user_connections)
+        seq_rec_sys.set_recommendation_size(2)
+        query_user_ids = list(user_ids) + ['a']
+        seq_suggestions = [seq_rec_sys.gen_suggestion(uid) for uid in query_user_ids]
+        self.assertEqual(self.nnrec_sys.gen_suggestions_batch(query_user_ids), seq_suggestions)
+
+    def test_update_user_profiles(self):
+        """ test update() recalculates distances of changed users only """
+        user_profiles = self.nnrec_sys._user_profiles.copy()
+        self.nnrec_sys.update(user_profiles=user_profiles)
+        dist_matrix = self.nnrec_sys._dist_matrix
+        self.nnrec_sys.gen_suggestion('a')
+        user_profiles[1, :] = user_profiles[0, :]
+        self.nnrec_sys.update(user_profiles=user_profiles)
+        self.assertTrue(self.nnrec_sys._dist_matrix is dist_matrix)
+        self.assertEqual(len(self.nnrec_sys._ordered_cand_dict), 0)
+        self.assertAlmostEqual(dist_matrix.get_distance('a', 'b'), 0.0)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -3,11 +3,17 @@ Author: Yi Zhang <beingzy@gmail.com>
 Date: 2016/02/20
 """
 import unittest
+import os
+import shutil
+import tempfile
 from os import getcwd
+from os.path import join
+import numpy as np
 # load helpfer function
 from user_recommender.test.helper_func import load_test_data
 # import test package
 from user_recommender import PairwiseDistMatrix
+from distance_metrics import GeneralDistanceWrapper
 
 
 class TestPairwiseDistMatrix(unittest.TestCase):
@@ -62,6 +68,20 @@ class TestPairwiseDistMatrix(unittest.TestCase):
         true_dist = round(1.5136858414837358, 3)
         self.assertEqual( cal_dist, true_dist )
 
+    def test_list_all_dist_later_user(self):
+        """ test .list_all_dist covers users ahead of user_id """
+        user_list, dist_list = self.dist_matrix.list_all_dist(user_id='c')
+        self.assertEqual(len(user_list), len(self._user_ids) - 1)
+        a_idx = user_list.index('a')
+        self.assertEqual(round(dist_list[a_idx], 3), round(1.5136858414837358, 3))
+
+    def test_get_user_dist_match_distance(self):
+        """ test .get_user_dist agrees with .get_distance """
+        for user_id in self._user_ids:
+            user_list, dist_list = self.dist_matrix.get_user_dist(user_id)
+            pair_dist = [self.dist_matrix.get_distance(user_id, uid) for uid in user_list]
+            self.assertTrue(np.allclose(dist_list, pair_dist))
+
     def test_with_target_user_ids(self):
         target_user_ids = ['a', 'b']
         new_dist_matrix = PairwiseDistMatrix(self._user_ids, self._user_profiles,
@@ -69,6 +89,107 @@ class TestPairwiseDistMatrix(unittest.TestCase):
         new_dist_matrix.update_distance_matrix()
         all_dists = new_dist_matrix._dist_matrix
         self.assertEqual(len(all_dists), 8)
+        user_list, dist_list = new_dist_matrix.list_all_dist(user_id='b')
+        for uid, dist in zip(user_list, dist_list):
+            self.assertAlmostEqual(dist, self.dist_matrix.get_distance('b', uid))
+
+    def test_set_dist_wrapper(self):
+        """ test explicit dist_wrapper agrees with a function wrapping it """
+        dist_wrapper = GeneralDistanceWrapper()
+        dist_wrapper.fit(self._user_profiles)
+        dist_wrapper.load_weights([0.5] * np.asarray(self._user_profiles).shape[1])
+
+        wrapper_dist_matrix = PairwiseDistMatrix(self._user_ids, self._user_profiles)
+        wrapper_dist_matrix.set_dist_func(dist_wrapper=dist_wrapper)
+        wrapper_dist_matrix.update_distance_matrix()
+        self.assertIs(wrapper_dist_matrix._dist_wrapper, dist_wrapper)
+
+        func_dist_matrix = PairwiseDistMatrix(self._user_ids, self._user_profiles)
+        func_dist_matrix.set_dist_func(lambda a, b: dist_wrapper.dist_euclidean(a, b))
+        func_dist_matrix.update_distance_matrix()
+        self.assertIsNone(func_dist_matrix._dist_wrapper)
+        self.assertTrue(np.allclose(wrapper_dist_matrix._dist_matrix, func_dist_matrix._dist_matrix))
+
+    def test_target_user_ids_with_dist_func(self):
+        """ test target_user_ids with a distance function computed pair by pair """
+        dist_wrapper = GeneralDistanceWrapper()
+        dist_wrapper.fit(self._user_profiles)
+        new_dist_matrix = PairwiseDistMatrix(self._user_ids, self._user_profiles, ['a', 'c'])
+        new_dist_matrix.set_dist_func(lambda a, b: dist_wrapper.dist_euclidean(a, b))
+        new_dist_matrix.update_distance_matrix()
+        self.assertEqual(len(new_dist_matrix._dist_matrix), 8)
+        user_list, dist_list = new_dist_matrix.list_all_dist(user_id='c')
+        for uid, dist in zip(user_list, dist_list):
+            self.assertAlmostEqual(dist, self.dist_matrix.get_distance('c', uid))
+
+    def test_update_users(self):
+        """ test delta update agrees with rebuilt distance matrix """
+        user_profiles = np.array(self._user_profiles, dtype=object)
+        new_profiles = np.vstack((user_profiles, user_profiles[[0, 2], :]))
+        new_profiles[1, :] = user_profiles[3, :]
+        self.dist_matrix.update_users(new_profiles, changed_user_ids=['b'], new_user_ids=['f', 'g'])
+
+        new_dist_matrix = PairwiseDistMatrix(list(self._user_ids) + ['f', 'g'], new_profiles)
+        new_dist_matrix.update_distance_matrix()
+        self.assertTrue(np.allclose(self.dist_matrix._dist_matrix, new_dist_matrix._dist_matrix))
+        self.assertAlmostEqual(self.dist_matrix.get_distance('a', 'f'), 0.0)
+
+    def test_parallel_update(self):
+        """ test update_distance_matrix with worker processes """
+        par_dist_matrix = PairwiseDistMatrix(self._user_ids, self._user_profiles, block_size=1)
+        par_dist_matrix.update_distance_matrix(n_jobs=2)
+        self.assertTrue(np.allclose(par_dist_matrix._dist_matrix, self.dist_matrix._dist_matrix))
+
+    def test_mmap_save_load(self):
+        """ test memory-mapped distance matrix shared through .npy file """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            mmap_path = join(tmp_dir, "dist.npy")
+            mmap_dist_matrix = PairwiseDistMatrix(self._user_ids, self._user_profiles,
+                                                  dtype=np.float32, mmap_path=mmap_path)
+            mmap_dist_matrix.update_distance_matrix()
+            loaded = PairwiseDistMatrix.load(mmap_path)
+            self.assertTrue(isinstance(loaded._dist_matrix, np.memmap))
+            self.assertEqual(loaded._dist_matrix.dtype, np.float32)
+            user_list, dist_list = loaded.list_all_dist(user_id='a')
+            self.assertEqual(user_list, self.dist_matrix.list_all_dist(user_id='a')[0])
+            self.assertTrue(np.allclose(dist_list, self.dist_matrix.list_all_dist(user_id='a')[1]))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_mmap_update_users_in_place(self):
+        """ test delta update of memory-mapped matrix without new users is
+            written in place, unless it is copied on write
+        """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            mmap_path = join(tmp_dir, "dist.npy")
+            user_profiles = np.array(self._user_profiles, dtype=object)
+            mmap_dist_matrix = PairwiseDistMatrix(self._user_ids, user_profiles, mmap_path=mmap_path)
+            mmap_dist_matrix.update_distance_matrix()
+            file_id = os.stat(mmap_path).st_ino
+
+            new_profiles = user_profiles.copy()
+            new_profiles[1, :] = user_profiles[3, :]
+            mmap_dist_matrix.update_users(new_profiles, changed_user_ids=['b'])
+            self.assertEqual(os.stat(mmap_path).st_ino, file_id)
+            self.assertFalse(os.path.exists(join(tmp_dir, "dist.tmp.npy")))
+
+            new_dist_matrix = PairwiseDistMatrix(self._user_ids, new_profiles)
+            new_dist_matrix.update_distance_matrix()
+            loaded = PairwiseDistMatrix.load(mmap_path, user_profiles=new_profiles)
+            self.assertTrue(np.allclose(loaded._dist_matrix, new_dist_matrix._dist_matrix))
+
+            # read-only mapping is mapped again for writing
+            loaded.update_users(user_profiles, changed_user_ids=['b'])
+            self.assertEqual(os.stat(mmap_path).st_ino, file_id)
+            self.assertTrue(np.allclose(loaded._dist_matrix, self.dist_matrix._dist_matrix))
+
+            loaded.update_users(new_profiles, changed_user_ids=['b'], copy_on_write=True)
+            self.assertNotEqual(os.stat(mmap_path).st_ino, file_id)
+            self.assertTrue(np.allclose(np.load(mmap_path), new_dist_matrix._dist_matrix))
+        finally:
+            shutil.rmtree(tmp_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,37 @@
+""" unit-test for user id index
+Author: Yi Zhang <beingzy@gmail.com>
+Date: 2016/05/26
+"""
+import unittest
+import numpy as np
+from user_recommender import UserIdIndex
+
+
+class TestUserIdIndex(unittest.TestCase):
+
+    def setUp(self):
+        self._user_ids = ['d', 'a', 'c', 'b']
+        self._user_index = UserIdIndex(self._user_ids)
+
+    def test_lookup(self):
+        for ii, uid in enumerate(self._user_ids):
+            self.assertEqual(self._user_index[uid], ii)
+        self.assertFalse('e' in self._user_index)
+        with self.assertRaises(ValueError):
+            self._user_index['e']
+
+    def test_bulk_rows(self):
+        rows = self._user_index.rows(['b', 'd', 'c'])
+        self.assertTrue(np.array_equal(rows, [3, 0, 2]))
+        with self.assertRaises(ValueError):
+            self._user_index.rows(['b', 'e'])
+
+    def test_append(self):
+        self._user_index.append(['f'])
+        self.assertTrue(np.array_equal(self._user_index.rows(['f', 'a']), [4, 1]))
+        with self.assertRaises(ValueError):
+            self._user_index.append(['a'])
+
+
+if __name__ == "__main__":
+    unittest.main()